@@ -0,0 +1,142 @@
+"""Incrementally maintained A/B test aggregates behind /metrics/ab.
+
+For every group the server keeps sufficient statistics (count, sum and sum
+of squares) of each compared metric, plus per-operation counts of runs and
+errors. They are updated as records are accepted, so group means, variances
+and Welch t statistics are available at any time without reading the logs.
+The statistics are seeded once from disk at startup.
+"""
+import itertools
+import math
+import threading
+
+
+from schema import CLICK_COLUMNS, ERROR_COLUMNS, operations_of, session_metrics, to_timestamps
+
+METRICS = ["total_session_time", "total_clicked_count", "total_error_count"]
+
+
+def _empty_group():
+    return {
+        "sessions": 0,
+        "metrics": {m: {"n": 0, "sum": 0.0, "sumsq": 0.0} for m in METRICS},
+        "operations": {},
+    }
+
+
+class ABAggregates:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._groups = {}
+
+    def load(self, store):
+        """Seed the statistics from every partition on disk (once, at startup)."""
+        wanted = ["user_id", "group", "total_session_time", "session_start_time", "session_end_time"]
+        for path in store.partitions():
+            sessions = store.read(path, columns=wanted + CLICK_COLUMNS + ERROR_COLUMNS)
+            operations = store.read_operations(path)
+            self._add_frames(sessions, operations)
+
+    def update(self, key, records):
+        with self._lock:
+            for record in records:
+                group = self._group(record.get("group"))
+                group["sessions"] += 1
+                for name, value in session_metrics(record).items():
+                    if value is not None:
+                        self._add(group["metrics"][name], 1, value, value * value)
+                for op_name, error in operations_of(record):
+                    op = group["operations"].setdefault(str(op_name), {"count": 0, "errors": 0})
+                    op["count"] += 1
+                    op["errors"] += 0 if error in (None, "") or error != error else 1
+
+    def _group(self, name):
+        name = "" if name is None or name != name else str(name)
+        return self._groups.setdefault(name, _empty_group())
+
+    @staticmethod
+    def _add(stat, n, total, sumsq):
+        stat["n"] += n
+        stat["sum"] += total
+        stat["sumsq"] += sumsq
+
+    def _add_frames(self, sessions, operations):
+        import pandas as pd
+
+        if sessions.empty or "group" not in sessions.columns:
+            return
+        df = pd.DataFrame({"group": sessions["group"].fillna("").astype(str)})
+
+        def number(column):
+            if column not in sessions.columns:
+                return pd.Series(float("nan"), index=sessions.index)
+            return pd.to_numeric(sessions[column], errors="coerce")
+
+        df["total_session_time"] = number("total_session_time")
+        if "session_start_time" in sessions.columns and "session_end_time" in sessions.columns:
+            derived = to_timestamps(sessions["session_end_time"]) - to_timestamps(sessions["session_start_time"])
+            df["total_session_time"] = df["total_session_time"].fillna(derived.dt.total_seconds())
+        df["total_clicked_count"] = sum(number(c).fillna(0) for c in CLICK_COLUMNS)
+        df["total_error_count"] = sum(number(c).fillna(0) for c in ERROR_COLUMNS)
+
+        ops = None
+        if not operations.empty and "user_id" in sessions.columns:
+            # Attribute each operation to the group of its session.
+            session_groups = pd.Series(df["group"].values, index=sessions["user_id"].values)
+            session_groups = session_groups[~session_groups.index.duplicated()]
+            ops = operations.assign(group=operations["session_id"].map(session_groups).fillna(""),
+                                    failed=operations["error"].notna() & (operations["error"].astype(str) != ""))
+
+        with self._lock:
+            for name, rows in df.groupby("group"):
+                group = self._group(name)
+                group["sessions"] += len(rows)
+                for metric in METRICS:
+                    values = rows[metric].dropna()
+                    self._add(group["metrics"][metric], len(values), float(values.sum()), float((values ** 2).sum()))
+            if ops is not None:
+                for (name, op_name), rows in ops.groupby(["group", "op_name"]):
+                    op = self._group(name)["operations"].setdefault(str(op_name), {"count": 0, "errors": 0})
+                    op["count"] += len(rows)
+                    op["errors"] += int(rows["failed"].sum())
+
+    def snapshot(self):
+        with self._lock:
+            groups = {}
+            for name, group in sorted(self._groups.items()):
+                groups[name] = {
+                    "sessions": group["sessions"],
+                    "metrics": {m: _describe(s) for m, s in group["metrics"].items()},
+                    "operations": {
+                        op: dict(stats, error_rate=stats["errors"] / stats["count"] if stats["count"] else None)
+                        for op, stats in sorted(group["operations"].items())
+                    },
+                }
+
+        welch = []
+        for (a, ga), (b, gb) in itertools.combinations(groups.items(), 2):
+            for metric in METRICS:
+                t, df = _welch(ga["metrics"][metric], gb["metrics"][metric])
+                welch.append({"metric": metric, "groups": [a, b], "t": t, "df": df})
+        return {"groups": groups, "welch": welch}
+
+
+def _describe(stat):
+    n = stat["n"]
+    mean = stat["sum"] / n if n else None
+    variance = (stat["sumsq"] - stat["sum"] ** 2 / n) / (n - 1) if n > 1 else None
+    if variance is not None:
+        variance = max(variance, 0.0)  # rounding can push it slightly below zero
+    return {"n": n, "sum": stat["sum"], "mean": mean, "variance": variance}
+
+
+def _welch(a, b):
+    """Welch's t statistic and Welch-Satterthwaite degrees of freedom."""
+    if a["variance"] is None or b["variance"] is None:
+        return None, None
+    va, vb = a["variance"] / a["n"], b["variance"] / b["n"]
+    if va + vb == 0:
+        return None, None
+    t = (a["mean"] - b["mean"]) / math.sqrt(va + vb)
+    df = (va + vb) ** 2 / (va ** 2 / (a["n"] - 1) + vb ** 2 / (b["n"] - 1))
+    return t, df
@@ -0,0 +1,287 @@
+"""ASGI variant of the log server for high-concurrency ingest.
+
+Serves the same ``/``, ``/log``, ``/log/batch``, ``/status`` and ``/logs`` contract as
+server.py, on an event loop instead of Flask's threaded dev server, so
+thousands of keep-alive connections cost a coroutine each rather than a
+thread. ``/log`` only journals and queues the record (see writer.py) and the
+background writer thread does the disk work. Handlers that read files, SQLite
+or pandas state are plain functions, which Starlette runs in its threadpool,
+so they never block the event loop; ``/log`` and ``/log/batch`` read the body
+on the loop and hand the rest to the threadpool.
+
+Run with:
+
+    python asgi_server.py
+    # or: uvicorn asgi_server:app --host 0.0.0.0 --port 5000
+"""
+import contextlib
+import json
+import os
+import time
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from ingest import (MAX_BATCH_BYTES, MAX_RECORD_BYTES, RETRY_AFTER, body_too_large, close_experiments,
+                    get_experiment, group_counts, ingest_batch, ingest_record, invalid_json, list_experiments,
+                    query_logs, query_rollups, queue_status, stream_options, unique_user_counts)
+from live_status import sse_stream_async
+from metrics import CONTENT_TYPE, REQUEST_LATENCY, render
+
+
+class LogJSONResponse(JSONResponse):
+    # Like Flask's jsonify: rows read back from CSV may contain NaN.
+    def render(self, content):
+        return json.dumps(content, default=str).encode("utf-8")
+
+
+def ingest_response(payload, code):
+    headers = {"Retry-After": str(RETRY_AFTER)} if code == 429 else None
+    return LogJSONResponse(payload, status_code=code, headers=headers)
+
+
+async def read_body(request, limit):
+    """The request body, or None once it grows past limit bytes."""
+    length = request.headers.get("Content-Length")
+    if length is not None and length.isdigit() and int(length) > limit:
+        return None
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            return None
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def hello(request):
+    return PlainTextResponse(" STAT5243 Log Server is running!")
+
+
+async def receive_log(request):
+    try:
+        body = await read_body(request, MAX_RECORD_BYTES)
+        if body is None:
+            return ingest_response(*body_too_large(MAX_RECORD_BYTES))
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return ingest_response(*invalid_json())
+        # May open the experiment's storage (see ingest.get_experiment) and waits on the dedup index.
+        payload, code = await run_in_threadpool(ingest_record, data, request.headers.get("Idempotency-Key"),
+                                                request.path_params.get("name"))
+        return ingest_response(payload, code)
+    except Exception as e:
+        return LogJSONResponse({"error": str(e)}, status_code=500)
+
+
+async def receive_log_batch(request):
+    try:
+        body = await read_body(request, MAX_BATCH_BYTES)
+        if body is None:
+            return ingest_response(*body_too_large(MAX_BATCH_BYTES))
+        payload, code = await run_in_threadpool(
+            ingest_batch,
+            body,
+            request.headers.get("Content-Type", ""),
+            request.headers.get("Content-Encoding", ""),
+            request.path_params.get("name"),
+        )
+        return ingest_response(payload, code)
+    except Exception as e:
+        return LogJSONResponse({"error": str(e)}, status_code=500)
+
+
+def status(request):
+    try:
+        experiment, error = get_experiment(request.path_params.get("name"))
+        if error is not None:
+            return ingest_response(*error)
+        payload, etag = experiment.live_status.snapshot(last_n=3)
+        if payload is None:
+            return LogJSONResponse({"error": "No log files found"}, status_code=404)
+
+        etag = f'"{etag}"'
+        if_none_match = request.headers.get("If-None-Match", "")
+        if etag in (tag.strip().removeprefix("W/") for tag in if_none_match.split(",")):
+            return Response(status_code=304, headers={"ETag": etag})
+        return LogJSONResponse(payload, headers={"ETag": etag})
+    except Exception as e:
+        return LogJSONResponse({"error": str(e)}, status_code=500)
+
+
+async def metrics(request):
+    return Response(render(), headers={"Content-Type": CONTENT_TYPE})
+
+
+def experiments(request):
+    return LogJSONResponse(list_experiments())
+
+
+def partition_manifest(request):
+    experiment, error = get_experiment(request.path_params.get("name"))
+    if error is not None:
+        return ingest_response(*error)
+    return LogJSONResponse(experiment.manifest.entries())
+
+
+def queue(request):
+    experiment, error = get_experiment(request.path_params.get("name"))
+    if error is not None:
+        return ingest_response(*error)
+    return LogJSONResponse(queue_status(experiment))
+
+
+def counts(request):
+    try:
+        experiment, error = get_experiment(request.path_params.get("name"))
+        if error is not None:
+            return ingest_response(*error)
+        return ingest_response(*group_counts(experiment, request.query_params))
+    except Exception as e:
+        return LogJSONResponse({"error": str(e)}, status_code=500)
+
+
+def user_counts(request):
+    try:
+        experiment, error = get_experiment(request.path_params.get("name"))
+        if error is not None:
+            return ingest_response(*error)
+        return ingest_response(*unique_user_counts(experiment, request.query_params))
+    except Exception as e:
+        return LogJSONResponse({"error": str(e)}, status_code=500)
+
+
+def metrics_ab(request):
+    try:
+        experiment, error = get_experiment(request.path_params.get("name"))
+        if error is not None:
+            return ingest_response(*error)
+        return LogJSONResponse(experiment.ab_metrics())
+    except Exception as e:
+        return LogJSONResponse({"error": str(e)}, status_code=500)
+
+
+def rollups(request):
+    try:
+        experiment, error = get_experiment(request.path_params.get("name"))
+        if error is not None:
+            return ingest_response(*error)
+        return ingest_response(*query_rollups(experiment, request.query_params))
+    except Exception as e:
+        return LogJSONResponse({"error": str(e)}, status_code=500)
+
+
+def logs(request):
+    try:
+        experiment, error = get_experiment(request.path_params.get("name"))
+        if error is not None:
+            return ingest_response(*error)
+        chunks, mimetype, error = query_logs(experiment, request.query_params)
+        if error is not None:
+            payload, code = error
+            return LogJSONResponse(payload, status_code=code)
+        # A sync iterator is run in the threadpool, so reading the partitions never blocks the loop.
+        return StreamingResponse(chunks, media_type=mimetype)
+    except Exception as e:
+        return LogJSONResponse({"error": str(e)}, status_code=500)
+
+
+def live_stream(request):
+    experiment, error = get_experiment(request.path_params.get("name"))
+    if error is not None:
+        return ingest_response(*error)
+    options = stream_options(request.query_params, request.headers.get("Last-Event-ID"))
+    return StreamingResponse(sse_stream_async(experiment.broadcast, **options), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    # uvicorn re-raises SIGTERM after shutdown, so atexit handlers may never run.
+    close_experiments()
+
+
+class LatencyMiddleware:
+    """Observes every request in log_request_duration_seconds (see metrics.py)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started, status = time.perf_counter(), [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = route_of(scope["path"])
+            # A /stream response lasts as long as the subscriber listens; that is not a latency.
+            if not route.endswith("/stream"):
+                REQUEST_LATENCY.observe(time.perf_counter() - started,
+                                        route=route, method=scope["method"], status=status[0])
+
+
+def route_of(path):
+    """Route label of a request path, with the experiment name replaced by ``{name}``."""
+    if path in ROUTE_PATHS:
+        return path
+    if path.startswith("/experiments/"):
+        name, _, rest = path[len("/experiments/"):].partition("/")
+        if name and "/" + rest in EXPERIMENT_PATHS:
+            return "/experiments/{name}/" + rest
+    return "unmatched"
+
+
+# Each experiment's routes are also served under /experiments/<name>/...;
+# without the prefix they serve the default experiment (see ingest.py).
+experiment_routes = [
+    Route("/log", receive_log, methods=["POST"]),
+    Route("/log/batch", receive_log_batch, methods=["POST"]),
+    Route("/status", status),
+    Route("/queue", queue),
+    Route("/manifest", partition_manifest),
+    Route("/counts", counts),
+    Route("/counts/users", user_counts),
+    Route("/metrics/ab", metrics_ab),
+    Route("/rollups", rollups),
+    Route("/logs", logs),
+    Route("/stream", live_stream),
+]
+EXPERIMENT_PATHS = {route.path for route in experiment_routes}
+routes = [
+    Route("/", hello),
+    Route("/metrics", metrics),
+    Route("/experiments", experiments),
+    *experiment_routes,
+    *(Route("/experiments/{name}" + route.path, route.endpoint, methods=route.methods)
+      for route in experiment_routes),
+]
+ROUTE_PATHS = {route.path for route in routes if "{" not in route.path}
+
+app = Starlette(lifespan=lifespan, routes=routes, middleware=[Middleware(LatencyMiddleware)])
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", 5000)),
+        backlog=int(os.environ.get("LOG_BACKLOG", 4096)),
+        timeout_keep_alive=int(os.environ.get("LOG_KEEP_ALIVE", 75)),
+        access_log=False,
+        # Open /stream connections would otherwise hold up shutdown indefinitely.
+        timeout_graceful_shutdown=int(os.environ.get("LOG_SHUTDOWN_TIMEOUT", 5)),
+    )
@@ -0,0 +1,256 @@
+"""Bulk-load historical session exports into the log server's storage.
+
+Reads CSV exports (``ab_test_log_with_times2.csv``, ``session_log_*.csv``)
+and JSON files (``test_data_collection.txt``: objects separated by commas,
+with or without the enclosing brackets; NDJSON) in chunks, without going
+through HTTP. Worker processes normalize each chunk to the ingest schema:
+empty CSV fields become missing values, numbers and list columns are parsed,
+and records are validated and given the derived columns like at /log. Only
+this preparation is parallel: the main process then writes the chunks one at
+a time through the server's own bulk path (dedup, journal, partitions,
+manifest, sketches and rollups; see ingest.py), commits each and records its
+progress in a checkpoint, so an interrupted load resumes after the last
+committed chunk. Throughput is reported in rows/s.
+
+    python backfill.py ../ab_test_log_with_times2.csv ../STAT5243_project_2/test_data_collection.txt
+    python backfill.py --experiment color --workers 4 --chunk-size 5000 exports/*.csv
+    python backfill.py --restart ../ab_test_log_with_times2.csv     # ignore the checkpoint
+
+Uses the same LOG_* environment as the server. Run it while the server is
+stopped, or with LOG_SHARDED=1 so that the loader appends to its own shard
+files. Records already logged (same ``user_id``) are skipped as duplicates.
+"""
+import argparse
+import ast
+import collections
+import csv
+import json
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from schema import DERIVE_ERRORS, SESSION_SCHEMA, ValidationError, derive_metrics, validate_session
+
+# Between the objects of test_data_collection.txt-style files.
+SEPARATORS = re.compile(r"[\s,\[\]]*")
+
+
+def iter_csv(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            yield row
+
+
+def iter_json(path, block_size=1 << 20):
+    """Every top-level object of a JSON array, NDJSON or comma-separated objects, read block by block."""
+    decoder = json.JSONDecoder()
+    with open(path, encoding="utf-8") as f:
+        buffer, pos, eof = "", 0, False
+        while True:
+            pos = SEPARATORS.match(buffer, pos).end()
+            try:
+                record, pos = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                if eof:
+                    if pos < len(buffer):
+                        raise ValueError(f"{path}: cannot parse {buffer[pos:pos + 40]!r}")
+                    return
+                # An object cut off at the end of the block: read on.
+                block = f.read(block_size)
+                eof = not block
+                buffer, pos = buffer[pos:] + block, 0
+                continue
+            yield record
+
+
+def read_source(path):
+    return iter_csv(path) if path.lower().endswith(".csv") else iter_json(path)
+
+
+def normalize(record):
+    """A source row in the shape of a /log payload."""
+    normalized = {}
+    for field, value in record.items():
+        if field is None:
+            continue  # surplus cells of a ragged CSV row
+        if value == "":
+            value = None
+        elif isinstance(value, str):
+            kind = SESSION_SCHEMA.get(field, (None,))[0]
+            if kind == "timestamp" and value.isdigit():
+                value = int(value)  # epoch µs written by the server
+            elif kind in ("count", "float"):
+                try:
+                    value = float(value)  # "3" and "3.0" alike
+                except ValueError:
+                    pass  # reported by the validator
+            elif kind == "list" and value.startswith("["):
+                value = ast.literal_eval(value)  # list written to CSV as its repr
+        normalized[field] = value
+    return normalized
+
+
+def prepare(rows, first_row, experiment, validate=True, derive=True):
+    """Normalize, validate and derive one chunk (in a worker process).
+
+    Returns ``(records, errors)`` with errors as ``[(row_number, message)]``.
+    """
+    records, errors = [], []
+    for i, row in enumerate(rows, first_row):
+        try:
+            # normalize() may fail too, on a list column that is not a valid literal.
+            record = normalize(row)
+        except (ValueError, SyntaxError) as e:
+            errors.append((i, f"Cannot parse row: {e}"))
+            continue
+        named = record.pop("experiment", None)
+        if named and named != experiment:
+            errors.append((i, f"Record is for experiment {named!r}, not {experiment!r}"))
+            continue
+        try:
+            if validate:
+                record = validate_session(record)
+            # Without validation, derive_metrics is the first to see a counter like "abc".
+            records.append(derive_metrics(record) if derive else record)
+        except (ValidationError, *DERIVE_ERRORS) as e:
+            errors.append((i, str(e)))
+    return records, errors
+
+
+def chunked(rows, size, skip=0):
+    """``(first_row, rows)`` chunks of an iterator, after skipping ``skip`` rows."""
+    chunk, first = [], skip
+    for i, row in enumerate(rows):
+        if i < skip:
+            continue
+        chunk.append(row)
+        if len(chunk) == size:
+            yield first, chunk
+            chunk, first = [], i + 1
+    if chunk:
+        yield first, chunk
+
+
+class Checkpoint:
+    """Committed rows per source file, in a JSON file replaced atomically after every chunk."""
+
+    def __init__(self, path):
+        self.path = path
+        self.sources = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.sources = json.load(f)
+
+    def start(self, source):
+        """Rows of ``source`` already committed; 0 if it is new or has changed since."""
+        entry = self.sources.get(os.path.abspath(source))
+        if entry is None:
+            return 0
+        if entry["size"] != os.path.getsize(source):
+            print(f" {source} changed since the last run; loading it from the start")
+            return 0
+        return entry["rows"]
+
+    def done(self, source):
+        entry = self.sources.get(os.path.abspath(source))
+        return entry is not None and entry["done"] and entry["size"] == os.path.getsize(source)
+
+    def update(self, source, rows, done=False):
+        self.sources[os.path.abspath(source)] = {"rows": rows, "size": os.path.getsize(source), "done": done}
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.sources, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+def load(source, experiment, pool, checkpoint, chunk_size, workers, validate, derive, queue_records):
+    """Load one source file; returns ``(rows, accepted, duplicates, rejected)``."""
+    skip = checkpoint.start(source)
+    if skip:
+        print(f" Resuming {source} after row {skip}")
+    rows = accepted = duplicates = rejected = 0
+    started = time.perf_counter()
+    pending = collections.deque()
+    chunks = chunked(read_source(source), chunk_size, skip)
+
+    def submit():
+        chunk = next(chunks, None)
+        if chunk is not None:
+            first, chunk = chunk
+            pending.append((first + len(chunk), pool.submit(prepare, chunk, first, experiment.name, validate, derive)))
+
+    # Up to two chunks per worker in flight; results are committed in file order.
+    for _ in range(2 * workers):
+        submit()
+    while pending:
+        end, future = pending.popleft()
+        records, errors = future.result()
+        submit()
+        for row, message in errors[:3]:
+            print(f" {source}: row {row + 1}: {message}")
+        fresh = queue_records(experiment, records)
+        experiment.writer.flush()
+        checkpoint.update(source, end)
+
+        rows += len(records) + len(errors)
+        accepted += sum(fresh)
+        duplicates += len(fresh) - sum(fresh)
+        rejected += len(errors)
+        elapsed = time.perf_counter() - started
+        print(f" {source}: {skip + rows} rows, {rows / elapsed:,.0f} rows/s")
+    checkpoint.update(source, skip + rows, done=True)
+    return rows, accepted, duplicates, rejected
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sources", nargs="+", help="CSV or JSON session exports")
+    parser.add_argument("--experiment", help="experiment to load into (default: LOG_EXPERIMENT)")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="rows per chunk (default 5000)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="processes normalizing chunks (default: one per CPU)")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: backfill_checkpoint.json in the log dir)")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and load every row")
+    args = parser.parse_args(argv)
+
+    # Startup scans and the in-memory /status and /metrics/ab state serve no purpose here.
+    os.environ.setdefault("LOG_LIGHT", "1")
+    import ingest
+
+    experiment, error = ingest.get_experiment(args.experiment, create=True)
+    if error is not None:
+        parser.error(error[0]["error"])
+    # Nothing reads this process's /status or /stream, so their in-memory state need not follow.
+    for listener in (experiment.broadcast.publish_sessions, getattr(experiment.live_status, "update", None)):
+        experiment.writer.unsubscribe(listener)
+    # A chunk is queued as a whole, so it has to fit in the ingest queue.
+    chunk_size = max(1, min(args.chunk_size, ingest.QUEUE_DEPTH))
+    checkpoint = Checkpoint(args.checkpoint or os.path.join(experiment.log_dir, "backfill_checkpoint.json"))
+    if args.restart:
+        for source in args.sources:
+            checkpoint.sources.pop(os.path.abspath(source), None)
+
+    totals = [0, 0, 0, 0]
+    started = time.perf_counter()
+    # spawn: the workers must not inherit the writer threads started by ingest.
+    with ProcessPoolExecutor(args.workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        for source in args.sources:
+            if checkpoint.done(source):
+                print(f" {source} was already loaded")
+                continue
+            counts = load(source, experiment, pool, checkpoint, chunk_size, args.workers,
+                          ingest.LOG_VALIDATE, ingest.LOG_DERIVE, ingest.queue_records)
+            totals = [t + c for t, c in zip(totals, counts)]
+    ingest.close_experiments()
+
+    elapsed = time.perf_counter() - started
+    rows, accepted, duplicates, rejected = totals
+    print(f" Loaded {rows} rows into experiment {experiment.name!r} in {elapsed:.1f} s "
+          f"({rows / elapsed if elapsed else 0:,.0f} rows/s): "
+          f"{accepted} stored, {duplicates} duplicates, {rejected} rejected")
+
+
+if __name__ == "__main__":
+    main()
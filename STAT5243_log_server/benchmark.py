@@ -0,0 +1,408 @@
+"""Load generator and benchmark for the log server.
+
+Starts server.py (or asgi_server.py) in a scratch directory, replays session
+records against ``/log`` at a fixed rate or as fast as possible, and then
+measures ``/status`` after growing the log to several sizes. For each phase it
+reports p50/p95/p99 latency, throughput, error rate and the bytes the server
+wrote to ``logs/``, so storage backends and serving modes can be compared
+with numbers. A started server is also timed from launch until it answers,
+with an empty log and again after restarts on the grown log, together with
+the latency of the first ``/log`` request after each start.
+
+    python benchmark.py                                   # Flask dev server, CSV
+    python benchmark.py --server asgi_server.py --env LOG_STORAGE=parquet
+    python benchmark.py --qps 500 --concurrency 64 --source test-data
+    python benchmark.py --url http://127.0.0.1:5000       # an already running server
+    python benchmark.py --env LOG_LIGHT=1 --startup-runs 5  # cold starts in lightweight mode
+
+Records come from synthetic sessions shaped like the Shiny app's
+``log_session_summary``, ``STAT5243_project_2/test_data_collection.txt`` and,
+with ``--source requests``, a ``requests.jsonl`` of captured /log bodies in the
+repository root. Missing files are skipped, and only records that look like
+sessions (objects with a ``user_id``) are replayed.
+Each replayed record gets a fresh ``user_id`` (the server drops repeated ones,
+see dedup.py) unless ``--keep-ids`` is given. With ``--qps``, latency is
+measured from the time a request was scheduled, so queueing in the client
+when the server falls behind counts against the server.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+REPO = os.path.dirname(HERE)
+
+OPERATIONS = ["standardization", "normalization", "log_transformation", "polynomial_features",
+              "one_hot_encoding", "drop_missing", "fill_missing"]
+
+
+def synthetic_session(rng):
+    # Started in the last hour of today (UTC), so the sessions land in the partition /status reads.
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    earliest = max(now - timedelta(hours=1), now.replace(hour=0, minute=0, second=0, microsecond=0))
+    start = earliest + (now - earliest) * rng.random()
+    end = start + timedelta(seconds=rng.expovariate(1 / 120))
+    record = {
+        "user_id": str(uuid.uuid4()),
+        "group": rng.choice(["red", "black"]),
+        "session_start_time": start.isoformat(),
+        "session_end_time": end.isoformat(),
+        "total_session_time": (end - start).total_seconds(),
+        "apply_fe_button_clicked_count": rng.randrange(6),
+        "revert_button_clicked_count": rng.randrange(3),
+        "download_button_clicked_count": rng.randrange(2),
+        "apply_fe_button_error_count": rng.randrange(2),
+        "revert_button_error_count": 0,
+        "download_button_error_count": 0,
+        "download_button_clicked_time": None,
+        "has_error": False,
+    }
+    names = [rng.choice(OPERATIONS) for _ in range(rng.randrange(11))]
+    errors = [None if rng.random() > 0.1 else "ValueError" for _ in names]
+    record["operation_names"], record["operation_errors"] = names, errors
+    for i in range(1, 11):
+        record[f"operation_name{i}"] = names[i - 1] if i <= len(names) else None
+        record[f"operation_is_error{i}"] = errors[i - 1] if i <= len(names) else None
+    record["has_error"] = any(errors)
+    return record
+
+
+def read_requests(f):
+    return [json.loads(line) for line in f if line.strip()]
+
+
+def read_test_data(f):
+    # The file holds comma-separated objects without the enclosing brackets.
+    return json.loads("[" + f.read().strip().rstrip(",") + "]")
+
+
+# Record files per source name: (path, reader).
+SOURCE_FILES = {
+    "requests": (os.path.join(REPO, "requests.jsonl"), read_requests),
+    "test-data": (os.path.join(REPO, "STAT5243_project_2", "test_data_collection.txt"), read_test_data),
+}
+
+
+def is_session(record):
+    return isinstance(record, dict) and record.get("user_id") is not None
+
+
+def load_records(sources, rng, n):
+    """n records drawn round-robin from the requested sources."""
+    pools = []
+    for source, (path, read) in SOURCE_FILES.items():
+        if source not in sources:
+            continue
+        if not os.path.exists(path):
+            print(f" {path} not found; skipping source {source!r}")
+            continue
+        with open(path, encoding="utf-8") as f:
+            records = read(f)
+        sessions = [record for record in records if is_session(record)]
+        if len(sessions) < len(records):
+            print(f" Skipping {len(records) - len(sessions)} records of {path} that are not sessions")
+        if sessions:
+            pools.append(sessions)
+    m = len(pools) + ("synthetic" in sources)
+    if not m:
+        raise ValueError(f"No usable record source in {sorted(sources)}")
+    records = []
+    for i in range(n):
+        k = i % m
+        records.append(dict(pools[k][(i // m) % len(pools[k])]) if k < len(pools) else synthetic_session(rng))
+    return records
+
+
+class Client:
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+
+    def connection(self):
+        return http.client.HTTPConnection(self.host, self.port, timeout=30)
+
+    def request(self, method, path, body=None, headers=None):
+        conn = self.connection()
+        try:
+            conn.request(method, path, body, headers or {})
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+
+
+def run_phase(client, method, path, bodies, concurrency, qps=0):
+    """Send every body (None for GET) and collect (latency_seconds, status) per request."""
+    results = []
+    lock = threading.Lock()
+    counter = iter(range(len(bodies)))
+    t0 = time.perf_counter() + 0.05
+
+    def worker():
+        conn = client.connection()
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            scheduled = t0 + i / qps if qps else None
+            if scheduled is not None:
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            start = time.perf_counter()
+            try:
+                body = bodies[i]
+                headers = {"Content-Type": "application/json"} if body is not None else {}
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+                response.read()
+                if response.will_close:
+                    conn.close()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = client.connection()
+                status = None
+            end = time.perf_counter()
+            with lock:
+                results.append((end - (scheduled or start), status))
+        conn.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, time.perf_counter() - started
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))]
+
+
+def summarize(name, results, elapsed, bytes_written=None):
+    latencies = sorted(latency for latency, _ in results)
+    ok = sum(1 for _, status in results if status is not None and status < 400)
+    return {
+        "phase": name,
+        "requests": len(results),
+        "throughput": ok / elapsed if elapsed else None,
+        "p50_ms": percentile(latencies, 50) * 1000 if latencies else None,
+        "p95_ms": percentile(latencies, 95) * 1000 if latencies else None,
+        "p99_ms": percentile(latencies, 99) * 1000 if latencies else None,
+        "error_rate": 1 - ok / len(results) if results else None,
+        "rejected_429": sum(1 for _, status in results if status == 429),
+        "bytes_written": bytes_written,
+    }
+
+
+def print_summary(s):
+    line = (f" {s['phase']:<22} {s['requests']:>7} req  {s['throughput']:>8.1f} req/s  "
+            f"p50 {s['p50_ms']:7.2f} ms  p95 {s['p95_ms']:7.2f} ms  p99 {s['p99_ms']:7.2f} ms  "
+            f"errors {s['error_rate']:.1%} (429: {s['rejected_429']})")
+    if s["bytes_written"] is not None:
+        line += f"  wrote {s['bytes_written'] / 1e6:.2f} MB ({s['bytes_written'] / max(s['requests'], 1):.0f} B/req)"
+    print(line)
+
+
+def summarize_startup(name, runs):
+    """runs: ``[(seconds_until_listening, first_log_seconds), ...]``."""
+    startup = sorted(seconds for seconds, _ in runs)
+    first_log = sorted(seconds for _, seconds in runs)
+    return {
+        "phase": name,
+        "runs": len(runs),
+        "startup_ms_min": startup[0] * 1000,
+        "startup_ms_p50": percentile(startup, 50) * 1000,
+        "startup_ms_max": startup[-1] * 1000,
+        "first_log_ms_p50": percentile(first_log, 50) * 1000,
+    }
+
+
+def print_startup(s):
+    print(f" {s['phase']:<22} {s['runs']:>7} run  startup min {s['startup_ms_min']:7.0f} ms  "
+          f"p50 {s['startup_ms_p50']:7.0f} ms  max {s['startup_ms_max']:7.0f} ms  "
+          f"first /log {s['first_log_ms_p50']:7.2f} ms")
+
+
+def first_log(client, rng):
+    """Latency of one /log request, the first one after a start."""
+    body = json.dumps(synthetic_session(rng)).encode("utf-8")
+    started = time.perf_counter()
+    client.request("POST", "/log", body, {"Content-Type": "application/json"})
+    return time.perf_counter() - started
+
+
+def dir_size(path):
+    if path is None:
+        return None
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def wait_drained(client, timeout=120):
+    """Wait until the server's writer has committed everything queued (see GET /queue)."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            status, body = client.request("GET", "/queue")
+            if status == 200 and json.loads(body)["depth"] == 0:
+                return
+        except (OSError, ValueError, http.client.HTTPException):
+            pass
+        time.sleep(0.2)
+    print(" Warning: server queue did not drain in time")
+
+
+def start_server(script, port, env_overrides, workdir):
+    """Start script in workdir; returns ``(process, seconds until it answered GET /)``."""
+    env = dict(os.environ, PORT=str(port), PYTHONPATH=HERE, **env_overrides)
+    log = open(os.path.join(workdir, "server.out"), "a")
+    started = time.perf_counter()
+    # Own process group, so the Flask reloader child is stopped with it.
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, script)], cwd=workdir, env=env,
+                            stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+    client = Client(f"http://127.0.0.1:{port}")
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{script} exited with code {proc.returncode}, see {log.name}")
+        try:
+            client.request("GET", "/")
+            return proc, time.perf_counter() - started
+        except OSError:
+            time.sleep(0.01)
+    stop_server(proc)
+    raise RuntimeError(f"{script} did not start listening on port {port}")
+
+
+def stop_server(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--server", default="server.py", help="server script to start (server.py or asgi_server.py)")
+    parser.add_argument("--url", help="benchmark an already running server instead of starting one")
+    parser.add_argument("--log-dir", help="logs/ directory of the server given with --url, for bytes written")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="environment for the started server, e.g. LOG_STORAGE=sqlite (repeatable)")
+    parser.add_argument("--source", default="synthetic,test-data",
+                        help="comma-separated record sources: synthetic, test-data, requests")
+    parser.add_argument("--requests", type=int, default=2000, help="number of /log requests")
+    parser.add_argument("--qps", type=float, default=0, help="target request rate; 0 sends as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--status-sizes", default="1000,10000,50000",
+                        help="log sizes (records) at which /status is measured")
+    parser.add_argument("--status-requests", type=int, default=500)
+    parser.add_argument("--startup-runs", type=int, default=3,
+                        help="restarts of the started server on the grown log, to time startup")
+    parser.add_argument("--keep-ids", action="store_true", help="send records with their original user_id")
+    parser.add_argument("--seed", type=int, default=5243)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    sources = {s.strip() for s in args.source.split(",") if s.strip()}
+    proc = workdir = None
+    if args.url:
+        client, log_dir = Client(args.url), args.log_dir
+    else:
+        workdir = tempfile.mkdtemp(prefix="logbench-")
+        env = dict(item.split("=", 1) for item in args.env)
+        proc, startup = start_server(args.server, args.port, env, workdir)
+        client, log_dir = Client(f"http://127.0.0.1:{args.port}"), os.path.join(workdir, "logs")
+    label = args.url or " ".join([args.server] + args.env)
+    print(f" Benchmarking {label}")
+
+    summaries = []
+    try:
+        if proc is not None:
+            summaries.append(summarize_startup("startup, empty log", [(startup, first_log(client, rng))]))
+            print_startup(summaries[-1])
+
+        records = load_records(sources, rng, args.requests)
+        if not args.keep_ids:
+            for record in records:
+                record["user_id"] = str(uuid.uuid4())
+        bodies = [json.dumps(record).encode("utf-8") for record in records]
+
+        before = dir_size(log_dir)
+        results, elapsed = run_phase(client, "POST", "/log", bodies, args.concurrency, args.qps)
+        wait_drained(client)
+        written = None if before is None else dir_size(log_dir) - before
+        summaries.append(summarize("/log", results, elapsed, written))
+        print_summary(summaries[-1])
+
+        logged = sum(1 for _, status in results if status == 200)
+        for size in sorted(int(s) for s in args.status_sizes.split(",") if s.strip()):
+            while logged < size:
+                n = min(500, size - logged)
+                batch = json.dumps([synthetic_session(rng) for _ in range(n)]).encode("utf-8")
+                status, _ = client.request("POST", "/log/batch", batch, {"Content-Type": "application/json"})
+                if status == 429:
+                    time.sleep(0.5)
+                    continue
+                if status != 200:
+                    raise RuntimeError(f"/log/batch returned {status} while growing the log")
+                logged += n
+            wait_drained(client)
+            # Replayed records keep their own start times, so not all of the log is in the latest partition.
+            _, body = client.request("GET", "/status")
+            latest = json.loads(body).get("total_logs")
+            results, elapsed = run_phase(client, "GET", "/status", [None] * args.status_requests,
+                                         args.concurrency, args.qps)
+            summaries.append(summarize(f"/status @ {size} records ({latest} in the latest partition)",
+                                       results, elapsed))
+            print_summary(summaries[-1])
+
+        if proc is not None and args.startup_runs > 0:
+            runs = []
+            for _ in range(args.startup_runs):
+                stop_server(proc)
+                proc, startup = start_server(args.server, args.port, env, workdir)
+                runs.append((startup, first_log(client, rng)))
+            summaries.append(summarize_startup(f"startup @ {logged} records", runs))
+            print_startup(summaries[-1])
+    finally:
+        if proc is not None:
+            stop_server(proc)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"target": label, "args": vars(args), "results": summaries}, f, indent=2)
+    return summaries
+
+
+if __name__ == "__main__":
+    main()
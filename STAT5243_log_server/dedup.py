@@ -0,0 +1,110 @@
+"""Duplicate suppression for /log and /log/batch.
+
+The Shiny app can send the same session summary more than once (two
+``on_ended`` handlers, client retries after a timeout). Every accepted record
+claims a key, its ``Idempotency-Key`` when the client sends one and otherwise
+its ``user_id``; a record whose key was already claimed is acknowledged but
+not stored again.
+
+Claimed keys live in a persistent index, ``logs/dedup.db`` (an SQLite table
+with the key as primary key, shared by all worker processes), fronted by an
+in-memory Bloom filter. A key the filter has never seen is new for this
+process, so it is inserted without a lookup; only keys the filter may have
+seen are looked up. The uniqueness constraint decides races between workers.
+"""
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(int(capacity), 1)
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 8)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        # Double hashing: k positions from two 64-bit halves of one digest.
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class DedupIndex:
+    def __init__(self, log_dir, capacity=1_000_000, error_rate=0.01, db_name="dedup.db"):
+        self.db_path = os.path.join(log_dir, db_name)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # The records themselves are journaled (see writer.py); the index can lag a crash.
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS dedup_keys (key TEXT PRIMARY KEY) WITHOUT ROWID")
+        self._conn.commit()
+
+        count = self._conn.execute("SELECT COUNT(*) FROM dedup_keys").fetchone()[0]
+        self._bloom = BloomFilter(max(capacity, 2 * count), error_rate)
+        for (key,) in self._conn.execute("SELECT key FROM dedup_keys"):
+            self._bloom.add(key)
+        self.seeded = count > 0
+
+    def seed(self, store):
+        """Claim the user_ids already logged, when the index is created next to existing logs."""
+        if self.seeded:
+            return
+        keys = []
+        for path in store.partitions():
+            df = store.read(path, columns=["user_id"])
+            if "user_id" in df.columns:
+                keys.extend(str(k) for k in df["user_id"].dropna())
+        self.claim_many(keys)
+        self.seeded = True
+
+    def claim(self, key):
+        """Claim one key; False if it was claimed before."""
+        return self.claim_many([key])[0]
+
+    def claim_many(self, keys):
+        """Claim several keys in one transaction. Returns one bool per key, True if it is new."""
+        claimed = []
+        with self._lock, self._conn:
+            seen = set()
+            for key in keys:
+                if key is None:
+                    claimed.append(True)  # nothing to deduplicate on
+                    continue
+                if key in seen or (key in self._bloom and self._exists(key)):
+                    claimed.append(False)
+                    continue
+                # Another worker may have claimed it since; the primary key settles that.
+                new = self._conn.execute("INSERT OR IGNORE INTO dedup_keys (key) VALUES (?)", [key]).rowcount == 1
+                self._bloom.add(key)
+                seen.add(key)
+                claimed.append(new)
+        return claimed
+
+    def release(self, keys):
+        """Forget keys whose records could not be queued after all."""
+        keys = [k for k in keys if k is not None]
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM dedup_keys WHERE key = ?", [[k] for k in keys])
+
+    def _exists(self, key):
+        return self._conn.execute("SELECT 1 FROM dedup_keys WHERE key = ?", [key]).fetchone() is not None
+
+
+def dedup_key(record, idempotency_key=None):
+    """The key a record is deduplicated on, or None."""
+    if not isinstance(record, dict):
+        return idempotency_key or None
+    key = idempotency_key or record.get("idempotency_key") or record.get("user_id")
+    return None if key is None or key == "" else str(key)
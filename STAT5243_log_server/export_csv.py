@@ -0,0 +1,36 @@
+"""Export partitions of the SQLite log database as session_log_<key>.csv files.
+
+The CSV files have the same wide layout the log server wrote before the
+SQLite backend existed, so cleaning.ipynb and other tooling keep working.
+
+    python export_csv.py                           # every partition
+    python export_csv.py 20250418                  # selected partitions
+    python export_csv.py --experiment color 20250418  # of another experiment
+"""
+import os
+import sys
+
+from sqlite_store import SqliteStore
+
+LOG_DIR = "logs"
+# As in ingest.py: the default experiment keeps the top-level logs/ directory.
+DEFAULT_EXPERIMENT = os.environ.get("LOG_EXPERIMENT", "default")
+
+
+def main(keys, experiment=None):
+    # Experiments other than the default one live in logs/experiments/<name>/ (see ingest.py).
+    if experiment and experiment != DEFAULT_EXPERIMENT:
+        log_dir = os.path.join(LOG_DIR, "experiments", experiment)
+    else:
+        log_dir = LOG_DIR
+    store = SqliteStore(log_dir, os.environ.get("LOG_PARTITION", "day"))
+    for key in keys or store.partitions():
+        print(f" Exported {store.export_csv(key)}")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args[:1] == ["--experiment"] and len(args) > 1:
+        main(args[2:], args[1])
+    else:
+        main(args)
@@ -0,0 +1,551 @@
+"""Ingest pipeline shared by the Flask server (server.py) and the ASGI server
+(asgi_server.py).
+
+Both servers are thin adapters: they read the request and pass the decoded
+body to the functions below, which validate it and queue the records on the
+LogWriter of the record's experiment (see ``Experiment``). The handlers
+return ``(payload, status_code)``.
+"""
+import atexit
+import json
+import logging
+import math
+import os
+import random
+import re
+import threading
+import time
+import zlib
+
+
+from ab_stats import ABAggregates
+from dedup import DedupIndex, dedup_key
+from live_status import Broadcast, LiveStatus, ShardedStatus
+from manifest import Manifest
+from metrics import PARSE_FAILURES, QUEUE_CAPACITY_GAUGE, QUEUE_DEPTH_GAUGE, RECORDS_RECEIVED
+from query import iter_range, range_columns, stream
+from rollups import Rollups
+from schema import (DERIVE_ERRORS, ValidationError, derive_metrics, parse_query_time, to_timestamps,
+                    validate_session)
+from sketches import UniqueUsers
+from storage import Compactor, Retention, make_store
+from writer import LogWriter, QueueFull
+
+LOG_DIR = "logs"
+os.makedirs(LOG_DIR, exist_ok=True)
+
+# Leveled logging instead of printing every payload: LOG_LEVEL=DEBUG logs each
+# received record, at INFO only a LOG_PAYLOAD_SAMPLE fraction of them is logged.
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+                    format="%(asctime)s %(levelname)s %(name)s:%(message)s")
+logger = logging.getLogger("ingest")
+PAYLOAD_SAMPLE = float(os.environ.get("LOG_PAYLOAD_SAMPLE", 0.01))
+
+# Records are committed in groups: every FLUSH_BATCH_SIZE records or every
+# FLUSH_INTERVAL seconds, whichever comes first.
+FLUSH_BATCH_SIZE = int(os.environ.get("LOG_FLUSH_BATCH_SIZE", 500))
+FLUSH_INTERVAL = float(os.environ.get("LOG_FLUSH_INTERVAL", 1.0))
+# A record is acknowledged once its journal line is fdatasynced; LOG_JOURNAL_SYNC=0
+# skips the sync, so a power loss can lose acknowledged records (a crash cannot).
+JOURNAL_SYNC = os.environ.get("LOG_JOURNAL_SYNC", "1") == "1"
+
+# LOG_STORAGE selects the partition layout: "csv" (default), "parquet",
+# "arrow" or "sqlite". Parquet/Arrow partitions are compacted every
+# LOG_COMPACT_INTERVAL seconds.
+LOG_STORAGE = os.environ.get("LOG_STORAGE", "csv")
+LOG_PARTITION = os.environ.get("LOG_PARTITION", "day")
+# LOG_LAYOUT=normalized stores a fixed-schema sessions table plus a long
+# operations table instead of one wide row per session.
+LOG_LAYOUT = os.environ.get("LOG_LAYOUT", "wide")
+COMPACT_INTERVAL = float(os.environ.get("LOG_COMPACT_INTERVAL", 600))
+# Set LOG_SHARDED=1 when running several worker processes (e.g. gunicorn -w 4,
+# without --preload). Each worker then appends to its own shard file and
+# /status merges the shards.
+LOG_SHARDED = os.environ.get("LOG_SHARDED", "0") == "1"
+
+# Backpressure: at most LOG_QUEUE_DEPTH records wait for the writer. Beyond
+# that, requests are turned away with 429 and Retry-After instead of piling up.
+QUEUE_DEPTH = int(os.environ.get("LOG_QUEUE_DEPTH", 10000))
+RETRY_AFTER = max(1, math.ceil(FLUSH_INTERVAL))
+# Request bodies larger than this are refused with 413 (batches also after gzip).
+MAX_RECORD_BYTES = int(os.environ.get("LOG_MAX_RECORD_BYTES", 64 * 1024))
+MAX_BATCH_BYTES = int(os.environ.get("LOG_MAX_BATCH_BYTES", 8 * 1024 * 1024))
+# Records are checked against schema.SESSION_SCHEMA and stored typed (epoch-µs
+# timestamps, integer counters); LOG_VALIDATE=0 stores payloads as received.
+LOG_VALIDATE = os.environ.get("LOG_VALIDATE", "1") == "1"
+# Derived metrics (schema.DERIVED_COLUMNS, formerly computed in cleaning.ipynb)
+# are added to every record before it is stored.
+LOG_DERIVE = os.environ.get("LOG_DERIVE", "1") == "1"
+
+# LOG_LIGHT=1 is for frequent cold starts (e.g. Render's free tier): nothing
+# is scanned at startup. /status starts from the manifest counts, with its
+# recent records filling up as sessions arrive, and /metrics/ab is computed
+# from disk when first requested. pandas is never imported for /log.
+LOG_LIGHT = os.environ.get("LOG_LIGHT", "0") == "1"
+# Per-group sufficient statistics for /metrics/ab. A worker only sees its own
+# requests, so with LOG_SHARDED (and with LOG_LIGHT, which skips the startup
+# scan) they are rebuilt from disk every LOG_AB_REFRESH seconds instead.
+AB_REFRESH = float(os.environ.get("LOG_AB_REFRESH", 60))
+AB_FROM_DISK = LOG_SHARDED or LOG_LIGHT
+
+# /stream pushes every accepted session, and every LOG_STREAM_ROLLUP seconds
+# the per-group /metrics/ab numbers, from one in-memory buffer. With
+# LOG_SHARDED a worker's stream carries the sessions that worker received.
+STREAM_HEARTBEAT = float(os.environ.get("LOG_STREAM_HEARTBEAT", 15))
+STREAM_BUFFER = int(os.environ.get("LOG_STREAM_BUFFER", 1000))
+STREAM_ROLLUP = float(os.environ.get("LOG_STREAM_ROLLUP", 5))
+
+# /log and /log/batch are idempotent: a record whose Idempotency-Key (or,
+# without one, user_id) was seen before is acknowledged but not stored again.
+LOG_DEDUP = os.environ.get("LOG_DEDUP", "1") == "1"
+DEDUP_CAPACITY = int(os.environ.get("LOG_DEDUP_CAPACITY", 1_000_000))
+
+# Partitions older than LOG_COMPRESS_AFTER_DAYS are compressed, and with
+# LOG_RETENTION_DAYS set, partitions older than that are deleted (checked
+# every LOG_RETENTION_INTERVAL seconds). Readers decompress transparently.
+COMPRESS_AFTER_DAYS = float(os.environ.get("LOG_COMPRESS_AFTER_DAYS", 2))
+RETENTION_DAYS = float(os.environ.get("LOG_RETENTION_DAYS", 0)) or None
+RETENTION_INTERVAL = float(os.environ.get("LOG_RETENTION_INTERVAL", 3600))
+
+# Several experiments can log to one server, selected by the URL
+# (/experiments/<name>/log, /experiments/<name>/status, ...) or by an
+# "experiment" field in the record. Each one lives in its own directory,
+# logs/experiments/<name>/, with its own partitions, manifest, journal, dedup
+# index and in-memory counters, so nothing ever reads another experiment's
+# files. Records without an experiment go to LOG_EXPERIMENT, which keeps the
+# top-level logs/ directory.
+DEFAULT_EXPERIMENT = os.environ.get("LOG_EXPERIMENT", "default")
+# Experiments are created by their first record; this caps how many a client can open.
+MAX_EXPERIMENTS = int(os.environ.get("LOG_MAX_EXPERIMENTS", 32))
+EXPERIMENT_NAME = re.compile(r"[A-Za-z0-9][A-Za-z0-9_-]{0,63}")
+EXPERIMENTS_DIR = os.path.join(LOG_DIR, "experiments")
+
+
+class Experiment:
+    """Storage and in-memory state of one experiment."""
+
+    def __init__(self, name, log_dir):
+        self.name = name
+        self.log_dir = log_dir
+        os.makedirs(log_dir, exist_ok=True)
+        self.store = store = make_store(log_dir, LOG_STORAGE, LOG_PARTITION, LOG_LAYOUT,
+                                        shard=os.getpid() if LOG_SHARDED else None)
+
+        # <log_dir>/manifest.json: rows, bytes, schema versions and time range per
+        # partition. Partitions written before the manifest existed are scanned
+        # before the journal is replayed into them.
+        self.manifest = Manifest(log_dir)
+        self.manifest.rebuild(store)
+        # HyperLogLog sketches of the distinct user_ids per (group, day) behind
+        # /counts/users, in <log_dir>/sketches.db; seeded from disk once.
+        self.unique_users = UniqueUsers(log_dir, store.key_format)
+        self.unique_users.seed(store)
+        # Per-group minute and hour counters behind /rollups, in <log_dir>/rollups.db.
+        self.rollups = Rollups(log_dir)
+        self.rollups.seed(store)
+        self.writer = writer = LogWriter(log_dir, store, batch_size=FLUSH_BATCH_SIZE, flush_interval=FLUSH_INTERVAL,
+                                         max_pending=QUEUE_DEPTH, manifest=self.manifest, experiment=name,
+                                         indexes=[self.unique_users, self.rollups], sync_journal=JOURNAL_SYNC)
+        atexit.register(writer.close)
+
+        # /status is answered from memory; the counters are seeded once from disk.
+        if LOG_SHARDED:
+            self.live_status = ShardedStatus(store, columns=store.columns)
+        else:
+            self.live_status = LiveStatus(buffer_size=int(os.environ.get("LOG_STATUS_BUFFER", 100)),
+                                          columns=store.columns)
+            self.live_status.load(store, self.manifest, recent=not LOG_LIGHT)
+            writer.subscribe(self.live_status.update)
+        self.ab_aggregates = ABAggregates()
+        self.ab_loaded_at = None
+        if not LOG_LIGHT:
+            self.ab_aggregates.load(store)
+            self.ab_loaded_at = time.monotonic()
+        if not AB_FROM_DISK:
+            writer.subscribe(self.ab_aggregates.update)
+
+        self.broadcast = Broadcast(buffer_size=STREAM_BUFFER)
+        writer.subscribe(self.broadcast.publish_sessions)
+        self.broadcast.start_rollups(self.ab_metrics, STREAM_ROLLUP)
+
+        self.dedup = None
+        if LOG_DEDUP:
+            self.dedup = DedupIndex(log_dir, capacity=DEDUP_CAPACITY)
+            self.dedup.seed(store)
+
+        if LOG_STORAGE in ("parquet", "arrow"):
+            self.compactor = Compactor(store, interval=COMPACT_INTERVAL).start()
+        self.retention = Retention(store, compress_after_days=COMPRESS_AFTER_DAYS, keep_days=RETENTION_DAYS,
+                                   interval=RETENTION_INTERVAL, manifest=self.manifest).start()
+
+    def ab_metrics(self):
+        if AB_FROM_DISK and (self.ab_loaded_at is None or time.monotonic() - self.ab_loaded_at > AB_REFRESH):
+            fresh = ABAggregates()
+            fresh.load(self.store)
+            self.ab_aggregates, self.ab_loaded_at = fresh, time.monotonic()
+        return self.ab_aggregates.snapshot()
+
+
+experiments = {}
+_experiments_lock = threading.Lock()
+
+
+def experiment_dir(name):
+    return LOG_DIR if name == DEFAULT_EXPERIMENT else os.path.join(EXPERIMENTS_DIR, name)
+
+
+def get_experiment(name=None, create=False):
+    """``(experiment, None)``, or ``(None, (payload, status_code))`` if there is no such experiment.
+
+    An experiment another worker process created is picked up from disk;
+    with ``create`` a new one is started.
+    """
+    name = name or DEFAULT_EXPERIMENT
+    experiment = experiments.get(name)
+    if experiment is not None:
+        return experiment, None
+    if not EXPERIMENT_NAME.fullmatch(name):
+        return None, ({"error": "Invalid experiment name", "experiment": name}, 400)
+    with _experiments_lock:
+        if name not in experiments:
+            if not create and not os.path.isdir(experiment_dir(name)):
+                return None, ({"error": "Unknown experiment", "experiment": name}, 404)
+            if len(experiments) >= MAX_EXPERIMENTS:
+                return None, ({"error": f"At most {MAX_EXPERIMENTS} experiments are allowed",
+                               "experiment": name}, 400)
+            experiments[name] = Experiment(name, experiment_dir(name))
+        return experiments[name], None
+
+
+def list_experiments():
+    """Rows and partitions per experiment, from the manifests."""
+    names = {DEFAULT_EXPERIMENT, *experiments}
+    if os.path.isdir(EXPERIMENTS_DIR):
+        names.update(n for n in os.listdir(EXPERIMENTS_DIR) if EXPERIMENT_NAME.fullmatch(n))
+    listing = {}
+    for name in sorted(names):
+        experiment, error = get_experiment(name)
+        if error is not None:
+            continue
+        entries = experiment.manifest.entries()
+        listing[name] = {"partitions": len(entries), "rows": sum(e["rows"] for e in entries.values())}
+    return listing
+
+
+# The default experiment, and every experiment already on disk so that its
+# journal is replayed at startup.
+get_experiment(DEFAULT_EXPERIMENT, create=True)
+if os.path.isdir(EXPERIMENTS_DIR):
+    for _name in sorted(os.listdir(EXPERIMENTS_DIR)):
+        if EXPERIMENT_NAME.fullmatch(_name):
+            get_experiment(_name)
+QUEUE_DEPTH_GAUGE.fn = lambda: sum(e.writer.depth() for e in list(experiments.values()))
+QUEUE_CAPACITY_GAUGE.fn = lambda: QUEUE_DEPTH * len(experiments)
+
+
+def close_experiments():
+    for experiment in list(experiments.values()):
+        experiment.writer.close()
+
+
+def log_payload(data):
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(" Received log: %s", data)
+    elif PAYLOAD_SAMPLE and random.random() < PAYLOAD_SAMPLE:
+        logger.info(" Received log (sampled): %s", data)
+
+
+def _experiment_of(record, experiment=None):
+    """``(name, record, error)``: the experiment a record goes to and the record without its "experiment" field.
+
+    The experiment in the URL wins; a record naming another one gets an error message.
+    """
+    if not isinstance(record, dict) or "experiment" not in record:
+        return experiment or DEFAULT_EXPERIMENT, record, None
+    named = record["experiment"]
+    record = {k: v for k, v in record.items() if k != "experiment"}
+    if named is not None and not isinstance(named, str):
+        return None, record, "experiment must be a string"
+    if experiment and named and named != experiment:
+        return None, record, f"Record is for experiment {named!r}, not {experiment!r}"
+    return named or experiment or DEFAULT_EXPERIMENT, record, None
+
+
+def ingest_record(data, idempotency_key=None, experiment=None):
+    log_payload(data)
+    if not data:
+        PARSE_FAILURES.inc(endpoint="/log", reason="empty")
+        return {"error": "No JSON received"}, 400
+    name, data, error = _experiment_of(data, experiment)
+    if error is not None:
+        PARSE_FAILURES.inc(endpoint="/log", reason="experiment")
+        return {"error": error}, 400
+    if LOG_VALIDATE:
+        try:
+            data = validate_session(data)
+        except ValidationError as e:
+            PARSE_FAILURES.inc(endpoint="/log", reason="schema")
+            return {"error": "Invalid record", "fields": e.errors}, 400
+    if LOG_DERIVE:
+        try:
+            data = derive_metrics(data)
+        except DERIVE_ERRORS as e:
+            PARSE_FAILURES.inc(endpoint="/log", reason="schema")
+            return {"error": f"Invalid record: {e}"}, 400
+    experiment, error = get_experiment(name, create=True)
+    if error is not None:
+        PARSE_FAILURES.inc(endpoint="/log", reason="experiment")
+        return error
+
+    try:
+        [new] = queue_records(experiment, [data], [dedup_key(data, idempotency_key)])
+    except QueueFull:
+        return queue_full()
+    if not new:
+        return {"status": " Duplicate log ignored", "duplicate": True}, 200
+    return {"status": " Log saved"}, 200
+
+
+def queue_records(experiment, records, keys=None):
+    """Queue validated records on an experiment's writer, skipping duplicates.
+
+    ``keys`` are the dedup keys (default: ``dedup_key`` of each record).
+    Returns one bool per record, True if it was queued. Raises QueueFull,
+    with nothing queued, when the writer has no room.
+    """
+    dedup = experiment.dedup
+    if dedup is not None:
+        keys = [dedup_key(record) for record in records] if keys is None else keys
+        fresh = dedup.claim_many(keys)
+    else:
+        fresh = [True] * len(records)
+    accepted = [record for record, new in zip(records, fresh) if new]
+    try:
+        experiment.writer.append_many(accepted)
+    except Exception as e:
+        if dedup is not None:
+            dedup.release([key for key, new in zip(keys, fresh) if new])
+        if isinstance(e, QueueFull):
+            RECORDS_RECEIVED.inc(len(accepted), outcome="rejected", experiment=experiment.name)
+        raise
+    RECORDS_RECEIVED.inc(len(accepted), outcome="accepted", experiment=experiment.name)
+    RECORDS_RECEIVED.inc(len(records) - len(accepted), outcome="duplicate", experiment=experiment.name)
+    return fresh
+
+
+def parse_batch(body, content_type=""):
+    """Parse a batch body given either as a JSON array or as NDJSON."""
+    text = body.decode("utf-8").strip()
+    if not text:
+        return []
+    if "ndjson" not in content_type and text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def ingest_batch(body, content_type="", content_encoding="", experiment=None):
+    try:
+        if content_encoding.lower() == "gzip":
+            body = _gunzip(body, MAX_BATCH_BYTES)
+            if body is None:
+                return body_too_large(MAX_BATCH_BYTES)
+        records = parse_batch(body, content_type)
+    except (ValueError, OSError, EOFError, zlib.error) as e:
+        PARSE_FAILURES.inc(endpoint="/log/batch", reason="body")
+        return {"error": f"Invalid batch body: {e}"}, 400
+    if not isinstance(records, list) or not records:
+        PARSE_FAILURES.inc(endpoint="/log/batch", reason="empty")
+        return {"error": "No records received"}, 400
+    for record in records:
+        log_payload(record)
+    if len(records) > QUEUE_DEPTH:
+        # Would never fit, however long the client waits.
+        return {"error": f"Batch exceeds the ingest queue capacity of {QUEUE_DEPTH} records"}, 413
+
+    errors = {}
+    names = [None] * len(records)
+    for i, record in enumerate(records):
+        if not isinstance(record, dict) or not record:
+            errors[i] = {"error": "Record must be a non-empty JSON object"}
+            continue
+        names[i], record, error = _experiment_of(record, experiment)
+        if error is not None:
+            errors[i] = {"error": error}
+            continue
+        if LOG_VALIDATE:
+            try:
+                record = validate_session(record)
+            except ValidationError as e:
+                errors[i] = {"error": "Invalid record", "fields": e.errors}
+                continue
+        try:
+            records[i] = derive_metrics(record) if LOG_DERIVE else record
+        except DERIVE_ERRORS as e:
+            errors[i] = {"error": f"Invalid record: {e}"}
+
+    # One group per experiment, each deduplicated and queued on its own writer.
+    groups = {}
+    for i, name in enumerate(names):
+        if i not in errors:
+            groups.setdefault(name, []).append(i)
+    for name, indexes in list(groups.items()):
+        target, error = get_experiment(name, create=True)
+        if error is not None:
+            for i in indexes:
+                errors[i] = error[0]
+            del groups[name]
+        else:
+            groups[name] = (target, indexes)
+
+    statuses = {}
+    for target, indexes in groups.values():
+        try:
+            fresh = queue_records(target, [records[i] for i in indexes])
+        except QueueFull:
+            # Groups queued before this one stay queued; a retry reports them as duplicates.
+            return queue_full()
+        statuses.update((i, "ok" if new else "duplicate") for i, new in zip(indexes, fresh))
+
+    results = []
+    for i in range(len(records)):
+        if i in errors:
+            results.append({"index": i, "status": "error", **errors[i]})
+        else:
+            results.append({"index": i, "status": statuses[i]})
+    if errors:
+        PARSE_FAILURES.inc(len(errors), endpoint="/log/batch", reason="record")
+
+    accepted = sum(1 for status in statuses.values() if status == "ok")
+    return {
+        "accepted": accepted,
+        "duplicates": len(statuses) - accepted,
+        "rejected": len(errors),
+        "results": results
+    }, 200
+
+
+def invalid_json():
+    PARSE_FAILURES.inc(endpoint="/log", reason="body")
+    return {"error": "Invalid JSON body"}, 400
+
+
+def queue_full():
+    """429 payload; the adapters add ``Retry-After: RETRY_AFTER`` to it."""
+    return {"error": "Ingest queue is full, retry later", "retry_after": RETRY_AFTER}, 429
+
+
+def body_too_large(limit):
+    return {"error": f"Request body exceeds {limit} bytes"}, 413
+
+
+def queue_status(experiment):
+    writer = experiment.writer
+    return {"depth": writer.depth(), "capacity": QUEUE_DEPTH, "rejected": writer.rejected}
+
+
+def _gunzip(body, limit):
+    """Decompress a gzip body, or None if it inflates beyond limit bytes."""
+    inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    data = inflater.decompress(body, limit + 1)
+    if len(data) > limit:
+        return None
+    if not inflater.eof:
+        raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+    return data
+
+
+def time_range(args):
+    """``(start, end)`` of a query's ``from`` and ``to`` as naive UTC datetimes, or ``(payload, 400)``."""
+    try:
+        return (parse_query_time(args.get("from")), parse_query_time(args.get("to"))), None
+    except ValueError as e:
+        return None, ({"error": f"Invalid time range: {e}"}, 400)
+
+
+def group_counts(experiment, args):
+    """Sessions per group with session_start_time in /counts?from=&to=, as ``(payload, status_code)``."""
+    bounds, error = time_range(args)
+    if error is not None:
+        return error
+    start, end = bounds
+    store, manifest = experiment.store, experiment.manifest
+    if hasattr(store, "group_counts"):
+        return store.group_counts(start, end), 200
+
+    counts = {}
+    entries = manifest.entries()
+    for path in store.partitions():
+        if not manifest.overlaps(store.key_of(path), start, end, entries=entries):
+            continue
+        df = store.read(path, columns=["group", "session_start_time"])
+        if "group" not in df.columns:
+            continue
+        if "session_start_time" in df.columns and (start or end):
+            start_times = to_timestamps(df["session_start_time"])
+            keep = start_times.notna()
+            if start:
+                keep &= start_times >= start
+            if end:
+                keep &= start_times < end
+            df = df[keep]
+        for group, n in df["group"].fillna("").value_counts().items():
+            counts[group] = counts.get(group, 0) + int(n)
+    return counts, 200
+
+
+def unique_user_counts(experiment, args):
+    """Approximate distinct user_ids per group, over the whole days overlapping /counts/users?from=&to=."""
+    bounds, error = time_range(args)
+    if error is not None:
+        return error
+    return experiment.unique_users.count(*bounds), 200
+
+
+def query_rollups(experiment, args):
+    """Rows of /rollups?resolution=minute|hour&from=&to=&group=, or ``(payload, status_code)`` on a bad query."""
+    bounds, error = time_range(args)
+    if error is not None:
+        return error
+    try:
+        return experiment.rollups.query(args.get("resolution", "hour"), *bounds, args.get("group")), 200
+    except ValueError as e:
+        return {"error": str(e)}, 400
+
+
+def query_logs(experiment, args):
+    """Stream the sessions matching /logs?from=&to=&group=&columns=&format=.
+
+    Returns ``(chunks, mimetype, None)`` where ``chunks`` is an iterator of
+    text chunks, or ``(None, None, (payload, status_code))`` on a bad query.
+    """
+    import pandas as pd
+
+    fmt = args.get("format", "ndjson")
+    if fmt not in ("ndjson", "csv"):
+        return None, None, ({"error": "format must be ndjson or csv"}, 400)
+    columns = [c.strip() for c in args.get("columns", "").split(",") if c.strip()] or None
+    # Parsed like the bounds of /counts, /counts/users and /rollups.
+    bounds, error = time_range(args)
+    if error is not None:
+        return None, None, error
+    start, end = (None if t is None else pd.Timestamp(t) for t in bounds)
+
+    store, manifest = experiment.store, experiment.manifest
+    # A CSV has one header: without columns=, it covers every file the query reads.
+    header = columns or (range_columns(store, start, end, manifest) if fmt == "csv" else None)
+    chunks = stream(iter_range(store, start, end, args.get("group"), columns, manifest=manifest), fmt, header)
+    return chunks, "text/csv" if fmt == "csv" else "application/x-ndjson", None
+
+
+def stream_options(args, last_event_id=None):
+    """Keyword arguments of ``sse_stream`` for a /stream request.
+
+    ``events=session`` or ``events=rollup`` selects one kind of event; clients
+    resume with the Last-Event-ID header (or ``last_id``) after a reconnect.
+    """
+    kinds = args.get("events")
+    return {
+        "last_event_id": args.get("last_id", last_event_id),
+        "kinds": set(kinds.split(",")) if kinds else None,
+        "heartbeat": STREAM_HEARTBEAT,
+    }
@@ -0,0 +1,286 @@
+"""In-memory state behind /status.
+
+/status used to re-read the latest log partition on every call. LiveStatus is
+updated by the writer as records are accepted and keeps, per partition, the
+row count, the column names and the latest ``session_end_time``, plus a ring
+buffer of the most recent records, so /status never touches the disk.
+
+That only works while one process does all the writing; with several worker
+processes (LOG_SHARDED=1) ShardedStatus reads the shard files incrementally.
+
+Broadcast feeds /stream (Server-Sent Events) the same way: every accepted
+session, and a periodic per-group rollup, is encoded once into a ring buffer
+that all subscribers read from.
+"""
+import asyncio
+import collections
+import hashlib
+import itertools
+import json
+import threading
+import time
+import uuid
+
+from schema import TIMESTAMP_COLUMNS, iso_time, max_time
+
+
+def _with_iso_times(record):
+    # Timestamps are stored as epoch µs; /status shows them as ISO strings.
+    return {k: iso_time(v) if k in TIMESTAMP_COLUMNS else v for k, v in record.items()}
+
+
+class LiveStatus:
+    def __init__(self, buffer_size=100, columns=None):
+        # With a fixed schema the stored columns do not depend on the payloads.
+        self._columns = columns
+        self._lock = threading.Lock()
+        self._partitions = {}
+        self._recent = collections.deque(maxlen=buffer_size)
+        self._version = 0
+        # Distinguishes ETags across restarts, when the version starts over.
+        self._instance = uuid.uuid4().hex[:8]
+
+    def load(self, store, manifest=None, recent=True):
+        """Seed the counters from the latest partition already on disk (once, at startup).
+
+        With a manifest entry for the partition, the count, latest time and
+        columns are taken from it instead of scanning the partition.
+        ``recent=False`` also skips reading its last records, so the partition
+        is not opened at all (unless the entry predates recorded columns) and
+        the recent records start empty.
+        """
+        partitions = store.partitions()
+        if not partitions:
+            return
+        latest = partitions[-1]
+        entry = manifest.get(store.key_of(latest)) if manifest is not None else None
+        columns = self._columns or (entry or {}).get("columns")
+        last = store.tail(latest, self._recent.maxlen) if recent or not columns else None
+        if entry is not None:
+            count, latest_time = entry["rows"], entry["max_session_end_time"]
+        else:
+            end_times = store.read(latest, columns=["session_end_time"])
+            count = store.count(latest)
+            latest_time = max_time(end_times["session_end_time"]) if "session_end_time" in end_times.columns else None
+        with self._lock:
+            self._partitions[store.key_of(latest)] = {
+                "count": count,
+                "columns": dict.fromkeys(last.columns if last is not None else columns),
+                "latest_time": latest_time,
+            }
+            if last is not None:
+                self._recent.extend(last.to_dict(orient="records"))
+            self._version += 1
+
+    def update(self, key, records):
+        with self._lock:
+            part = self._partitions.setdefault(key, {"count": 0, "columns": {}, "latest_time": None})
+            part["count"] += len(records)
+            for record in records:
+                part["columns"].update(dict.fromkeys(record))
+                end_time = iso_time(record.get("session_end_time"))
+                # Normalized ISO strings compare in time order.
+                if end_time is not None and (part["latest_time"] is None or end_time > part["latest_time"]):
+                    part["latest_time"] = end_time
+            self._recent.extend(records)
+            self._version += 1
+
+    def snapshot(self, last_n=3):
+        """Return ``(payload, etag)`` for /status; payload is None if nothing was logged yet."""
+        with self._lock:
+            etag = f"{self._instance}-{self._version}"
+            if not self._partitions:
+                return None, etag
+            part = self._partitions[max(self._partitions)]
+            return {
+                "columns": list(self._columns or part["columns"]),
+                "total_logs": part["count"],
+                "latest_time": part["latest_time"],
+                "last_logs": [_with_iso_times(r) for r in list(self._recent)[-last_n:]] if last_n else [],
+            }, etag
+
+
+class ShardedStatus:
+    """/status when several worker processes write their own shard files.
+
+    A worker's in-memory counters only see its own requests, so instead the
+    files of the latest partition are summarized directly. Summaries are
+    cached per file and only the rows appended since the last call are
+    parsed, so the cost follows the new data, not the size of the log.
+    """
+
+    def __init__(self, store, columns=None):
+        self.store = store
+        self._columns = columns
+        self._lock = threading.Lock()
+        self._cache = {}
+
+    def snapshot(self, last_n=3):
+        with self._lock:
+            partitions = self.store.partitions()
+            if not partitions:
+                return None, "empty"
+            summaries = {}
+            for path in self.store.files(partitions[-1]):
+                try:
+                    summaries[path] = self.store.summarize(path, self._cache.get(path), n=last_n)
+                except FileNotFoundError:
+                    continue  # compacted away since it was listed
+            self._cache = summaries
+
+        ordered = sorted(summaries.values(), key=lambda s: s["mtime"])
+        columns = {}
+        latest_times = []
+        recent = []
+        for summary in ordered:
+            columns.update(dict.fromkeys(summary["columns"]))
+            if summary["latest_time"] is not None:
+                latest_times.append(summary["latest_time"])
+            recent.extend(summary["tail"])
+        payload = {
+            "columns": list(self._columns or columns),
+            "total_logs": sum(s["count"] for s in ordered),
+            "latest_time": max(latest_times, key=str) if latest_times else None,
+            "last_logs": [_with_iso_times(r) for r in recent[-last_n:]] if last_n else [],
+        }
+        etag = hashlib.md5(repr(sorted((p, s["count"]) for p, s in summaries.items())).encode()).hexdigest()[:16]
+        return payload, etag
+
+
+class Broadcast:
+    """Fan-out of live events to /stream subscribers.
+
+    Events get consecutive ids and are JSON-encoded once, into a ring buffer
+    of the last ``buffer_size`` events. A subscriber only keeps the id of the
+    last event it sent, so a slow client never holds up ingest or the other
+    clients; if it falls behind the buffer it is told how many events it missed.
+    """
+
+    def __init__(self, buffer_size=1000):
+        self._cond = threading.Condition()
+        self._events = collections.deque(maxlen=buffer_size)
+        self._last_id = 0
+        self._waiters = set()  # (loop, asyncio.Event) of async subscribers
+        self.subscribers = 0
+
+    def publish(self, kind, payloads):
+        """Append one ``kind`` event per payload and wake the subscribers."""
+        encoded = [json.dumps(payload, default=str) for payload in payloads]
+        if not encoded:
+            return
+        with self._cond:
+            for data in encoded:
+                self._last_id += 1
+                self._events.append((self._last_id, kind, data))
+            self._cond.notify_all()
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def publish_sessions(self, key, records):
+        """Writer listener: one ``session`` event per accepted record."""
+        self.publish("session", [_with_iso_times(record) for record in records])
+
+    def start_rollups(self, rollup, interval):
+        """Publish ``rollup()`` as a ``rollup`` event every interval seconds in which sessions arrived.
+
+        Nothing is computed while no one is subscribed.
+        """
+        def run():
+            seen = self.last_id()
+            while True:
+                time.sleep(interval)
+                if self.subscribers and self.last_id() != seen:
+                    self.publish("rollup", [rollup()])
+                    seen = self.last_id()
+
+        threading.Thread(target=run, name="stream-rollups", daemon=True).start()
+
+    def subscribe(self, delta):
+        with self._cond:
+            self.subscribers += delta
+
+    def last_id(self):
+        with self._cond:
+            return self._last_id
+
+    def since(self, last_id):
+        """``(events after last_id, number of those no longer buffered)``."""
+        with self._cond:
+            return self._since(last_id)
+
+    def _since(self, last_id):
+        first = self._events[0][0] if self._events else self._last_id + 1
+        start = max(last_id + 1 - first, 0)
+        return list(itertools.islice(self._events, start, None)), max(first - 1 - last_id, 0)
+
+    def wait(self, last_id, timeout):
+        """Block until there are events after last_id or timeout seconds passed."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._last_id > last_id, timeout)
+            return self._since(last_id)
+
+    async def wait_async(self, last_id, timeout):
+        """``wait`` for the event loop: publishers wake it without a thread per subscriber."""
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._cond:
+            if self._last_id > last_id:
+                return self._since(last_id)
+            self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._cond:
+                self._waiters.discard(waiter)
+        return self.since(last_id)
+
+
+def _start_id(broadcast, last_event_id):
+    # Resume after Last-Event-ID; ids from before a restart, or none, start at the live edge.
+    current = broadcast.last_id()
+    if last_event_id is not None and str(last_event_id).isdigit() and int(last_event_id) <= current:
+        return int(last_event_id)
+    return current
+
+
+def _encode(events, missed, kinds):
+    chunks = []
+    if missed:
+        chunks.append(f"event: dropped\ndata: {json.dumps({'missed': missed})}\n\n")
+    for event_id, kind, data in events:
+        if kinds is None or kind in kinds:
+            chunks.append(f"id: {event_id}\nevent: {kind}\ndata: {data}\n\n")
+    # A comment line keeps idle connections (and proxies) from timing out.
+    return "".join(chunks) or ": keepalive\n\n"
+
+
+def sse_stream(broadcast, last_event_id=None, kinds=None, heartbeat=15):
+    """Server-Sent Events for a blocking server (one thread per subscriber)."""
+    last_id = _start_id(broadcast, last_event_id)
+    broadcast.subscribe(1)
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            events, missed = broadcast.wait(last_id, heartbeat)
+            if events:
+                last_id = events[-1][0]
+            yield _encode(events, missed, kinds)
+    finally:
+        broadcast.subscribe(-1)
+
+
+async def sse_stream_async(broadcast, last_event_id=None, kinds=None, heartbeat=15):
+    """Server-Sent Events for an event loop (one coroutine per subscriber)."""
+    last_id = _start_id(broadcast, last_event_id)
+    broadcast.subscribe(1)
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            events, missed = await broadcast.wait_async(last_id, heartbeat)
+            if events:
+                last_id = events[-1][0]
+            yield _encode(events, missed, kinds)
+    finally:
+        broadcast.subscribe(-1)
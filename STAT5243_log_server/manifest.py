@@ -0,0 +1,159 @@
+"""Partition manifest: what each log partition holds, without opening it.
+
+``logs/manifest.json`` maps every partition key to its row count, byte size,
+the schema versions written to it and the min/max ``session_start_time`` and
+``session_end_time``. The writer updates it on every flush (see writer.py),
+the retention job when it archives or deletes a partition, and partitions
+that predate the manifest are scanned once at startup.
+
+Readers use it to plan: /logs and /counts skip partitions whose time range
+does not overlap the query, and /status seeds its counters from it.
+"""
+import json
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; then only one process may write
+    fcntl = None
+
+from schema import SCHEMA_VERSION, parse_time
+
+TIME_FIELDS = ("session_start_time", "session_end_time")
+
+
+def _empty_entry():
+    entry = {"rows": 0, "bytes": 0, "schema_versions": [], "columns": []}
+    for field in TIME_FIELDS:
+        entry[f"min_{field}"] = entry[f"max_{field}"] = None
+    return entry
+
+
+def _merge_time(entry, field, value):
+    if value is None:
+        return
+    lo, hi = entry[f"min_{field}"], entry[f"max_{field}"]
+    value = value.isoformat()
+    # Stored as normalized ISO strings, which compare in time order.
+    if lo is None or value < lo:
+        entry[f"min_{field}"] = value
+    if hi is None or value > hi:
+        entry[f"max_{field}"] = value
+
+
+def stats_of(records, bytes_written=0, schema_version=SCHEMA_VERSION):
+    """Manifest entry describing a batch of records."""
+    entry = _empty_entry()
+    entry["rows"] = len(records)
+    entry["bytes"] = bytes_written or 0
+    entry["schema_versions"] = [schema_version]
+    entry["columns"] = list(dict.fromkeys(column for record in records for column in record))
+    for record in records:
+        for field in TIME_FIELDS:
+            _merge_time(entry, field, parse_time(record.get(field)))
+    return entry
+
+
+class Manifest:
+    def __init__(self, log_dir, name="manifest.json"):
+        self.path = os.path.join(log_dir, name)
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._mtime = None
+
+    def entries(self):
+        """``{key: entry}`` for every partition, re-read if another process changed it."""
+        with self._lock:
+            self._refresh()
+            return {key: dict(entry) for key, entry in self._entries.items()}
+
+    def get(self, key):
+        return self.entries().get(key)
+
+    def add(self, key, stats):
+        """Fold the stats of newly written records (see ``stats_of``) into a partition."""
+        def update(entries):
+            entry = entries.setdefault(key, _empty_entry())
+            entry["rows"] += stats["rows"]
+            entry["bytes"] += stats["bytes"]
+            entry["schema_versions"] = sorted(set(entry["schema_versions"]) | set(stats["schema_versions"]))
+            # Entries written before columns were recorded have none.
+            entry["columns"] = list(dict.fromkeys(entry.get("columns", []) + stats.get("columns", [])))
+            for field in TIME_FIELDS:
+                for bound in ("min", "max"):
+                    value = stats[f"{bound}_{field}"]
+                    if value is not None:
+                        _merge_time(entry, field, parse_time(value))
+        self._modify(update)
+
+    def set_bytes(self, key, size):
+        def update(entries):
+            if key in entries:
+                entries[key]["bytes"] = size
+        self._modify(update)
+
+    def remove(self, key):
+        self._modify(lambda entries: entries.pop(key, None))
+
+    def rebuild(self, store):
+        """Scan the partitions that have no manifest entry yet (once, at startup)."""
+        known = self.entries()
+        for path in store.partitions():
+            key = store.key_of(path)
+            if key in known:
+                continue
+            df = store.read(path, columns=list(TIME_FIELDS))
+            records = df.to_dict(orient="records") if not df.empty else [{}] * store.count(path)
+            stats = stats_of(records, partition_bytes(store, path), schema_version=0)
+            self._modify(lambda entries, key=key, stats=stats: entries.setdefault(key, stats))
+
+    def overlaps(self, key, start=None, end=None, field="session_start_time", entries=None):
+        """False only if the manifest proves no row of the partition has ``field`` in [start, end).
+
+        A query planning many partitions passes ``entries`` (from ``entries()``,
+        read once) instead of copying the manifest for every partition.
+        """
+        entry = (self.entries() if entries is None else entries).get(key)
+        if entry is None or entry[f"min_{field}"] is None:
+            return True
+        if end is not None and parse_time(entry[f"min_{field}"]) >= end:
+            return False
+        if start is not None and parse_time(entry[f"max_{field}"]) < start:
+            return False
+        return True
+
+    def _refresh(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._mtime:
+            with open(self.path, encoding="utf-8") as f:
+                self._entries = json.load(f)
+            self._mtime = mtime
+
+    def _modify(self, update):
+        # Read-modify-write under a file lock, so worker processes do not lose each other's updates.
+        with self._lock, open(self.path + ".lock", "w") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            self._mtime = None
+            self._refresh()
+            update(self._entries)
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+            self._mtime = os.stat(self.path).st_mtime_ns
+
+
+def partition_bytes(store, path):
+    """Bytes on disk of one partition."""
+    total = 0
+    for file in store.files(path):
+        try:
+            total += os.path.getsize(file)
+        except (FileNotFoundError, TypeError):
+            pass
+    return total
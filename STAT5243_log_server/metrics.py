@@ -0,0 +1,119 @@
+"""Prometheus-style instrumentation behind /metrics.
+
+A minimal in-process registry (counters, gauges read at scrape time and
+histograms) rendered in the Prometheus text exposition format, so no client
+library is needed. With several worker processes (LOG_SHARDED=1) every worker
+reports its own numbers; scrape each one or aggregate in Prometheus.
+"""
+import threading
+
+# Seconds; request and flush latencies of a small instance fall in this range.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_labels(self.label_names, key)} {value}"
+
+
+class Gauge:
+    """A value read from ``fn()`` at scrape time."""
+
+    def __init__(self, name, help, fn=None):
+        self.name, self.help, self.fn = name, help, fn
+        _registry.append(self)
+
+    def collect(self):
+        if self.fn is None:
+            return
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {self.fn()}"
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0, 0.0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            series[1] += 1
+            series[2] += value
+
+    def collect(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._series.items())
+        for key, (counts, count, total) in series:
+            for bound, n in zip(self.buckets, counts):
+                labels = _labels(self.label_names + ("le",), key + (repr(float(bound)),))
+                yield f"{self.name}_bucket{labels} {n}"
+            yield f"{self.name}_bucket{_labels(self.label_names + ('le',), key + ('+Inf',))} {count}"
+            yield f"{self.name}_sum{_labels(self.label_names, key)} {total}"
+            yield f"{self.name}_count{_labels(self.label_names, key)} {count}"
+
+
+def render():
+    """The whole registry in the Prometheus text format."""
+    return "\n".join(line for metric in _registry for line in metric.collect()) + "\n"
+
+
+REQUEST_LATENCY = Histogram("log_request_duration_seconds", "HTTP request latency by route.",
+                            labels=("route", "method", "status"))
+FLUSH_DURATION = Histogram("log_flush_duration_seconds", "Time to commit one batch of queued records to storage.")
+RECORDS_WRITTEN = Counter("log_records_written_total", "Records committed to storage, by partition.",
+                          labels=("experiment", "partition"))
+BYTES_WRITTEN = Counter("log_bytes_written_total", "Bytes added to storage, by partition.",
+                        labels=("experiment", "partition"))
+PARSE_FAILURES = Counter("log_parse_failures_total", "Request bodies or records that could not be parsed.",
+                         labels=("endpoint", "reason"))
+LATE_RECORDS = Counter("log_late_records_total",
+                       "Records filed into a partition older than the current one (by session_start_time).",
+                       labels=("experiment",))
+RECORDS_RECEIVED = Counter("log_records_received_total", "Records received, by outcome.",
+                           labels=("experiment", "outcome"))
+QUEUE_DEPTH_GAUGE = Gauge("log_ingest_queue_depth", "Records queued and not yet committed.")
+QUEUE_CAPACITY_GAUGE = Gauge("log_ingest_queue_capacity", "Maximum number of queued records (LOG_QUEUE_DEPTH per experiment).")
@@ -0,0 +1,167 @@
+"""Range queries over the log partitions, behind /logs.
+
+A query names a ``session_start_time`` range, optionally a group and the
+columns to return. Partitions are keyed by the UTC day (or hour) of their
+sessions' ``session_start_time`` (see writer.partition_of), so those before the
+range are skipped by their key; the others by their manifest entry, then files by
+their min/max ``session_start_time``. The remaining files are read in chunks with
+only the needed columns, so memory stays bounded by the chunk size. A record
+whose start time was more than an hour ahead of the server clock is filed under
+its arrival day instead and is missed by a range starting after that day.
+"""
+import os
+import threading
+
+
+from schema import TIMESTAMP_COLUMNS, iso_time, to_timestamps
+
+CHUNK_SIZE = 10000
+
+_ranges = {}
+_ranges_lock = threading.Lock()
+
+
+def file_time_range(store, path):
+    """(min, max) session_start_time of one physical file, cached until it changes."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None, None  # not a file (SQLite partition) or compacted away meanwhile
+    version = (st.st_size, st.st_mtime_ns)
+    with _ranges_lock:
+        cached = _ranges.get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    lo = hi = None
+    for chunk in store.iter_chunks(path, ["session_start_time"], CHUNK_SIZE):
+        if "session_start_time" not in chunk.columns:
+            break
+        times = to_timestamps(chunk["session_start_time"]).dropna()
+        if times.empty:
+            continue
+        lo = times.min() if lo is None else min(lo, times.min())
+        hi = times.max() if hi is None else max(hi, times.max())
+    with _ranges_lock:
+        _ranges[path] = (version, (lo, hi))
+    return lo, hi
+
+
+def _partitions(store, start, end, manifest, entries=None):
+    """Partitions that may hold sessions with session_start_time in [start, end)."""
+    start_key = store.partition_key(start.to_pydatetime()) if start is not None else None
+    if manifest is not None and entries is None:
+        entries = manifest.entries()  # once per query, not per partition
+    for path in store.partitions():
+        if start_key is not None and store.key_of(path) < start_key:
+            continue
+        if manifest is not None and not manifest.overlaps(store.key_of(path), start, end, entries=entries):
+            continue
+        yield path
+
+
+def range_columns(store, start=None, end=None, manifest=None):
+    """Union of the columns of the partitions a query over [start, end) reads, in first-seen order.
+
+    Taken from the store's fixed schema or the manifest entries; only the
+    header of files in partitions whose entry has no columns is read.
+    """
+    import pandas as pd
+
+    if store.columns is not None:
+        return list(store.columns)
+    start = pd.Timestamp(start) if start else None
+    end = pd.Timestamp(end) if end else None
+    entries = manifest.entries() if manifest is not None else {}
+    columns = {}
+    for path in _partitions(store, start, end, manifest, entries):
+        entry = entries.get(store.key_of(path))
+        if entry is not None and entry.get("columns"):
+            columns.update(dict.fromkeys(entry["columns"]))
+            continue
+        for file in store.files(path):
+            if os.path.getsize(file):
+                columns.update(dict.fromkeys(next(store.iter_chunks(file, None, 1)).columns))
+    return list(columns)
+
+
+def iter_range(store, start=None, end=None, group=None, columns=None, chunksize=CHUNK_SIZE, manifest=None):
+    """Yield DataFrames of the sessions with session_start_time in [start, end).
+
+    With a manifest (see manifest.py), partitions whose recorded
+    session_start_time range misses [start, end) are skipped unopened. A store
+    with its own ``iter_range`` (SQLite) selects the range itself.
+    """
+    import pandas as pd
+
+    start = pd.Timestamp(start) if start else None
+    end = pd.Timestamp(end) if end else None
+
+    filters = (["session_start_time"] if start is not None or end is not None else []) + (["group"] if group else [])
+    read_columns = None if columns is None else list(dict.fromkeys(columns + filters))
+
+    if hasattr(store, "iter_range"):
+        # An index lookup, so the chunks only hold rows in range.
+        chunks, in_range = store.iter_range(start, end, read_columns, chunksize), True
+    else:
+        chunks, in_range = _file_chunks(store, start, end, read_columns, chunksize, manifest), False
+    for chunk in chunks:
+        if not in_range and (start is not None or end is not None):
+            times = to_timestamps(chunk["session_start_time"]) if "session_start_time" in chunk.columns \
+                else pd.Series(pd.NaT, index=chunk.index)
+            keep = times.notna()
+            if start is not None:
+                keep &= times >= start
+            if end is not None:
+                keep &= times < end
+            chunk = chunk[keep]
+        if group:
+            chunk = chunk[chunk["group"].astype(str) == group] if "group" in chunk.columns else chunk.iloc[0:0]
+        if columns is not None:
+            chunk = chunk[[c for c in columns if c in chunk.columns]]
+        if not chunk.empty:
+            yield chunk
+
+
+def _file_chunks(store, start, end, columns, chunksize, manifest):
+    # Chunks of the files whose session_start_time range may overlap [start, end).
+    for path in _partitions(store, start, end, manifest):
+        for file in store.files(path):
+            if start is not None or end is not None:
+                lo, hi = file_time_range(store, file)
+                if lo is not None and ((end is not None and lo >= end) or (start is not None and hi < start)):
+                    continue
+            yield from store.iter_chunks(file, columns, chunksize)
+
+
+def _iso_times(chunk):
+    # Timestamps are stored as epoch µs (or ISO strings in older partitions); emit ISO strings.
+    for column in TIMESTAMP_COLUMNS:
+        if column in chunk.columns:
+            chunk[column] = chunk[column].map(iso_time)
+    return chunk
+
+
+def stream(chunks, fmt="ndjson", columns=None):
+    """Encode DataFrame chunks as NDJSON lines or as one CSV with a single header.
+
+    The CSV header is ``columns`` if given (see ``range_columns``), else the
+    columns of the first chunk: columns only later chunks have are dropped.
+    """
+    import pandas as pd
+
+    chunks = (_iso_times(chunk) for chunk in chunks)
+    if fmt == "csv":
+        header = columns
+        if header is not None:
+            yield pd.DataFrame(columns=header).to_csv(index=False)
+        for chunk in chunks:
+            if header is None:
+                header = list(chunk.columns)
+                yield chunk.to_csv(index=False)
+                continue
+            yield chunk.reindex(columns=header).to_csv(index=False, header=False)
+        return
+    for chunk in chunks:
+        text = chunk.to_json(orient="records", lines=True, date_format="iso", default_handler=str)
+        yield text if text.endswith("\n") else text + "\n"
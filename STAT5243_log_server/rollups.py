@@ -0,0 +1,164 @@
+"""Per-minute and per-hour rollups behind /rollups.
+
+Time-series charts of experiment traffic used to rescan the raw sessions.
+The writer now adds every committed batch to per-group counters for each
+minute and each hour of ``session_start_time`` (UTC), kept in
+``<log_dir>/rollups.db`` next to the partitions: sessions, clicks, errors,
+downloads and the sum and count of ``total_session_time``. A chart of a day
+reads 24 hourly (or 1440 minute) rows per group.
+
+Counters are added, not merged, so a batch must be added once only. The
+writer passes the name of the journal segment a batch came from, and it is
+recorded in ``applied`` in the transaction that adds the batch: when the
+segment is replayed after a crash between the write and its removal, it is
+skipped here (although, like the partitions themselves, the raw rows are
+written again). Names of removed segments are pruned from time to time.
+"""
+import glob
+import os
+import sqlite3
+import threading
+
+from schema import CLICK_COLUMNS, ERROR_COLUMNS, parse_time, session_metrics
+
+# Bucket of a start time per resolution; ISO strings that sort in time order.
+RESOLUTIONS = {"minute": "%Y-%m-%dT%H:%M:00", "hour": "%Y-%m-%dT%H:00:00"}
+COUNTERS = ["sessions", "clicks", "errors", "downloads", "session_time_sum", "session_time_n"]
+
+
+class Rollups:
+    def __init__(self, log_dir, db_name="rollups.db"):
+        self.log_dir = log_dir
+        self.db_path = os.path.join(log_dir, db_name)
+        self._lock = threading.Lock()
+        self._adds = 0
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS rollups (resolution TEXT NOT NULL, bucket TEXT NOT NULL, '
+            '"group" TEXT NOT NULL, sessions INTEGER NOT NULL, clicks INTEGER NOT NULL, errors INTEGER NOT NULL, '
+            'downloads INTEGER NOT NULL, session_time_sum REAL NOT NULL, session_time_n INTEGER NOT NULL, '
+            'PRIMARY KEY (resolution, bucket, "group")) WITHOUT ROWID')
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS applied (segment TEXT NOT NULL, key TEXT NOT NULL, "
+            "PRIMARY KEY (segment, key)) WITHOUT ROWID")
+        self._conn.commit()
+        self.seeded = self._is_seeded()
+
+        self._upsert = (
+            f'INSERT INTO rollups (resolution, bucket, "group", {", ".join(COUNTERS)}) '
+            f'VALUES (?, ?, ?, {", ".join("?" for _ in COUNTERS)}) '
+            'ON CONFLICT (resolution, bucket, "group") DO UPDATE SET '
+            + ", ".join(f"{c} = {c} + excluded.{c}" for c in COUNTERS)
+        )
+        self.prune()
+
+    def seed(self, store):
+        """Roll up the partitions already on disk, when the database is created next to existing logs."""
+        if self.seeded:
+            return
+        wanted = ["group", "session_start_time", "session_end_time", "total_session_time"]
+        wanted += CLICK_COLUMNS + ERROR_COLUMNS
+        buckets = {}
+        for path in store.partitions():
+            self._buckets(store.read(path, columns=wanted).to_dict(orient="records"), buckets)
+        with self._lock, self._conn:
+            # Worker processes started together all find the database unseeded; checking
+            # again inside the write transaction lets only the first one add its counters.
+            self._conn.execute("BEGIN IMMEDIATE")
+            if not self._is_seeded():
+                self._conn.executemany(self._upsert, [[*bucket, *counters] for bucket, counters in buckets.items()])
+                self._conn.execute("PRAGMA user_version = 1")
+        self.seeded = True
+
+    def _is_seeded(self):
+        # Marked by user_version: logs without start times leave the table empty, and an
+        # empty table would be rescanned on every start. Older databases have rows instead.
+        return (self._conn.execute("PRAGMA user_version").fetchone()[0] >= 1
+                or self._conn.execute("SELECT COUNT(*) FROM rollups").fetchone()[0] > 0)
+
+    def add(self, key, records, segment=None):
+        """Add records written to partition ``key`` to the counters of their minute and hour.
+
+        Records of a journal ``segment`` whose batch for ``key`` was already added are skipped.
+        """
+        buckets = self._buckets(records)
+        if not buckets:
+            return
+        with self._lock, self._conn:
+            if segment is not None:
+                cursor = self._conn.execute("INSERT OR IGNORE INTO applied (segment, key) VALUES (?, ?)",
+                                            [segment, key])
+                if not cursor.rowcount:
+                    return  # replayed from the journal
+            self._conn.executemany(self._upsert, [[*bucket, *counters] for bucket, counters in buckets.items()])
+            self._adds += 1
+        if self._adds % 1000 == 0:
+            self.prune()
+
+    def prune(self):
+        """Forget the segments no longer on disk: they cannot be replayed."""
+        with self._lock, self._conn:
+            # Listed inside the write transaction: a segment is on disk before its batch is added.
+            self._conn.execute("BEGIN IMMEDIATE")
+            segments = {os.path.basename(p) for p in glob.glob(os.path.join(self.log_dir, "journal_*.wal"))}
+            stale = [row for row in self._conn.execute("SELECT DISTINCT segment FROM applied")
+                     if row[0] not in segments]
+            self._conn.executemany("DELETE FROM applied WHERE segment = ?", stale)
+
+    @staticmethod
+    def _buckets(records, buckets=None):
+        """Counters of records per (resolution, bucket, group), added to ``buckets``."""
+        buckets = {} if buckets is None else buckets
+        for record in records:
+            started = parse_time(record.get("session_start_time"))
+            if started is None:
+                continue
+            group = record.get("group")
+            group = "" if group is None or group != group else str(group)
+            metrics = session_metrics(record)
+            seconds = metrics["total_session_time"]
+            row = (1, int(metrics["total_clicked_count"]), int(metrics["total_error_count"]),
+                   _count(record.get("download_button_clicked_count")), seconds or 0.0, 0 if seconds is None else 1)
+            for resolution, fmt in RESOLUTIONS.items():
+                counters = buckets.setdefault((resolution, started.strftime(fmt), group), [0] * len(COUNTERS))
+                for i, value in enumerate(row):
+                    counters[i] += value
+        return buckets
+
+    def query(self, resolution="hour", start=None, end=None, group=None):
+        """Rows of the buckets of one resolution that overlap [start, end), in time order."""
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"resolution must be one of {', '.join(RESOLUTIONS)}")
+        sql = f'SELECT bucket, "group", {", ".join(COUNTERS)} FROM rollups WHERE resolution = ?'
+        params = [resolution]
+        if start is not None:
+            sql += " AND bucket >= ?"
+            params.append(start.strftime(RESOLUTIONS[resolution]))
+        if end is not None:
+            sql += " AND bucket < ?"
+            params.append(end.isoformat(timespec="seconds"))
+        if group is not None:
+            sql += ' AND "group" = ?'
+            params.append(group)
+        with self._lock:
+            rows = self._conn.execute(sql + ' ORDER BY bucket, "group"', params).fetchall()
+        result = []
+        for bucket, group, sessions, clicks, errors, downloads, time_sum, time_n in rows:
+            result.append({
+                "time": bucket,
+                "group": group,
+                "sessions": sessions,
+                "clicks": clicks,
+                "errors": errors,
+                "downloads": downloads,
+                "mean_session_time": time_sum / time_n if time_n else None,
+            })
+        return result
+
+
+def _count(value):
+    if value is None or value != value or value == "":
+        return 0
+    return int(float(value))
@@ -0,0 +1,360 @@
+"""Column layout and types of the session records.
+
+The Shiny apps send a varying number of ``operation_nameN`` /
+``operation_is_errorN`` columns plus the raw ``operation_names`` /
+``operation_errors`` lists. In the normalized layout a session keeps only the
+fixed SESSION_COLUMNS and its operations go to a long table with one row per
+operation.
+
+At ingest every record is checked against SESSION_SCHEMA by a validator
+compiled once at import. Timestamps are stored as int64 microseconds since
+the Unix epoch (naive ISO strings are taken as UTC) and counters as ints, so
+consumers do not parse strings. Partitions written before schema version 2
+hold ISO strings; ``to_timestamps`` and ``parse_time`` read both.
+
+``derive_metrics`` then adds the DERIVED_COLUMNS that cleaning.ipynb used to
+compute from the raw CSV (totals, rates and per-operation counts), with the
+notebook's formulas, so stored partitions are ready for ab_test_analysis.py.
+"""
+import ast
+import math
+import numbers
+from datetime import datetime, timedelta, timezone
+
+# Bumped whenever the stored representation of a session changes (see manifest.py).
+# 1: values as sent; 2: typed, timestamps in epoch microseconds; 3: with DERIVED_COLUMNS.
+SCHEMA_VERSION = 3
+
+# Operations counted per session by cleaning.ipynb (as "<keyword>_error_count").
+OPERATION_KEYWORDS = ["normalize", "one_hot", "box_cox", "convert_date"]
+DERIVED_COLUMNS = [
+    "total_clicked_count",
+    "total_error_count",
+    "total_clicked_rate",
+    "total_error_rate",
+    *(f"{keyword}_error_count" for keyword in OPERATION_KEYWORDS),
+]
+
+SESSION_COLUMNS = [
+    "user_id",
+    "group",
+    "session_start_time",
+    "session_end_time",
+    "total_session_time",
+    "apply_fe_button_clicked_count",
+    "apply_fe_button_error_count",
+    "revert_button_clicked_count",
+    "revert_button_error_count",
+    "download_button_clicked_count",
+    "download_button_error_count",
+    "download_button_clicked_time",
+    "apply_fe_button_clicked_rate",
+    "revert_button_clicked_rate",
+    "download_button_clicked_rate",
+    "has_error",
+    *DERIVED_COLUMNS,
+]
+
+OPERATION_COLUMNS = ["session_id", "seq", "op_name", "error"]
+
+CLICK_COLUMNS = ["apply_fe_button_clicked_count", "revert_button_clicked_count", "download_button_clicked_count"]
+ERROR_COLUMNS = ["apply_fe_button_error_count", "revert_button_error_count", "download_button_error_count"]
+TIMESTAMP_COLUMNS = ["session_start_time", "session_end_time", "download_button_clicked_time"]
+
+# field: (type, required). Fields not listed here (operation_nameN, ...) pass through unchanged.
+SESSION_SCHEMA = {
+    "user_id": ("str", True),
+    "group": ("str", False),
+    **{c: ("timestamp", False) for c in TIMESTAMP_COLUMNS},
+    **{c: ("count", False) for c in CLICK_COLUMNS + ERROR_COLUMNS},
+    "total_session_time": ("float", False),
+    "apply_fe_button_clicked_rate": ("float", False),
+    "revert_button_clicked_rate": ("float", False),
+    "download_button_clicked_rate": ("float", False),
+    "has_error": ("bool", False),
+    "operation_names": ("list", False),
+    "operation_errors": ("list", False),
+}
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def _is_blank(value):
+    return value is None or value == "" or (isinstance(value, float) and math.isnan(value))
+
+
+def operations_of(record):
+    """Return ``[(op_name, error), ...]`` for a record in either payload shape."""
+    names = record.get("operation_names")
+    if isinstance(names, str) and names.startswith("["):
+        names = ast.literal_eval(names)  # list written to CSV as its repr
+    if names is not None and not isinstance(names, (str, float)):
+        names = list(names)
+        errors = record.get("operation_errors")
+        if isinstance(errors, str) and errors.startswith("["):
+            errors = ast.literal_eval(errors)
+        errors = [] if errors is None or isinstance(errors, (str, float)) else list(errors)
+        errors = errors + [None] * (len(names) - len(errors))
+        return list(zip(names, errors))
+
+    # Wide layout: operation_name1, operation_is_error1, operation_name2, ...
+    operations = []
+    i = 1
+    while f"operation_name{i}" in record:
+        name = record[f"operation_name{i}"]
+        if not _is_blank(name):
+            operations.append((name, record.get(f"operation_is_error{i}")))
+        i += 1
+    return operations
+
+
+def split_records(records):
+    """Split raw records into ``(session_rows, operation_rows)``."""
+    sessions, operations = [], []
+    for record in records:
+        sessions.append({c: record.get(c) for c in SESSION_COLUMNS})
+        session_id = record.get("user_id")
+        for seq, (name, error) in enumerate(operations_of(record), 1):
+            operations.append({
+                "session_id": session_id,
+                "seq": seq,
+                "op_name": name,
+                "error": None if _is_blank(error) else str(error),
+            })
+    return sessions, operations
+
+
+def _number(value):
+    if _is_blank(value):
+        return 0
+    return float(value)
+
+
+class ValidationError(ValueError):
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join(f"{field}: {message}" for field, message in errors.items()))
+
+
+def _to_str(value):
+    if isinstance(value, (dict, list, bool)):
+        raise TypeError("expected a string")
+    return str(value)
+
+
+def _to_count(value):
+    if isinstance(value, bool):
+        raise TypeError("expected an integer")
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError("expected an integer")
+        value = int(value)
+    elif not isinstance(value, int):
+        value = int(value)  # numeric strings
+    if value < 0:
+        raise ValueError("must not be negative")
+    return value
+
+
+def _to_float(value):
+    if isinstance(value, bool):
+        raise TypeError("expected a number")
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+def _to_bool(value):
+    if isinstance(value, bool):
+        return value
+    if value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    raise TypeError("expected true or false")
+
+
+def _to_list(value):
+    if not isinstance(value, (list, tuple)):
+        raise TypeError("expected a list")
+    return list(value)
+
+
+def to_epoch_us(value):
+    """Epoch microseconds of an ISO string, datetime or (already) epoch-µs integer."""
+    if isinstance(value, bool):
+        raise TypeError("expected a timestamp")
+    if isinstance(value, int):
+        return value
+    if not isinstance(value, datetime):
+        if not isinstance(value, str):
+            raise TypeError("expected an ISO 8601 timestamp")
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+_CONVERTERS = {
+    "str": _to_str,
+    "count": _to_count,
+    "float": _to_float,
+    "bool": _to_bool,
+    "list": _to_list,
+    "timestamp": to_epoch_us,
+}
+
+
+def compile_schema(schema):
+    """Build a ``validate(record) -> typed record`` function for a field schema.
+
+    The per-field converters are looked up once here, so validating a record
+    is one pass over the schema. Raises ValidationError listing every bad field.
+    """
+    fields = [(name, _CONVERTERS[kind], required) for name, (kind, required) in schema.items()]
+
+    def validate(record):
+        if not isinstance(record, dict):
+            raise ValidationError({"record": "must be a JSON object"})
+        typed, errors = dict(record), None
+        for name, convert, required in fields:
+            value = record.get(name)
+            if value is None or value == "":
+                if required:
+                    errors = errors or {}
+                    errors[name] = "is required"
+                elif name in record:
+                    typed[name] = None
+                continue
+            try:
+                typed[name] = convert(value)
+            except (TypeError, ValueError, OverflowError) as e:
+                errors = errors or {}
+                errors[name] = str(e) or "invalid value"
+        if errors:
+            raise ValidationError(errors)
+        return typed
+
+    return validate
+
+
+validate_session = compile_schema(SESSION_SCHEMA)
+
+
+def parse_time(value):
+    """Naive UTC datetime of a stored timestamp (epoch µs or ISO string), or None."""
+    if _is_blank(value) or value != value:  # value != value: NaT
+        return None
+    if isinstance(value, str) and value.isdigit():
+        value = int(value)  # epoch µs read back from a CSV column that also holds ISO strings
+    if isinstance(value, numbers.Real) and not isinstance(value, bool):  # numbers.Real: numpy ints too
+        return EPOCH + timedelta(microseconds=int(value))
+    if not isinstance(value, datetime):
+        try:
+            value = datetime.fromisoformat(str(value))
+        except ValueError:
+            return None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def parse_query_time(value):
+    """Naive UTC datetime of a ``from``/``to`` query parameter, or None if it is not given.
+
+    Stricter than parse_time, which reads stored values: a query names an ISO
+    8601 date or time (``2025-04-18``, ``20250418``, ``2025-04-18T10:00:00+02:00``),
+    never epoch µs, and anything else raises ValueError instead of being ignored.
+    """
+    if value is None or value == "":
+        return None
+    try:
+        value = datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        raise ValueError(f"{value!r} is not an ISO 8601 date or time, e.g. 2025-04-18") from None
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def iso_time(value):
+    """ISO string of a stored timestamp, or None."""
+    value = parse_time(value)
+    return None if value is None else value.isoformat()
+
+
+def to_timestamps(values):
+    """datetime64 Series of stored timestamps, epoch µs and ISO strings alike."""
+    import pandas as pd
+
+    values = pd.Series(values)
+    numeric = pd.to_numeric(values, errors="coerce")
+    times = pd.to_datetime(numeric, unit="us", errors="coerce")
+    text = numeric.isna() & values.notna()
+    if text.any():
+        parsed = pd.to_datetime(values[text].astype(str), errors="coerce", format="ISO8601", utc=True)
+        times[text] = parsed.dt.tz_localize(None)
+    return times
+
+
+def max_time(values):
+    """ISO string of the latest stored timestamp among values, or None."""
+    times = to_timestamps(values).dropna()
+    return times.max().isoformat() if len(times) else None
+
+
+def session_time(record):
+    """total_session_time in seconds, from the payload or its start/end times."""
+    value = record.get("total_session_time")
+    if not _is_blank(value):
+        return float(value)
+    start, end = parse_time(record.get("session_start_time")), parse_time(record.get("session_end_time"))
+    if start is None or end is None:
+        return None
+    return (end - start).total_seconds()
+
+
+def _rate(count, seconds):
+    # The notebook divides by zero-length sessions too (inf); JSON has no inf.
+    if _is_blank(count) or not seconds:
+        return None
+    return float(count) / seconds
+
+
+# What derive_metrics raises on a record that was not validated (LOG_VALIDATE=0),
+# e.g. a count of "abc" or an operation_names string that is not a list.
+DERIVE_ERRORS = (AttributeError, TypeError, ValueError, SyntaxError, OverflowError)
+
+
+def derive_metrics(record):
+    """Add the cleaning.ipynb columns to a record (in place) and return it.
+
+    total_session_time is recomputed from the start/end times when both are
+    present, as in the notebook; otherwise the value sent by the app is kept.
+    """
+    start, end = parse_time(record.get("session_start_time")), parse_time(record.get("session_end_time"))
+    if start is not None and end is not None:
+        record["total_session_time"] = (end - start).total_seconds()
+    seconds = session_time(record)
+
+    clicked = sum(int(_number(record.get(c))) for c in CLICK_COLUMNS)
+    errors = sum(int(_number(record.get(c))) for c in ERROR_COLUMNS)
+    record["total_clicked_count"] = clicked
+    record["total_error_count"] = errors
+    for column in CLICK_COLUMNS:
+        record[column.replace("_count", "_rate")] = _rate(record.get(column), seconds)
+    record["total_clicked_rate"] = _rate(clicked, seconds)
+    record["total_error_rate"] = _rate(errors, seconds)
+
+    names = [str(name) for name, _ in operations_of(record)]
+    for keyword in OPERATION_KEYWORDS:
+        record[f"{keyword}_error_count"] = sum(keyword in name for name in names)
+    return record
+
+
+def session_metrics(record):
+    """The per-session metrics compared between groups."""
+    return {
+        "total_session_time": session_time(record),
+        "total_clicked_count": sum(_number(record.get(c)) for c in CLICK_COLUMNS),
+        "total_error_count": sum(_number(record.get(c)) for c in ERROR_COLUMNS),
+    }
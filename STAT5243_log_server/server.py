@@ -1,57 +1,187 @@
-from flask import Flask, request, jsonify
-import pandas as pd
 import os
-from datetime import datetime
-import glob
+import time
+
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from ingest import (MAX_BATCH_BYTES, MAX_RECORD_BYTES, RETRY_AFTER, body_too_large, get_experiment, group_counts,
+                    ingest_batch, ingest_record, invalid_json, list_experiments, query_logs, query_rollups,
+                    queue_status, stream_options, unique_user_counts)
+from live_status import sse_stream
+from metrics import CONTENT_TYPE, REQUEST_LATENCY, render
 
 app = Flask(__name__)
-LOG_DIR = "logs"
-os.makedirs(LOG_DIR, exist_ok=True)
+# Upper bound for bodies sent without Content-Length (chunked).
+app.config["MAX_CONTENT_LENGTH"] = MAX_BATCH_BYTES
+
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_latency(response):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    REQUEST_LATENCY.observe(time.perf_counter() - g.request_started,
+                            route=route, method=request.method, status=response.status_code)
+    return response
+
+
+def ingest_response(payload, code):
+    headers = {"Retry-After": str(RETRY_AFTER)} if code == 429 else {}
+    return jsonify(payload), code, headers
 
 @app.route("/")
 def hello():
     return " STAT5243 Log Server is running!"
 
+# Every route below also serves one experiment under /experiments/<name>/...;
+# without the prefix it serves the default experiment (see ingest.py).
+@app.route("/experiments", methods=["GET"])
+def experiments():
+    return jsonify(list_experiments()), 200
+
 @app.route("/log", methods=["POST"])
-def receive_log():
+@app.route("/experiments/<name>/log", methods=["POST"])
+def receive_log(name=None):
     try:
-        data = request.get_json()
-        print(" Received log:", data)
-        if not data:
-            return jsonify({"error": "No JSON received"}), 400
-
-        now = datetime.now().strftime("%Y%m%d")
-        log_file = os.path.join(LOG_DIR, f"session_log_{now}.csv")
-
-        df = pd.DataFrame([data])
-        write_header = not os.path.exists(log_file)
-        df.to_csv(log_file, mode='a', index=False, header=write_header)
+        if (request.content_length or 0) > MAX_RECORD_BYTES:
+            return ingest_response(*body_too_large(MAX_RECORD_BYTES))
+        data = request.get_json(silent=True)
+        if data is None and request.get_data():
+            return ingest_response(*invalid_json())
+        payload, code = ingest_record(data, request.headers.get("Idempotency-Key"), name)
+        return ingest_response(payload, code)
+    except RequestEntityTooLarge:
+        return ingest_response(*body_too_large(MAX_BATCH_BYTES))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        return jsonify({"status": " Log saved"}), 200
+@app.route("/log/batch", methods=["POST"])
+@app.route("/experiments/<name>/log/batch", methods=["POST"])
+def receive_log_batch(name=None):
+    try:
+        payload, code = ingest_batch(
+            request.get_data(),
+            request.content_type or "",
+            request.headers.get("Content-Encoding", ""),
+            name,
+        )
+        return ingest_response(payload, code)
+    except RequestEntityTooLarge:
+        return ingest_response(*body_too_large(MAX_BATCH_BYTES))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route("/status", methods=["GET"])
-def status():
+@app.route("/experiments/<name>/status", methods=["GET"])
+def status(name=None):
     try:
-        log_files = sorted(glob.glob(os.path.join(LOG_DIR, "session_log_*.csv")))
-        if not log_files:
+        experiment, error = get_experiment(name)
+        if error is not None:
+            return ingest_response(*error)
+        payload, etag = experiment.live_status.snapshot(last_n=3)
+        if payload is None:
             return {"error": "No log files found"}, 404
 
-        latest_file = log_files[-1]
-        df = pd.read_csv(latest_file)
+        response = jsonify(payload)
+        response.set_etag(etag)
+        return response.make_conditional(request)
+    except Exception as e:
+        return {"error": str(e)}, 500
 
-        last_logs = df.tail(3).to_dict(orient="records")
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(render(), content_type=CONTENT_TYPE)
 
-        return {
-            "columns": df.columns.tolist(),
-            "total_logs": len(df),
-            "latest_time": df["session_end_time"].max() if "session_end_time" in df.columns else None,
-            "last_logs": last_logs 
-        }
+@app.route("/manifest", methods=["GET"])
+@app.route("/experiments/<name>/manifest", methods=["GET"])
+def partition_manifest(name=None):
+    experiment, error = get_experiment(name)
+    if error is not None:
+        return ingest_response(*error)
+    return jsonify(experiment.manifest.entries()), 200
+
+@app.route("/queue", methods=["GET"])
+@app.route("/experiments/<name>/queue", methods=["GET"])
+def queue(name=None):
+    experiment, error = get_experiment(name)
+    if error is not None:
+        return ingest_response(*error)
+    return jsonify(queue_status(experiment)), 200
+
+@app.route("/counts", methods=["GET"])
+@app.route("/experiments/<name>/counts", methods=["GET"])
+def counts(name=None):
+    try:
+        experiment, error = get_experiment(name)
+        if error is not None:
+            return ingest_response(*error)
+        return ingest_response(*group_counts(experiment, request.args))
     except Exception as e:
-        return {"error": str(e)}, 500
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/counts/users", methods=["GET"])
+@app.route("/experiments/<name>/counts/users", methods=["GET"])
+def user_counts(name=None):
+    try:
+        experiment, error = get_experiment(name)
+        if error is not None:
+            return ingest_response(*error)
+        return ingest_response(*unique_user_counts(experiment, request.args))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/metrics/ab", methods=["GET"])
+@app.route("/experiments/<name>/metrics/ab", methods=["GET"])
+def metrics_ab(name=None):
+    try:
+        experiment, error = get_experiment(name)
+        if error is not None:
+            return ingest_response(*error)
+        return jsonify(experiment.ab_metrics()), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/rollups", methods=["GET"])
+@app.route("/experiments/<name>/rollups", methods=["GET"])
+def rollups(name=None):
+    try:
+        experiment, error = get_experiment(name)
+        if error is not None:
+            return ingest_response(*error)
+        return ingest_response(*query_rollups(experiment, request.args))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/logs", methods=["GET"])
+@app.route("/experiments/<name>/logs", methods=["GET"])
+def logs(name=None):
+    try:
+        experiment, error = get_experiment(name)
+        if error is not None:
+            return ingest_response(*error)
+        chunks, mimetype, error = query_logs(experiment, request.args)
+        if error is not None:
+            payload, code = error
+            return jsonify(payload), code
+        return Response(stream_with_context(chunks), mimetype=mimetype)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/stream", methods=["GET"])
+@app.route("/experiments/<name>/stream", methods=["GET"])
+def live_stream(name=None):
+    experiment, error = get_experiment(name)
+    if error is not None:
+        return ingest_response(*error)
+    options = stream_options(request.args, request.headers.get("Last-Event-ID"))
+    return Response(sse_stream(experiment.broadcast, **options), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    # The reloader would run the startup (journal recovery, seeding, writer threads) in a
+    # second process, so debug mode is opt-in and never reloads.
+    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)),
+            debug=os.environ.get("LOG_DEBUG", "0") == "1", use_reloader=False)
@@ -0,0 +1,134 @@
+"""Approximate distinct user counts behind /counts/users.
+
+Counting the distinct ``user_id``s of a group used to mean reading every row.
+Instead the writer folds every committed batch into a HyperLogLog sketch per
+(group, day), kept in ``<log_dir>/sketches.db``. A sketch is 2**14 one-byte
+registers (16 KB) whatever the number of users, estimates within about 1%
+(standard error 0.8%), and two sketches merge by taking the register-wise
+maximum. A date range is answered by merging the sketches of its days, one
+group at a time, so the cost follows the number of days, not of sessions.
+
+Merging is idempotent, so a record replayed from the journal or a user seen
+by several worker processes is never counted twice.
+"""
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+from datetime import datetime, time, timedelta
+
+PRECISION = 14
+REGISTERS = 1 << PRECISION
+
+
+class HyperLogLog:
+    def __init__(self, registers=None):
+        self.registers = bytearray(registers) if registers is not None else bytearray(REGISTERS)
+        if len(self.registers) != REGISTERS:
+            raise ValueError(f"expected {REGISTERS} registers, got {len(self.registers)}")
+
+    def add(self, value):
+        x = int.from_bytes(hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest(), "little")
+        # The first PRECISION bits pick the register, the rest give the rank of the first 1 bit.
+        index, rest = x >> (64 - PRECISION), x & ((1 << (64 - PRECISION)) - 1)
+        rank = 64 - PRECISION - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        registers = other.registers if isinstance(other, HyperLogLog) else other
+        self.registers = bytearray(map(max, self.registers, registers))
+        return self
+
+    def count(self):
+        m = REGISTERS
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / math.fsum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small range: linear counting over the empty registers is more accurate.
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+
+class UniqueUsers:
+    def __init__(self, log_dir, key_format, db_name="sketches.db"):
+        self.db_path = os.path.join(log_dir, db_name)
+        self.key_format = key_format
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Like the dedup index: the records are in the journal and the partitions; a sketch can lag a crash.
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS unique_users ("group" TEXT NOT NULL, day TEXT NOT NULL, '
+            'registers BLOB NOT NULL, PRIMARY KEY ("group", day)) WITHOUT ROWID')
+        self._conn.commit()
+        self.seeded = self._conn.execute("SELECT COUNT(*) FROM unique_users").fetchone()[0] > 0
+
+    def seed(self, store):
+        """Sketch the partitions already on disk, when the database is created next to existing logs."""
+        if self.seeded:
+            return
+        for path in store.partitions():
+            df = store.read(path, columns=["user_id", "group"])
+            if "user_id" in df.columns:
+                if "group" not in df.columns:
+                    df["group"] = None
+                self.add(store.key_of(path), df.to_dict(orient="records"))
+        self.seeded = True
+
+    def day_of(self, key):
+        """ISO date of a partition key (partitions are days or hours, in UTC)."""
+        return datetime.strptime(key, self.key_format).date().isoformat()
+
+    def add(self, key, records, segment=None):
+        """Fold the user_ids of records written to partition ``key`` into their groups' sketches.
+
+        ``segment`` (the journal segment of the records) is not needed: merging is idempotent.
+        """
+        sketches = {}
+        for record in records:
+            user_id = record.get("user_id")
+            if user_id is None or user_id != user_id or user_id == "":
+                continue
+            group = record.get("group")
+            group = "" if group is None or group != group else str(group)
+            sketches.setdefault(group, HyperLogLog()).add(user_id)
+        if not sketches:
+            return
+        day = self.day_of(key)
+        with self._lock, self._conn:
+            # Read-merge-write in one write transaction, so worker processes do not lose each other's registers.
+            self._conn.execute("BEGIN IMMEDIATE")
+            for group, sketch in sketches.items():
+                row = self._conn.execute('SELECT registers FROM unique_users WHERE "group" = ? AND day = ?',
+                                         [group, day]).fetchone()
+                if row is not None:
+                    sketch.merge(row[0])
+                self._conn.execute('INSERT OR REPLACE INTO unique_users ("group", day, registers) VALUES (?, ?, ?)',
+                                   [group, day, bytes(sketch.registers)])
+
+    def count(self, start=None, end=None):
+        """Approximate distinct user_ids per group over the days overlapping [start, end)."""
+        sql, params = 'SELECT "group", registers FROM unique_users', []
+        where = []
+        if start is not None:
+            where.append("day >= ?")
+            params.append(start.date().isoformat())
+        if end is not None:
+            # A day that starts at or after end is out of the range.
+            last = end.date() if end.time() != time(0) else end.date() - timedelta(days=1)
+            where.append("day <= ?")
+            params.append(last.isoformat())
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        merged = {}
+        with self._lock:
+            for group, registers in self._conn.execute(sql + ' ORDER BY "group"', params):
+                sketch = merged.get(group)
+                if sketch is None:
+                    merged[group] = HyperLogLog(registers)
+                else:
+                    sketch.merge(registers)
+        return {group: sketch.count() for group, sketch in merged.items()}
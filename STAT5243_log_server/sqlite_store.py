@@ -0,0 +1,267 @@
+"""Embedded SQLite storage for session logs (LOG_STORAGE=sqlite).
+
+Records are stored in the normalized layout (see schema.py): a ``sessions``
+table with the fixed session columns plus the partition key, and a long
+``operations`` table. The database runs in WAL mode, so readers never block
+the writer thread, and each flushed batch is one transaction of prepared
+``executemany`` inserts. Indexes on ``group``, ``session_start_time``,
+``user_id`` and the partition key turn /status, per-group counts and
+date-range queries into index lookups.
+
+A partition is addressed by its key (e.g. ``"20250418"``) wherever the file
+stores use a path. ``export_csv`` writes a partition back out as the wide
+``session_log_<key>.csv`` file the existing tooling reads.
+"""
+import os
+import sqlite3
+import threading
+
+
+from schema import (OPERATION_COLUMNS, SESSION_COLUMNS, TIMESTAMP_COLUMNS, iso_time, parse_time, split_records,
+                    to_epoch_us)
+from storage import PARTITION_FORMATS
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS sessions (
+    partition_key TEXT NOT NULL,
+    {", ".join(_quote(c) for c in SESSION_COLUMNS)}
+);
+CREATE INDEX IF NOT EXISTS sessions_partition ON sessions (partition_key);
+CREATE INDEX IF NOT EXISTS sessions_group ON sessions ("group");
+CREATE INDEX IF NOT EXISTS sessions_start_time ON sessions (session_start_time);
+CREATE INDEX IF NOT EXISTS sessions_user_id ON sessions (user_id);
+
+CREATE TABLE IF NOT EXISTS operations (
+    partition_key TEXT NOT NULL,
+    {", ".join(_quote(c) for c in OPERATION_COLUMNS)}
+);
+CREATE INDEX IF NOT EXISTS operations_session ON operations (session_id);
+"""
+
+
+class SqliteStore:
+    def __init__(self, log_dir, partition="day", db_name="sessions.db"):
+        self.log_dir = log_dir
+        self.key_format = PARTITION_FORMATS[partition]
+        self.columns = SESSION_COLUMNS
+        self.db_path = os.path.join(log_dir, db_name)
+        self._local = threading.local()
+
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        # Databases created before a column was added to SESSION_COLUMNS.
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}
+        for column in SESSION_COLUMNS:
+            if column not in existing:
+                conn.execute(f"ALTER TABLE sessions ADD COLUMN {_quote(column)}")
+        conn.commit()
+
+        cols = ["partition_key"] + SESSION_COLUMNS
+        self._insert_session = (
+            f"INSERT INTO sessions ({', '.join(_quote(c) for c in cols)}) "
+            f"VALUES ({', '.join('?' for _ in cols)})"
+        )
+        cols = ["partition_key"] + OPERATION_COLUMNS
+        self._insert_operation = (
+            f"INSERT INTO operations ({', '.join(_quote(c) for c in cols)}) "
+            f"VALUES ({', '.join('?' for _ in cols)})"
+        )
+
+    def _conn(self):
+        # sqlite3 connections must not be shared between threads.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # FULL: a committed batch is on disk before its journal segment is deleted.
+            conn.execute("PRAGMA synchronous=FULL")
+            self._local.conn = conn
+        return conn
+
+    def partition_key(self, ts):
+        return ts.strftime(self.key_format)
+
+    def partition_path(self, key):
+        return key
+
+    def key_of(self, path):
+        return path
+
+    def partitions(self):
+        rows = self._conn().execute("SELECT DISTINCT partition_key FROM sessions ORDER BY partition_key")
+        return [row[0] for row in rows]
+
+    def files(self, path):
+        return [path]
+
+    def write(self, key, records):
+        """Insert records into the partition; returns the size of the inserted values in bytes.
+
+        The database grows by whole pages, and not at all while pages freed by
+        deletes are reused, so the size is counted from the rows themselves.
+        """
+        sessions, operations = split_records(records)
+        session_rows = [[key] + [_sql_value(s[c]) for c in SESSION_COLUMNS] for s in sessions]
+        operation_rows = [[key] + [_sql_value(o[c]) for c in OPERATION_COLUMNS] for o in operations]
+        conn = self._conn()
+        with conn:
+            conn.executemany(self._insert_session, session_rows)
+            conn.executemany(self._insert_operation, operation_rows)
+        return sum(_value_bytes(value) for row in session_rows + operation_rows for value in row)
+
+    def read(self, path, columns=None):
+        import pandas as pd
+
+        columns = [c for c in (columns or SESSION_COLUMNS) if c in SESSION_COLUMNS]
+        return pd.read_sql_query(
+            f"SELECT {', '.join(_quote(c) for c in columns)} FROM sessions WHERE partition_key = ? ORDER BY rowid",
+            self._conn(), params=[path])
+
+    def iter_chunks(self, path, columns=None, chunksize=10000):
+        import pandas as pd
+
+        columns = [c for c in (columns or SESSION_COLUMNS) if c in SESSION_COLUMNS]
+        cursor = self._conn().execute(
+            f"SELECT {', '.join(_quote(c) for c in columns)} FROM sessions WHERE partition_key = ? ORDER BY rowid",
+            [path])
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                break
+            yield pd.DataFrame(rows, columns=columns)
+
+    def iter_range(self, start=None, end=None, columns=None, chunksize=10000):
+        """Yield the sessions of every partition with session_start_time in [start, end) (naive UTC datetimes).
+
+        The range is a lookup in the sessions_start_time index instead of a
+        scan of each partition; query.iter_range uses this when it is there.
+        """
+        import pandas as pd
+
+        columns = [c for c in (columns or SESSION_COLUMNS) if c in SESSION_COLUMNS]
+        sql, params = f"SELECT {', '.join(_quote(c) for c in columns)} FROM sessions", []
+        if start is not None or end is not None:
+            where, params = _start_time_range(start, end)
+            sql += " WHERE " + where
+        else:
+            sql += " ORDER BY partition_key, rowid"
+        cursor = self._conn().execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                break
+            yield pd.DataFrame(rows, columns=columns)
+
+    def count(self, path):
+        return self._conn().execute("SELECT COUNT(*) FROM sessions WHERE partition_key = ?", [path]).fetchone()[0]
+
+    def tail(self, path, n):
+        import pandas as pd
+
+        df = pd.read_sql_query(
+            f"SELECT {', '.join(_quote(c) for c in SESSION_COLUMNS)} FROM sessions "
+            "WHERE partition_key = ? ORDER BY rowid DESC LIMIT ?",
+            self._conn(), params=[path, n])
+        return df.iloc[::-1].reset_index(drop=True)
+
+    def read_operations(self, path):
+        import pandas as pd
+
+        return pd.read_sql_query(
+            f"SELECT {', '.join(_quote(c) for c in OPERATION_COLUMNS)} FROM operations "
+            "WHERE partition_key = ? ORDER BY rowid",
+            self._conn(), params=[path])
+
+    def summarize(self, path, prev=None, n=3):
+        # Epoch-microsecond integers (schema v2) and ISO strings (older rows) do not compare.
+        latest = self._conn().execute(
+            "SELECT MAX(CASE WHEN typeof(session_end_time) = 'integer' THEN session_end_time END), "
+            "MAX(CASE WHEN typeof(session_end_time) = 'text' THEN session_end_time END) "
+            "FROM sessions WHERE partition_key = ?", [path]).fetchone()
+        latest = [parse_time(t) for t in latest if t is not None]
+        latest_time = max(latest).isoformat() if latest else None
+        return {
+            "columns": SESSION_COLUMNS,
+            "count": self.count(path),
+            "latest_time": latest_time,
+            "tail": self.tail(path, n).to_dict(orient="records"),
+            "mtime": 0,
+        }
+
+    def group_counts(self, start=None, end=None):
+        """Sessions per group, optionally limited to session_start_time in [start, end) (naive UTC datetimes)."""
+        sql, params = 'SELECT "group", COUNT(*) FROM sessions', []
+        if start is not None or end is not None:
+            where, params = _start_time_range(start, end)
+            sql += " WHERE " + where
+        rows = self._conn().execute(sql + ' GROUP BY "group"', params).fetchall()
+        # Same keys as the file stores, where a missing group reads back as "".
+        return {"" if group is None else group: n for group, n in rows}
+
+    def compact(self, path):
+        return False
+
+    def archive(self, path):
+        # Pages are shared by all partitions; there is nothing to compress per partition.
+        return False
+
+    def drop(self, path):
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM sessions WHERE partition_key = ?", [path])
+            conn.execute("DELETE FROM operations WHERE partition_key = ?", [path])
+
+    def export_csv(self, key, log_file=None):
+        """Write one partition as the wide session_log_<key>.csv file."""
+        log_file = log_file or os.path.join(self.log_dir, f"session_log_{key}.csv")
+        sessions = self.read(key)
+        for column in TIMESTAMP_COLUMNS:
+            # Back to ISO strings, the format of the original CSV logs.
+            sessions[column] = sessions[column].map(iso_time)
+        operations = self.read_operations(key)
+        if not operations.empty:
+            wide = operations.drop_duplicates(["session_id", "seq"]).pivot(
+                index="session_id", columns="seq", values=["op_name", "error"])
+            wide.columns = [f"operation_name{seq}" if field == "op_name" else f"operation_is_error{seq}"
+                            for field, seq in wide.columns]
+            order = [c for seq in sorted(operations["seq"].unique())
+                     for c in (f"operation_name{seq}", f"operation_is_error{seq}") if c in wide.columns]
+            sessions = sessions.merge(wide[order], how="left", left_on="user_id", right_index=True)
+        sessions.to_csv(log_file, index=False)
+        return log_file
+
+
+def _start_time_range(start=None, end=None):
+    """WHERE clause and parameters for session_start_time in [start, end) that use sessions_start_time.
+
+    The column holds epoch µs integers (schema v2) and ISO strings (older rows).
+    SQLite sorts every integer before every string and every string before
+    every blob, so each type gets a closed range of its own, which the index
+    can serve: ``''`` bounds the integers from above and ``X''`` the strings.
+    """
+    params = [-2 ** 63 if start is None else to_epoch_us(start), "" if end is None else to_epoch_us(end),
+              "" if start is None else start.isoformat(), b"" if end is None else end.isoformat()]
+    return ("(session_start_time >= ? AND session_start_time < ?) "
+            "OR (session_start_time >= ? AND session_start_time < ?)"), params
+
+
+def _value_bytes(value):
+    # Roughly SQLite's record format: 8-byte numbers, text as UTF-8.
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    return 8
+
+
+def _sql_value(value):
+    if isinstance(value, bool):
+        return int(value)
+    if value is None or isinstance(value, (int, float, str)):
+        return value
+    return str(value)
@@ -0,0 +1,716 @@
+"""Partition storage for session logs.
+
+Logs are split into partitions by arrival time, one per day (default) or per
+hour. Two layouts are supported:
+
+* ``csv``: one ``session_log_<key>.csv`` file per partition, appended to.
+  Records with columns the file's header lacks go to ``session_log_<key>.w1.csv``
+  (``.w2``, ...), started with the wider header.
+* ``parquet`` / ``arrow``: one ``session_log_<key>/`` directory per partition
+  holding immutable part files. Each flush writes a new part; a background
+  compactor merges small parts into one file with large row groups.
+
+Readers go through ``store.read(partition, columns)`` so columnar partitions
+only load the columns they are asked for. A partition may consist of several
+files (CSV shards, Parquet/Arrow parts); ``store.files(partition)`` lists
+them and every reader merges them.
+
+With ``layout="normalized"`` each record is split into a fixed-schema row of
+``session_log_<key>`` and one row per operation in ``operation_log_<key>``.
+
+Old partitions are archived (CSV files gzipped to ``.csv.gz``, columnar parts
+rewritten as one zstd-compressed file) and, past the retention period,
+deleted by the Retention job; readers handle archived files transparently.
+"""
+import collections
+import contextlib
+import csv
+import functools
+import glob
+import gzip
+import io
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+from schema import (OPERATION_COLUMNS, SESSION_COLUMNS, TIMESTAMP_COLUMNS, max_time, parse_time, split_records,
+                    to_epoch_us)
+
+logger = logging.getLogger(__name__)
+
+PARTITION_FORMATS = {"day": "%Y%m%d", "hour": "%Y%m%d%H"}
+
+
+def _open(path, mode="rb", **kwargs):
+    """open() that reads archived ``.gz`` files transparently."""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode if "b" in mode else mode + "t", **kwargs)
+    return open(path, mode, **kwargs)
+
+
+class CsvStore:
+    def __init__(self, log_dir, partition="day", prefix="session_log", columns=None, shard=None):
+        self.log_dir = log_dir
+        self.key_format = PARTITION_FORMATS[partition]
+        self.prefix = prefix
+        self.columns = columns
+        # With several worker processes each one appends to its own shard file,
+        # session_log_<key>.<shard>.csv; readers merge all shards of a partition.
+        self.shard = shard
+        self._headers = {}
+        self._current = {}
+
+    def partition_key(self, ts):
+        return ts.strftime(self.key_format)
+
+    def partition_path(self, key):
+        return os.path.join(self.log_dir, f"{self.prefix}_{key}.csv")
+
+    def partitions(self):
+        files = glob.glob(os.path.join(self.log_dir, f"{self.prefix}_*.csv"))
+        files += glob.glob(os.path.join(self.log_dir, f"{self.prefix}_*.csv.gz"))
+        return sorted({self.partition_path(self.key_of(f)) for f in files})
+
+    def key_of(self, path):
+        return os.path.basename(path)[len(self.prefix) + 1:].split(".")[0]
+
+    def files(self, path):
+        """Physical files of a partition: the unsharded file and every shard, archived or not."""
+        stem = path[:-len(".csv")]
+        files = [f for f in (path + ".gz", path) if os.path.exists(f)]
+        return files + sorted(glob.glob(stem + ".*.csv.gz")) + sorted(glob.glob(stem + ".*.csv"))
+
+    def write(self, key, records):
+        """Append records to the partition; returns the number of bytes written.
+
+        Rows are formatted by the csv module, so ingest does not load pandas.
+        """
+        stem = self.partition_path(key)[:-len(".csv")]
+        if self.shard is not None:
+            stem += f".{self.shard}"
+        columns = list(self.columns or dict.fromkeys(k for record in records for k in record))
+        log_file, n = self._current.get(stem, (stem + ".csv", 0))
+        while True:
+            with self._append(log_file) as f:
+                start = os.fstat(f.fileno()).st_size
+                write_header = start == 0
+                if write_header:
+                    self._headers[log_file] = columns
+                else:
+                    header = self._header(log_file)
+                    missing = [c for c in columns if c not in header]
+                    if missing:
+                        # e.g. a session with more operations than any before, or columns added to
+                        # the schema after the file was started: go on in a file with the wider header.
+                        columns = header + missing
+                        n += 1
+                        log_file = f"{stem}.w{n}.csv"
+                        continue
+                    columns = header
+                self._current[stem] = (log_file, n)
+                out = csv.writer(f, lineterminator=os.linesep)
+                if write_header:
+                    out.writerow(columns)
+                out.writerows([_csv_value(record.get(c)) for c in columns] for record in records)
+                f.flush()
+                os.fsync(f.fileno())
+                return os.fstat(f.fileno()).st_size - start
+
+    @staticmethod
+    def _append(log_file):
+        """Open a file for appending, holding an exclusive lock on it until it is closed.
+
+        archive() takes the same lock, so no row lands in a file between it
+        being copied and removed. If the file was archived while we waited
+        for the lock, a new one is started.
+        """
+        while True:
+            f = open(log_file, "a", newline="")
+            if fcntl is None:
+                return f
+            fcntl.flock(f, fcntl.LOCK_EX)
+            if os.fstat(f.fileno()).st_nlink:
+                return f
+            f.close()
+
+    def _header(self, log_file):
+        """The file's header, the column order of rows appended to it."""
+        header = self._headers.get(log_file)
+        if header is None:
+            with open(log_file, newline="") as f:
+                header = self._headers[log_file] = next(csv.reader(f), [])
+        return header
+
+    def read(self, path, columns=None):
+        import pandas as pd
+
+        usecols = None if columns is None else (lambda c, wanted=set(columns): c in wanted)
+        for attempt in range(3):
+            try:
+                # An empty file is one a writer has just created and not yet written its header to.
+                frames = [pd.read_csv(f, usecols=usecols) for f in self.files(path) if os.path.getsize(f)]
+                break
+            except FileNotFoundError:
+                # The partition was archived while we were listing it.
+                if attempt == 2:
+                    raise
+        if not frames:
+            return pd.DataFrame(columns=columns or [])
+        return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+    def iter_chunks(self, log_file, columns=None, chunksize=10000):
+        """Yield one physical file as DataFrames of at most chunksize rows."""
+        import pandas as pd
+
+        usecols = None if columns is None else (lambda c, wanted=set(columns): c in wanted)
+        yield from pd.read_csv(log_file, usecols=usecols, chunksize=chunksize)
+
+    def count(self, path):
+        total = 0
+        for log_file in self.files(path):
+            with _open(log_file, "rb") as f:
+                total += max(sum(1 for _ in f) - 1, 0)
+        return total
+
+    def tail(self, path, n):
+        import pandas as pd
+
+        frames = []
+        for log_file in sorted(self.files(path), key=os.path.getmtime):
+            with _open(log_file, "r", newline="") as f:
+                header = f.readline()
+                last = collections.deque(f, maxlen=n)
+            if not header:
+                continue
+            frames.append(pd.read_csv(io.StringIO(header + "".join(last))))
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True).tail(n)
+
+    def summarize(self, log_file, prev=None, n=3):
+        """Row count, columns, latest session_end_time and last n rows of one file.
+
+        Files are append-only, so given the previous summary only the bytes
+        appended since then are parsed.
+        """
+        import pandas as pd
+
+        size = os.path.getsize(log_file)
+        if prev is not None and prev["offset"] == size:
+            return prev
+        if log_file.endswith(".gz"):
+            # Archived files are not appended to in place; summarize them whole.
+            with _open(log_file, "rb") as f:
+                header = f.readline()
+                chunk = f.read()
+            summary = {"offset": size, "header": header,
+                       "columns": next(csv.reader([header.decode("utf-8")])) if header else [],
+                       "count": 0, "latest_time": None, "tail": [], "mtime": os.path.getmtime(log_file)}
+            if chunk:
+                self._add_rows(summary, pd.read_csv(io.BytesIO(header + chunk)), n)
+            return summary
+        with open(log_file, "rb") as f:
+            if prev is None:
+                header = f.readline()
+                if not header.endswith(b"\n"):
+                    return {"offset": 0, "header": b"", "columns": [], "count": 0,
+                            "latest_time": None, "tail": [], "mtime": 0}
+                prev = {"offset": f.tell(), "header": header, "columns": next(csv.reader([header.decode("utf-8")])),
+                        "count": 0, "latest_time": None, "tail": []}
+            f.seek(prev["offset"])
+            chunk = f.read()
+        # Only parse complete lines; a concurrent flush may still be writing the rest.
+        chunk = chunk[:chunk.rfind(b"\n") + 1]
+        summary = dict(prev, offset=prev["offset"] + len(chunk), mtime=os.path.getmtime(log_file))
+        if chunk:
+            self._add_rows(summary, pd.read_csv(io.BytesIO(prev["header"] + chunk)), n)
+        return summary
+
+    @staticmethod
+    def _add_rows(summary, df, n):
+        summary["count"] += len(df)
+        latest = max_time(df["session_end_time"]) if "session_end_time" in df.columns else None
+        if latest is not None and (summary["latest_time"] is None or latest > summary["latest_time"]):
+            summary["latest_time"] = latest
+        summary["tail"] = (summary["tail"] + df.tail(n).to_dict(orient="records"))[-n:]
+
+    def read_operations(self, path):
+        return _operations_from_wide(self, path)
+
+    def compact(self, path):
+        return False
+
+    def archive(self, path, min_idle=600):
+        """Gzip the plain files of a partition. Returns True if it did.
+
+        A file started after its partition was archived (e.g. late data) is
+        gzipped to a file of its own, ``session_log_<key>.late<n>.csv.gz``
+        with its own header, which readers merge like a shard. Files modified
+        in the last ``min_idle`` seconds are left alone.
+        """
+        archived = False
+        for log_file in self.files(path):
+            if log_file.endswith(".gz") or time.time() - os.path.getmtime(log_file) < min_idle:
+                continue
+            with open(log_file, "rb") as src:
+                # The writer's lock: nothing is appended while we copy, and the
+                # file is only removed once its .gz is complete.
+                if fcntl is not None:
+                    fcntl.flock(src, fcntl.LOCK_EX)
+                if not os.fstat(src.fileno()).st_nlink:
+                    continue  # archived by another process meanwhile
+                if not os.fstat(src.fileno()).st_size:
+                    # Just created by a writer waiting for the lock; it will start a new file.
+                    os.remove(log_file)
+                    continue
+                target = log_file + ".gz"
+                n = 0
+                while os.path.exists(target):
+                    n += 1
+                    target = f"{log_file[:-len('.csv')]}.late{n}.csv.gz"
+                tmp = target + ".tmp"
+                with open(tmp, "wb") as out:
+                    with gzip.GzipFile(fileobj=out, mode="wb") as z:
+                        shutil.copyfileobj(src, z)
+                    out.flush()
+                    os.fsync(out.fileno())
+                os.replace(tmp, target)
+                os.remove(log_file)
+            self._headers.pop(log_file, None)
+            archived = True
+        return archived
+
+    def drop(self, path):
+        """Delete a partition with all its files."""
+        for log_file in self.files(path):
+            os.remove(log_file)
+
+
+class ColumnarStore:
+    def __init__(self, log_dir, partition="day", fmt="parquet", prefix="session_log", columns=None,
+                 row_group_size=64 * 1024):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise RuntimeError("LOG_STORAGE=parquet/arrow needs pyarrow: pip install pyarrow")
+        self.log_dir = log_dir
+        self.key_format = PARTITION_FORMATS[partition]
+        self.prefix = prefix
+        self.columns = columns
+        self.fmt = fmt
+        self.ext = ".parquet" if fmt == "parquet" else ".arrow"
+        self.row_group_size = row_group_size
+        self._seq = 0
+        self._seq_lock = threading.Lock()
+
+    def partition_key(self, ts):
+        return ts.strftime(self.key_format)
+
+    def partition_path(self, key):
+        return os.path.join(self.log_dir, f"{self.prefix}_{key}")
+
+    def partitions(self):
+        paths = glob.glob(os.path.join(self.log_dir, f"{self.prefix}_*"))
+        return sorted(p for p in paths if os.path.isdir(p))
+
+    def key_of(self, path):
+        return os.path.basename(path)[len(self.prefix) + 1:]
+
+    def parts(self, path):
+        return sorted(glob.glob(os.path.join(path, f"*{self.ext}")))
+
+    # Part file names include the writer's pid, so worker processes never
+    # write to the same file and every part is already a shard.
+    files = parts
+
+    def write(self, key, records):
+        import pyarrow as pa
+
+        path = self.partition_path(key)
+        os.makedirs(path, exist_ok=True)
+        with self._seq_lock:
+            self._seq += 1
+            name = f"part-{int(time.time() * 1000)}-{os.getpid()}-{self._seq:06d}{self.ext}"
+        # Build columns from the union of keys; from_pylist would only use the first record's.
+        columns = self.columns or dict.fromkeys(k for record in records for k in record)
+        table = pa.Table.from_pydict({c: [record.get(c) for record in records] for c in columns})
+        self._write_table(table, os.path.join(path, name))
+        return os.path.getsize(os.path.join(path, name))
+
+    def read(self, path, columns=None):
+        import pandas as pd
+
+        table = self._read_table(path, columns)
+        return table.to_pandas() if table is not None else pd.DataFrame(columns=columns or [])
+
+    def iter_chunks(self, part, columns=None, chunksize=10000):
+        import pandas as pd
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if self.fmt == "parquet":
+            f = pq.ParquetFile(part)
+            if columns is not None:
+                columns = [c for c in columns if c in f.schema_arrow.names]
+            batches = f.iter_batches(batch_size=chunksize, columns=columns)
+        else:
+            reader = pa.ipc.open_file(pa.memory_map(part))
+            if columns is not None:
+                columns = [c for c in columns if c in reader.schema.names]
+            batches = (reader.get_batch(i).select(columns) if columns is not None else reader.get_batch(i)
+                       for i in range(reader.num_record_batches))
+        for batch in batches:
+            yield pd.DataFrame(batch.to_pylist(), columns=batch.schema.names)
+
+    def count(self, path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        total = 0
+        for part in self.parts(path):
+            if self.fmt == "parquet":
+                total += pq.read_metadata(part).num_rows
+            else:
+                with pa.ipc.open_file(pa.memory_map(part)) as reader:
+                    total += sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+        return total
+
+    def tail(self, path, n):
+        import pandas as pd
+
+        # Walk back from the newest part until we have n rows.
+        tables, rows = [], 0
+        for part in reversed(self.parts(path)):
+            if rows >= n:
+                break
+            table = self._read_part(part)
+            tables.insert(0, table)
+            rows += table.num_rows
+        if not tables:
+            return pd.DataFrame()
+        table = self._concat(tables)
+        last = table.slice(max(table.num_rows - n, 0))
+        # to_pylist keeps list columns as plain lists so the rows stay JSON-friendly.
+        return pd.DataFrame(last.to_pylist(), columns=last.column_names)
+
+    def read_operations(self, path):
+        return _operations_from_wide(self, path)
+
+    def summarize(self, part, prev=None, n=3):
+        """Same summary as CsvStore.summarize; parts are immutable so it is computed once."""
+        if prev is not None:
+            return prev
+        table = self._read_part(part)
+        latest_time = None
+        if "session_end_time" in table.column_names:
+            latest_time = max_time(table.column("session_end_time").to_pandas())
+        return {
+            "columns": table.column_names,
+            "count": table.num_rows,
+            "latest_time": latest_time,
+            "tail": table.slice(max(table.num_rows - n, 0)).to_pylist(),
+            "mtime": os.path.getmtime(part),
+        }
+
+    def compact(self, path, min_parts=2, max_part_bytes=64 * 1024 * 1024):
+        """Merge the small part files of a partition into one. Returns True if it did.
+
+        Parts of ``max_part_bytes`` or more (e.g. the result of an earlier
+        compaction) are left as they are, so each run only rewrites the parts
+        flushed since the last one.
+        """
+        parts = [p for p in self.parts(path) if os.path.getsize(p) < max_part_bytes]
+        if len(parts) < min_parts:
+            return False
+        table = self._concat([self._read_part(p) for p in parts])
+        target = os.path.join(path, f"compacted-{int(time.time() * 1000)}{self.ext}")
+        self._write_table(table, target)
+        for part in parts:
+            os.remove(part)
+        return True
+
+    def archive(self, path):
+        """Rewrite a partition as one zstd-compressed file. Returns True if it did."""
+        parts = self.parts(path)
+        if not parts or (len(parts) == 1 and os.path.basename(parts[0]).startswith("archived-")):
+            return False
+        table = self._concat([self._read_part(p) for p in parts])
+        self._write_table(table, os.path.join(path, f"archived-{int(time.time() * 1000)}{self.ext}"),
+                          compression="zstd")
+        for part in parts:
+            os.remove(part)
+        return True
+
+    def drop(self, path):
+        shutil.rmtree(path, ignore_errors=True)
+
+    def _read_part(self, part, columns=None):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        import pyarrow.feather as feather
+
+        if self.fmt == "parquet":
+            schema_names = pq.read_schema(part).names
+        else:
+            with pa.ipc.open_file(pa.memory_map(part)) as reader:
+                schema_names = reader.schema.names
+        if columns is not None:
+            columns = [c for c in columns if c in schema_names]
+        if self.fmt == "parquet":
+            return pq.read_table(part, columns=columns)
+        return feather.read_table(part, columns=columns, memory_map=True)
+
+    def _read_table(self, path, columns=None):
+        for attempt in range(3):
+            try:
+                tables = [self._read_part(p, columns) for p in self.parts(path)]
+                break
+            except FileNotFoundError:
+                # Another process compacted the partition while we were listing it.
+                if attempt == 2:
+                    raise
+        return self._concat(tables) if tables else None
+
+    def _concat(self, tables):
+        import pyarrow as pa
+
+        # Parts written at different times may have different column sets, and
+        # parts from before schema v2 hold timestamps as strings instead of epoch µs.
+        for column in TIMESTAMP_COLUMNS:
+            types = {t.schema.field(column).type for t in tables if column in t.column_names}
+            if pa.string() in types and len(types - {pa.string(), pa.null()}) > 0:
+                tables = [_epoch_us_column(t, column) for t in tables]
+        return pa.concat_tables(tables, promote_options="default")
+
+    def _write_table(self, table, target, compression=None):
+        import pyarrow.parquet as pq
+        import pyarrow.feather as feather
+
+        # Write under a temporary name so readers never see a half-written part.
+        tmp = target + ".tmp"
+        if self.fmt == "parquet":
+            pq.write_table(table, tmp, row_group_size=self.row_group_size, compression=compression or "snappy")
+        else:
+            feather.write_feather(table, tmp, chunksize=self.row_group_size, compression=compression)
+        with open(tmp, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, target)
+
+
+class NormalizedStore:
+    """Fixed-schema ``session_log`` table plus a long ``operation_log`` table.
+
+    Each record is split at write time (see schema.split_records). Everything
+    other than writing and compaction is delegated to the sessions table.
+    """
+
+    def __init__(self, sessions, operations):
+        self.sessions = sessions
+        self.operations = operations
+
+    def __getattr__(self, name):
+        return getattr(self.sessions, name)
+
+    def write(self, key, records):
+        sessions, operations = split_records(records)
+        written = self.sessions.write(key, sessions)
+        if operations:
+            written += self.operations.write(key, operations)
+        return written
+
+    def read_operations(self, path):
+        return self.operations.read(self.operations.partition_path(self.sessions.key_of(path)))
+
+    def compact(self, path):
+        compacted = self.sessions.compact(path)
+        operations_path = self.operations.partition_path(self.sessions.key_of(path))
+        if os.path.exists(operations_path):
+            compacted = self.operations.compact(operations_path) or compacted
+        return compacted
+
+    def archive(self, path):
+        archived = self.sessions.archive(path)
+        return self.operations.archive(self.operations.partition_path(self.sessions.key_of(path))) or archived
+
+    def drop(self, path):
+        self.sessions.drop(path)
+        self.operations.drop(self.operations.partition_path(self.sessions.key_of(path)))
+
+
+def _csv_value(value):
+    # Written like DataFrame.to_csv: missing values (None, NaN) as empty fields.
+    if value is None or (isinstance(value, float) and value != value):
+        return ""
+    return value
+
+
+def _epoch_us_column(table, column):
+    import pyarrow as pa
+
+    if column not in table.column_names or table.schema.field(column).type != pa.string():
+        return table
+    values = [None if t is None else to_epoch_us(t) for t in map(parse_time, table.column(column).to_pylist())]
+    return table.set_column(table.column_names.index(column), column, pa.array(values, pa.int64()))
+
+
+def _operations_from_wide(store, path):
+    """Operations table (OPERATION_COLUMNS) of a wide-layout partition."""
+    import pandas as pd
+
+    _, operations = split_records(store.read(path).to_dict(orient="records"))
+    return pd.DataFrame(operations, columns=OPERATION_COLUMNS)
+
+
+def make_store(log_dir, kind="csv", partition="day", layout="wide", shard=None):
+    if kind == "sqlite":
+        # Always normalized; several processes can share one WAL database.
+        from sqlite_store import SqliteStore
+        return SqliteStore(log_dir, partition)
+
+    if kind == "csv":
+        table = functools.partial(CsvStore, log_dir, partition, shard=shard)
+    elif kind in ("parquet", "arrow"):
+        table = functools.partial(ColumnarStore, log_dir, partition, kind)
+    else:
+        raise ValueError(f"Unknown log storage: {kind}")
+
+    if layout == "wide":
+        return table()
+    if layout == "normalized":
+        return NormalizedStore(
+            table(prefix="session_log", columns=SESSION_COLUMNS),
+            table(prefix="operation_log", columns=OPERATION_COLUMNS),
+        )
+    raise ValueError(f"Unknown log layout: {layout}")
+
+
+@contextlib.contextmanager
+def partition_lock(store, path):
+    """Lock for rewriting one partition; yields False, without waiting, if another job holds it.
+
+    Compactor and Retention both replace the files of a partition, possibly
+    in different worker processes, so they take the same lock.
+    """
+    with open(os.path.join(store.log_dir, f".{os.path.basename(path)}.lock"), "w") as lock:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                yield False
+                return
+        yield True
+
+
+class Compactor:
+    """Background thread that periodically compacts small part files."""
+
+    def __init__(self, store, interval=600.0):
+        self.store = store
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="log-compactor", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self):
+        # With several worker processes only one of them compacts at a time.
+        with open(os.path.join(self.store.log_dir, "compact.lock"), "w") as lock:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return 0
+            compacted = 0
+            for path in self.store.partitions():
+                with partition_lock(self.store, path) as locked:
+                    compacted += bool(locked and self.store.compact(path))
+            return compacted
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                compacted = self.run_once()
+                if compacted:
+                    logger.info(" Compacted %d log partitions", compacted)
+            except Exception as e:
+                logger.exception(" Log compaction failed: %s", e)
+
+
+class Retention:
+    """Background job that archives old partitions and deletes expired ones.
+
+    Partitions whose key is more than ``compress_after_days`` days old are
+    archived (see ``store.archive``); with ``keep_days`` set, partitions older
+    than that are deleted. The newest partition is never touched.
+    """
+
+    def __init__(self, store, compress_after_days=2, keep_days=None, interval=3600.0, manifest=None):
+        self.store = store
+        self.manifest = manifest
+        self.compress_after_days = compress_after_days
+        self.keep_days = keep_days
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="log-retention", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self, now=None):
+        """Returns ``(archived, dropped)`` partition counts."""
+        # Partition keys are UTC dates (see writer.py).
+        now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+        archived = dropped = 0
+        with open(os.path.join(self.store.log_dir, "retention.lock"), "w") as lock:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return 0, 0
+            for path in self.store.partitions()[:-1]:
+                key = self.store.key_of(path)
+                age = now - datetime.strptime(key, self.store.key_format)
+                with partition_lock(self.store, path) as locked:
+                    if not locked:
+                        continue  # being compacted; next run
+                    if self.keep_days and age > timedelta(days=self.keep_days):
+                        self.store.drop(path)
+                        dropped += 1
+                        if self.manifest is not None:
+                            self.manifest.remove(key)
+                    elif self.compress_after_days is not None and age > timedelta(days=self.compress_after_days):
+                        if self.store.archive(path):
+                            archived += 1
+                            if self.manifest is not None:
+                                self.manifest.set_bytes(key,
+                                                        sum(os.path.getsize(f) for f in self.store.files(path)))
+        return archived, dropped
+
+    def _run(self):
+        while True:
+            try:
+                archived, dropped = self.run_once()
+                if archived or dropped:
+                    logger.info(" Archived %d and deleted %d old log partitions", archived, dropped)
+            except Exception as e:
+                logger.exception(" Log retention failed: %s", e)
+            if self._stop.wait(self.interval):
+                break
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+# The server modules import each other as top-level modules, like `python server.py` does.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def ingest(tmp_path, monkeypatch):
+    """The ingest module with no experiments open, logging to ``tmp_path/logs``."""
+    monkeypatch.chdir(tmp_path)
+    import ingest
+
+    ingest.close_experiments()
+    monkeypatch.setattr(ingest, "experiments", {})
+    os.makedirs(ingest.LOG_DIR, exist_ok=True)
+    yield ingest
+    ingest.close_experiments()
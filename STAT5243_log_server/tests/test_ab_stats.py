@@ -0,0 +1,38 @@
+import math
+
+import pytest
+
+from ab_stats import ABAggregates
+from storage import CsvStore
+
+
+def sessions():
+    records = []
+    for i, (group, seconds) in enumerate([("A", 60), ("A", 120), ("A", 90), ("B", 200), ("B", 260)]):
+        records.append({"user_id": f"u{i}", "group": group, "total_session_time": seconds,
+                        "apply_fe_button_clicked_count": i, "apply_fe_button_error_count": i % 2,
+                        "operation_names": ["normalization"] * (i + 1),
+                        "operation_errors": [None] * i + ["ValueError"]})
+    return records
+
+
+def test_incremental_aggregates_match_the_logs(tmp_path):
+    live = ABAggregates()
+    for record in sessions():
+        live.update("20250418", [record])
+    store = CsvStore(str(tmp_path))
+    store.write("20250418", sessions())
+    loaded = ABAggregates()
+    loaded.load(store)
+
+    snapshot = live.snapshot()
+    assert snapshot == loaded.snapshot()
+    a, b = snapshot["groups"]["A"], snapshot["groups"]["B"]
+    assert (a["sessions"], b["sessions"]) == (3, 2)
+    assert a["metrics"]["total_session_time"]["mean"] == 90
+    assert a["metrics"]["total_session_time"]["variance"] == 900
+    assert a["operations"]["normalization"] == {"count": 6, "errors": 3, "error_rate": 0.5}
+
+    # Welch's t for total_session_time: (90 - 230) / sqrt(900 / 3 + 1800 / 2)
+    (welch,) = [w for w in snapshot["welch"] if w["metric"] == "total_session_time"]
+    assert welch["t"] == pytest.approx(-140 / math.sqrt(1200))
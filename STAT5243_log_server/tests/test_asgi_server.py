@@ -0,0 +1,56 @@
+import asyncio
+import json
+
+import pytest
+
+
+def call(app, method, path, body=b"", headers=()):
+    """``(status, headers, body)`` of one request to an ASGI app, without a server."""
+    path, _, query = path.partition("?")
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method, "scheme": "http",
+             "path": path, "raw_path": path.encode(), "root_path": "", "query_string": query.encode(),
+             "headers": [(k.lower().encode(), v.encode()) for k, v in headers],
+             "client": ("127.0.0.1", 1234), "server": ("127.0.0.1", 5000)}
+    requests = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return requests.pop(0) if requests else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    start = sent[0]
+    return (start["status"], {k.decode(): v.decode() for k, v in start["headers"]},
+            b"".join(m.get("body", b"") for m in sent[1:]))
+
+
+@pytest.fixture
+def app(ingest):
+    import asgi_server
+
+    return asgi_server.app
+
+
+def test_log_batch_and_status(app):
+    record = {"user_id": "u0", "group": "A", "session_start_time": "2025-04-18T10:00:00",
+              "session_end_time": "2025-04-18T10:05:00"}
+    status, _, body = call(app, "POST", "/log", json.dumps(record).encode(), [("Content-Type", "application/json")])
+    assert (status, json.loads(body)["status"]) == (200, " Log saved")
+    batch = "\n".join(json.dumps(dict(record, user_id=f"u{i}")) for i in range(1, 3)).encode()
+    status, _, body = call(app, "POST", "/log/batch", batch, [("Content-Type", "application/x-ndjson")])
+    assert (status, json.loads(body)["accepted"]) == (200, 2)
+
+    status, headers, body = call(app, "GET", "/status")
+    assert status == 200
+    assert json.loads(body)["total_logs"] == 3
+    status, _, _ = call(app, "GET", "/status", headers=[("If-None-Match", headers["etag"])])
+    assert status == 304
+
+
+def test_oversized_and_malformed_bodies(app, ingest):
+    status, _, _ = call(app, "POST", "/log", b"{" * (ingest.MAX_RECORD_BYTES + 1))
+    assert status == 413
+    status, _, _ = call(app, "POST", "/log", b"not json")
+    assert status == 400
@@ -0,0 +1,60 @@
+import csv
+import json
+
+import backfill
+from backfill import iter_json, prepare
+
+
+def test_rows_that_cannot_be_derived_are_rejected_without_validation():
+    rows = [{"user_id": "u0", "group": "A", "apply_fe_button_clicked_count": "abc"},
+            {"user_id": "u1", "group": "A", "apply_fe_button_clicked_count": "2"}]
+    records, errors = prepare(rows, 10, "default", validate=False)
+    assert [r["user_id"] for r in records] == ["u1"]
+    assert [row for row, _ in errors] == [10]
+
+
+def test_objects_are_read_across_block_boundaries(tmp_path):
+    path = tmp_path / "test_data_collection.txt"
+    records = [{"user_id": f"u{i}", "operation_names": ["a", "b"]} for i in range(20)]
+    path.write_text(",\n".join(json.dumps(r) for r in records))
+    assert list(iter_json(str(path), block_size=16)) == records
+    path.write_text(json.dumps(records))
+    assert list(iter_json(str(path), block_size=16)) == records
+
+
+def test_backfill_loads_csv_and_json_and_resumes_from_the_checkpoint(ingest, monkeypatch, tmp_path, capsys):
+    monkeypatch.setenv("LOG_LIGHT", "1")
+    exported = tmp_path / "ab_test_log.csv"
+    with open(exported, "w", newline="") as f:
+        writer = csv.DictWriter(f, ["user_id", "group", "session_start_time", "apply_fe_button_clicked_count"])
+        writer.writeheader()
+        writer.writerows({"user_id": f"c{i}", "group": "A", "session_start_time": "2025-04-18T10:00:00",
+                          "apply_fe_button_clicked_count": "" if i % 2 else "3"} for i in range(5))
+    collected = tmp_path / "test_data_collection.txt"
+    collected.write_text(",".join(json.dumps({"user_id": f"j{i}", "group": "B",
+                                              "session_start_time": "2025-04-18T11:00:00"}) for i in range(3))
+                         + ',{"user_id": "c0", "group": "A"},{"group": "B"}')
+    sources = [str(exported), str(collected)]
+
+    backfill.main(["--workers", "1", "--chunk-size", "2", *sources])
+    assert "8 stored, 1 duplicates, 1 rejected" in capsys.readouterr().out
+    experiment = ingest.experiments[ingest.DEFAULT_EXPERIMENT]
+    df = experiment.store.read(experiment.store.partition_path("20250418"))
+    assert sorted(df["user_id"]) == ["c0", "c1", "c2", "c3", "c4", "j0", "j1", "j2"]
+    assert df.set_index("user_id").loc["c0", "total_clicked_count"] == 3
+
+    # Loaded sources are skipped; one that grew is loaded again from the start.
+    monkeypatch.setattr(ingest, "experiments", {})
+    with open(exported, "a", newline="") as f:
+        f.write("c5,A,2025-04-18T10:00:00,\n")
+    backfill.main(["--workers", "1", "--chunk-size", "2", *sources])
+    out = capsys.readouterr().out
+    assert f"{collected} was already loaded" in out and "1 stored, 5 duplicates" in out
+
+    # An interrupted load resumes after the last committed chunk.
+    monkeypatch.setattr(ingest, "experiments", {})
+    checkpoint = backfill.Checkpoint(str(tmp_path / "logs" / "backfill_checkpoint.json"))
+    checkpoint.update(str(exported), 4)
+    backfill.main(["--workers", "1", "--chunk-size", "2", str(exported)])
+    out = capsys.readouterr().out
+    assert f"Resuming {exported} after row 4" in out and "Loaded 2 rows" in out
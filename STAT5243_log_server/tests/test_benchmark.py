@@ -0,0 +1,24 @@
+import random
+from datetime import datetime, timezone
+
+import pytest
+
+from benchmark import summarize, synthetic_session
+from schema import parse_time, validate_session
+
+
+def test_synthetic_sessions_are_valid_and_land_in_todays_partition():
+    rng = random.Random(0)
+    today = datetime.now(timezone.utc).date()
+    for _ in range(200):
+        record = synthetic_session(rng)
+        validate_session(dict(record))
+        assert parse_time(record["session_start_time"]).date() == today
+
+
+def test_summary_percentiles_and_errors():
+    results = [(i / 1000, 200) for i in range(1, 97)] + [(0.5, 429), (0.6, 500), (0.7, None), (0.8, 200)]
+    s = summarize("/log", results, elapsed=2.0, bytes_written=1000)
+    assert (s["requests"], s["throughput"], s["rejected_429"]) == (100, 48.5, 1)
+    assert s["error_rate"] == pytest.approx(0.03)
+    assert [s["p50_ms"], s["p95_ms"], s["p99_ms"]] == pytest.approx([50, 95, 700])
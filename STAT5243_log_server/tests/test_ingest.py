@@ -0,0 +1,72 @@
+import gzip
+import json
+
+import pytest
+
+
+@pytest.mark.parametrize("field, value", [("apply_fe_button_clicked_count", "abc"), ("operation_names", "[")])
+def test_unvalidated_record_that_cannot_be_derived_is_rejected(ingest, monkeypatch, field, value):
+    monkeypatch.setattr(ingest, "LOG_VALIDATE", False)
+    record = {"user_id": "u0", "group": "A", field: value}
+
+    payload, code = ingest.ingest_record(dict(record))
+    assert code == 400 and payload["error"].startswith("Invalid record")
+
+    payload, code = ingest.ingest_batch(json.dumps([record, {"user_id": "u1", "group": "A"}]).encode())
+    assert code == 200
+    assert (payload["accepted"], payload["rejected"]) == (1, 1)
+    assert payload["results"][0]["status"] == "error"
+
+
+@pytest.mark.parametrize("content_type, content_encoding, encode", [
+    ("application/json", "", lambda records: json.dumps(records).encode()),
+    ("application/x-ndjson", "", lambda records: "\n".join(json.dumps(r) for r in records).encode()),
+    ("application/json", "gzip", lambda records: gzip.compress(json.dumps(records).encode())),
+])
+def test_batch_is_accepted_as_json_ndjson_or_gzip(ingest, content_type, content_encoding, encode):
+    records = [{"user_id": f"u{i}", "group": "A", "session_start_time": "2025-04-18T10:00:00"} for i in range(3)]
+    payload, code = ingest.ingest_batch(encode(records), content_type, content_encoding)
+    assert code == 200 and payload["accepted"] == 3
+
+    experiment, _ = ingest.get_experiment()
+    experiment.writer.flush()
+    store = experiment.store
+    assert sorted(store.read(store.partition_path("20250418"))["user_id"]) == ["u0", "u1", "u2"]
+
+
+def test_invalid_batch_records_are_rejected_one_by_one(ingest):
+    body = json.dumps([{"user_id": "u0"}, {"user_id": "u1", "session_start_time": "yesterday"}, 3]).encode()
+    payload, code = ingest.ingest_batch(body, "application/json")
+    assert code == 200
+    assert (payload["accepted"], payload["rejected"]) == (1, 2)
+    assert [r["status"] for r in payload["results"]] == ["ok", "error", "error"]
+
+    assert ingest.ingest_batch(b"[{", "application/json")[1] == 400
+    assert ingest.ingest_batch(gzip.compress(b"[]" * 10)[:-4], "application/json", "gzip")[1] == 400
+
+
+def test_duplicate_user_id_is_acknowledged_but_stored_once(ingest):
+    record = {"user_id": "u0", "group": "A", "session_start_time": "2025-04-18T10:00:00"}
+    assert ingest.ingest_record(dict(record)) == ({"status": " Log saved"}, 200)
+    payload, code = ingest.ingest_record(dict(record))
+    assert code == 200 and payload["duplicate"]
+    payload, _ = ingest.ingest_batch(json.dumps([record, dict(record, user_id="u1")]).encode())
+    assert (payload["accepted"], payload["duplicates"]) == (1, 1)
+    # An Idempotency-Key identifies the request instead of the user_id.
+    assert ingest.ingest_record(dict(record), idempotency_key="retry-1")[1] == 200
+    assert ingest.ingest_record(dict(record), idempotency_key="retry-1")[0]["duplicate"]
+
+    experiment, _ = ingest.get_experiment()
+    experiment.writer.flush()
+    store = experiment.store
+    assert sorted(store.read(store.partition_path("20250418"))["user_id"]) == ["u0", "u0", "u1"]
+
+
+def test_dedup_index_survives_a_restart(ingest, monkeypatch):
+    record = {"user_id": "u0", "group": "A", "session_start_time": "2025-04-18T10:00:00"}
+    ingest.ingest_record(dict(record))
+    ingest.close_experiments()
+    monkeypatch.setattr(ingest, "experiments", {})
+
+    payload, code = ingest.ingest_record(dict(record))
+    assert code == 200 and payload["duplicate"]
@@ -0,0 +1,107 @@
+import asyncio
+import json
+
+from live_status import Broadcast, LiveStatus, ShardedStatus, sse_stream, sse_stream_async
+from manifest import Manifest, stats_of
+from storage import CsvStore
+
+
+class UnreadableStore(CsvStore):
+    def tail(self, path, n):
+        raise AssertionError("the partition was opened")
+
+    def read(self, path, columns=None):
+        raise AssertionError("the partition was opened")
+
+
+def test_light_start_takes_the_columns_from_the_manifest(tmp_path):
+    log_dir = str(tmp_path)
+    records = [{"user_id": f"u{i}", "group": "A", "session_end_time": f"2025-04-18T10:0{i}:00"} for i in range(3)]
+    CsvStore(log_dir).write("20250418", records)
+    manifest = Manifest(log_dir)
+    manifest.add("20250418", stats_of(records))
+
+    status = LiveStatus()
+    status.load(UnreadableStore(log_dir), manifest, recent=False)
+    payload, _ = status.snapshot()
+    assert payload["columns"] == ["user_id", "group", "session_end_time"]
+    assert payload["total_logs"] == 3
+    assert payload["last_logs"] == []  # filled as sessions arrive
+
+
+def test_status_follows_the_writes_without_reading_the_disk(tmp_path):
+    status = LiveStatus(buffer_size=5)
+    status.load(UnreadableStore(str(tmp_path)))  # nothing on disk yet
+    assert status.snapshot()[0] is None
+
+    status.update("20250418", [{"user_id": f"u{i}", "session_end_time": f"2025-04-18T10:0{i}:00"} for i in range(4)])
+    payload, etag = status.snapshot(last_n=2)
+    status.update("20250419", [{"user_id": "u9", "group": "B", "session_end_time": "2025-04-19T09:00:00"}])
+    later, later_etag = status.snapshot(last_n=2)
+
+    assert (payload["total_logs"], payload["latest_time"]) == (4, "2025-04-18T10:03:00")
+    assert [r["user_id"] for r in payload["last_logs"]] == ["u2", "u3"]
+    # The latest partition is reported, and the ETag changes with every update.
+    assert (later["total_logs"], later["columns"]) == (1, ["user_id", "group", "session_end_time"])
+    assert [r["user_id"] for r in later["last_logs"]] == ["u3", "u9"]
+    assert later_etag != etag
+
+
+def test_sharded_status_merges_the_shards_of_the_latest_partition(tmp_path):
+    workers = [CsvStore(str(tmp_path), shard=pid) for pid in (101, 102)]
+    for i, store in enumerate(workers * 2):
+        store.write("20250418", [{"user_id": f"u{i}", "session_end_time": f"2025-04-18T10:0{i}:00"}])
+
+    status = ShardedStatus(workers[0])
+    payload, etag = status.snapshot(last_n=2)
+    assert (payload["total_logs"], payload["latest_time"]) == (4, "2025-04-18T10:03:00")
+    assert sorted(workers[1].read(workers[1].partition_path("20250418"))["user_id"]) == ["u0", "u1", "u2", "u3"]
+
+    workers[1].write("20250418", [{"user_id": "u4", "session_end_time": "2025-04-18T10:04:00"}])
+    payload, later_etag = status.snapshot(last_n=2)
+    assert payload["total_logs"] == 5 and later_etag != etag
+
+
+def events(chunk):
+    """``[(id, kind, data)]`` of the events in one SSE chunk."""
+    parsed = []
+    for block in chunk.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if "event" in fields:
+            parsed.append((fields.get("id"), fields["event"], json.loads(fields["data"])))
+    return parsed
+
+
+def test_stream_resumes_after_last_event_id():
+    broadcast = Broadcast(buffer_size=3)
+    broadcast.publish_sessions("20250418", [{"user_id": f"u{i}"} for i in range(3)])
+    stream = sse_stream(broadcast, last_event_id="1", heartbeat=0.01)
+    assert next(stream) == "retry: 3000\n\n"
+    assert [(i, d["user_id"]) for i, _, d in events(next(stream))] == [("2", "u1"), ("3", "u2")]
+
+    broadcast.publish("rollup", [{"groups": {}}])
+    assert [kind for _, kind, _ in events(next(stream))] == ["rollup"]
+    assert next(stream) == ": keepalive\n\n"
+    stream.close()
+    assert broadcast.subscribers == 0
+
+
+def test_stream_reports_events_that_fell_out_of_the_buffer():
+    broadcast = Broadcast(buffer_size=2)
+    broadcast.publish_sessions("20250418", [{"user_id": f"u{i}"} for i in range(5)])
+
+    async def first_chunk():
+        stream = sse_stream_async(broadcast, last_event_id="1", kinds={"session"}, heartbeat=0.01)
+        await stream.__anext__()
+        chunk = await stream.__anext__()
+        await stream.aclose()
+        return chunk
+
+    chunk = asyncio.run(first_chunk())
+    assert [(i, kind) for i, kind, _ in events(chunk)] == [(None, "dropped"), ("4", "session"), ("5", "session")]
+    assert events(chunk)[0][2] == {"missed": 2}
+    # An id from before a restart (ahead of this server's ids) starts at the live edge.
+    stream = sse_stream(broadcast, last_event_id="99", heartbeat=0.01)
+    next(stream)
+    assert next(stream) == ": keepalive\n\n"
+    stream.close()
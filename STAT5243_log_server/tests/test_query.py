@@ -0,0 +1,91 @@
+import csv
+import io
+import json
+
+import pytest
+
+from manifest import Manifest, stats_of
+from query import iter_range, range_columns, stream
+from storage import CsvStore
+
+
+@pytest.mark.parametrize("with_manifest", [True, False])
+def test_csv_header_covers_columns_first_seen_in_later_files(tmp_path, with_manifest):
+    store = CsvStore(str(tmp_path))
+    manifest = Manifest(str(tmp_path)) if with_manifest else None
+    for key, records in (
+        ("20250418", [{"user_id": "u0", "session_start_time": "2025-04-18T10:00:00"}]),
+        ("20250419", [{"user_id": "u1", "session_start_time": "2025-04-19T10:00:00",
+                       "download_button_clicked_count": 2}]),
+    ):
+        store.write(key, records)
+        if manifest is not None:
+            manifest.add(key, stats_of(records))
+
+    header = range_columns(store, manifest=manifest)
+    rows = list(csv.DictReader(io.StringIO("".join(stream(iter_range(store, manifest=manifest), "csv", header)))))
+    assert header == ["user_id", "session_start_time", "download_button_clicked_count"]
+    assert [(r["user_id"], r["download_button_clicked_count"]) for r in rows] == [("u0", ""), ("u1", "2")]
+
+
+def test_query_plan_reads_the_manifest_once(tmp_path, monkeypatch):
+    store, manifest = CsvStore(str(tmp_path)), Manifest(str(tmp_path))
+    for day in range(1, 21):
+        records = [{"user_id": f"u{day}", "session_start_time": f"2025-04-{day:02d}T10:00:00"}]
+        store.write(f"202504{day:02d}", records)
+        manifest.add(f"202504{day:02d}", stats_of(records))
+
+    reads = []
+    entries = manifest.entries
+    monkeypatch.setattr(manifest, "entries", lambda: reads.append(1) or entries())
+    chunks = list(iter_range(store, "2025-04-05", "2025-04-07", manifest=manifest))
+    assert [u for chunk in chunks for u in chunk["user_id"]] == ["u5", "u6"]
+    assert len(reads) == 1
+
+
+class CountingStore(CsvStore):
+    def __init__(self, log_dir):
+        super().__init__(log_dir)
+        self.opened = []
+
+    def iter_chunks(self, log_file, columns=None, chunksize=10000):
+        self.opened.append(self.key_of(log_file))
+        return super().iter_chunks(log_file, columns, chunksize)
+
+
+def test_partitions_outside_the_range_are_not_opened(tmp_path):
+    store = CountingStore(str(tmp_path))
+    for day in range(1, 6):
+        store.write(f"202504{day:02d}", [{"user_id": f"u{day}", "session_start_time": f"2025-04-{day:02d}T10:00:00"}])
+    # Written before the manifest existed: scanned once to build it.
+    manifest = Manifest(str(tmp_path))
+    manifest.rebuild(store)
+    assert manifest.get("20250403")["rows"] == 1
+    assert manifest.get("20250403")["min_session_start_time"] == "2025-04-03T10:00:00"
+
+    store.opened.clear()
+    chunks = list(iter_range(store, "2025-04-02", "2025-04-04", manifest=manifest))
+    assert [u for chunk in chunks for u in chunk["user_id"]] == ["u2", "u3"]
+    # Days before from= are skipped by their key, days after to= by their manifest entry.
+    assert set(store.opened) == {"20250402", "20250403"}
+
+
+def test_logs_are_streamed_by_time_range_group_and_columns(ingest):
+    ingest.ingest_batch(json.dumps([
+        {"user_id": f"u{i}", "group": "AB"[i % 2], "session_start_time": f"2025-04-{17 + i // 2}T10:00:00"}
+        for i in range(6)]).encode())
+    experiment, _ = ingest.get_experiment()
+    experiment.writer.flush()
+
+    chunks, mimetype, error = ingest.query_logs(experiment, {"from": "2025-04-18", "to": "2025-04-20", "group": "A",
+                                                             "columns": "user_id,session_start_time"})
+    assert error is None and mimetype == "application/x-ndjson"
+    assert [json.loads(line) for line in "".join(chunks).splitlines()] == [
+        {"user_id": "u2", "session_start_time": "2025-04-18T10:00:00"},
+        {"user_id": "u4", "session_start_time": "2025-04-19T10:00:00"}]
+
+    chunks, mimetype, _ = ingest.query_logs(experiment, {"format": "csv", "group": "B"})
+    rows = list(csv.DictReader(io.StringIO("".join(chunks))))
+    assert mimetype == "text/csv" and [r["user_id"] for r in rows] == ["u1", "u3", "u5"]
+    assert ingest.query_logs(experiment, {"format": "xml"})[2][1] == 400
+    assert ingest.query_logs(experiment, {"to": "soon"})[2][1] == 400
@@ -0,0 +1,78 @@
+import json
+import multiprocessing
+
+from rollups import Rollups
+from storage import CsvStore
+
+
+def seed(log_dir, barrier):
+    rollups = Rollups(log_dir)
+    barrier.wait()
+    rollups.seed(CsvStore(log_dir))
+
+
+def test_processes_starting_together_seed_once(tmp_path):
+    log_dir = str(tmp_path)
+    store = CsvStore(log_dir)
+    store.write("20250418", [{"user_id": f"u{i}", "group": "AB"[i % 2], "session_start_time": "2025-04-18T10:00:00",
+                              "session_end_time": "2025-04-18T10:05:00"} for i in range(10)])
+
+    context = multiprocessing.get_context("fork")
+    barrier = context.Barrier(4)
+    processes = [context.Process(target=seed, args=(log_dir, barrier)) for _ in range(4)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+    assert all(p.exitcode == 0 for p in processes)
+
+    rows = Rollups(log_dir).query("hour")
+    assert [(r["group"], r["sessions"]) for r in rows] == [("A", 5), ("B", 5)]
+    assert rows[0]["mean_session_time"] == 300
+
+
+def test_batch_of_a_segment_is_added_once(tmp_path):
+    rollups = Rollups(str(tmp_path))
+    records = [{"group": "A", "session_start_time": "2025-04-18T10:00:00"}]
+    rollups.add("20250418", records, "journal_1_0_000001.wal")
+    rollups.add("20250418", records, "journal_1_0_000001.wal")
+    rollups.add("20250418", records, "journal_1_0_000002.wal")
+    assert [r["sessions"] for r in rollups.query("hour")] == [2]
+
+    rollups.prune()  # neither segment is on disk any more
+    assert rollups._conn.execute("SELECT COUNT(*) FROM applied").fetchone()[0] == 0
+
+
+def test_logs_without_start_times_are_seeded_once(tmp_path):
+    store = CsvStore(str(tmp_path))
+    store.write("20250418", [{"user_id": "u0", "group": "A"}])
+    Rollups(str(tmp_path)).seed(store)
+    assert Rollups(str(tmp_path)).seeded  # not rescanned on the next start
+
+
+def test_ingested_sessions_are_rolled_up_by_minute_and_hour(ingest):
+    def session(user_id, group, start, end, clicks=0, errors=0):
+        return {"user_id": user_id, "group": group, "session_start_time": start, "session_end_time": end,
+                "apply_fe_button_clicked_count": clicks, "apply_fe_button_error_count": errors}
+
+    ingest.ingest_batch(json.dumps([
+        session("u0", "A", "2025-04-18T10:00:10", "2025-04-18T10:01:10", clicks=2),
+        session("u1", "A", "2025-04-18T10:00:50", "2025-04-18T10:03:50", errors=1),
+        session("u2", "B", "2025-04-18T10:59:00", "2025-04-18T11:00:00", clicks=1),
+        session("u3", "A", "2025-04-18T11:30:00", "2025-04-18T11:31:00"),
+    ]).encode())
+    experiment, _ = ingest.get_experiment()
+    experiment.writer.flush()
+
+    hours, code = ingest.query_rollups(experiment, {})
+    assert code == 200
+    assert [(r["time"], r["group"], r["sessions"], r["clicks"], r["errors"]) for r in hours] == [
+        ("2025-04-18T10:00:00", "A", 2, 2, 1), ("2025-04-18T10:00:00", "B", 1, 1, 0),
+        ("2025-04-18T11:00:00", "A", 1, 0, 0)]
+    assert hours[0]["mean_session_time"] == 120
+
+    minutes, _ = ingest.query_rollups(experiment, {"resolution": "minute", "group": "A",
+                                                   "from": "2025-04-18T10:00:00", "to": "2025-04-18T11:00:00"})
+    assert [(r["time"], r["sessions"]) for r in minutes] == [("2025-04-18T10:00:00", 2)]
+    assert ingest.query_rollups(experiment, {"resolution": "day"})[1] == 400
+    assert ingest.query_rollups(experiment, {"from": "yesterday"})[1] == 400
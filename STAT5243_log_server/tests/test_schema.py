@@ -0,0 +1,54 @@
+from datetime import datetime
+
+import pytest
+
+from schema import ValidationError, derive_metrics, iso_time, parse_query_time, parse_time, validate_session
+
+
+def test_query_times_are_iso_dates_not_epoch_microseconds():
+    assert parse_query_time("20250418") == datetime(2025, 4, 18)
+    assert parse_query_time("2025-04-18T10:00:00+02:00") == datetime(2025, 4, 18, 8)
+    assert parse_query_time("") is None and parse_query_time(None) is None
+    # Stored values keep the epoch µs shortcut.
+    assert parse_time("20250418") == datetime(1970, 1, 1, 0, 0, 20, 250418)
+
+
+@pytest.mark.parametrize("value", ["yesterday", "2025-13-01", "1713434400000000"])
+def test_bad_query_times_raise(value):
+    with pytest.raises(ValueError):
+        parse_query_time(value)
+
+
+def test_records_are_stored_typed():
+    record = validate_session({"user_id": "u0", "group": "A", "session_start_time": "2025-04-18T12:00:00+02:00",
+                               "apply_fe_button_clicked_count": "3", "total_session_time": 12,
+                               "has_error": "false", "operation_names": ["normalization"], "extra": "kept"})
+    assert record["session_start_time"] == 1744970400000000  # epoch µs, UTC
+    assert iso_time(record["session_start_time"]) == "2025-04-18T10:00:00"
+    assert (record["apply_fe_button_clicked_count"], record["total_session_time"]) == (3, 12.0)
+    assert record["has_error"] is False and record["extra"] == "kept"
+
+
+def test_every_bad_field_is_reported():
+    with pytest.raises(ValidationError) as e:
+        validate_session({"session_start_time": "yesterday", "revert_button_clicked_count": -1,
+                          "operation_names": "normalization"})
+    assert sorted(e.value.errors) == ["operation_names", "revert_button_clicked_count", "session_start_time",
+                                      "user_id"]
+
+
+def test_derived_metrics_follow_the_cleaning_notebook():
+    record = derive_metrics({"session_start_time": "2025-04-18T10:00:00", "session_end_time": "2025-04-18T10:02:00",
+                             "total_session_time": 999, "apply_fe_button_clicked_count": 4,
+                             "download_button_clicked_count": 2, "apply_fe_button_error_count": 1,
+                             "operation_names": ["normalize_column", "one_hot_encode", "normalize_again"]})
+    assert record["total_session_time"] == 120  # recomputed from the start and end times
+    assert (record["total_clicked_count"], record["total_error_count"]) == (6, 1)
+    assert record["total_clicked_rate"] == pytest.approx(6 / 120)
+    assert record["apply_fe_button_clicked_rate"] == pytest.approx(4 / 120)
+    assert record["revert_button_clicked_rate"] is None
+    assert (record["normalize_error_count"], record["one_hot_error_count"], record["box_cox_error_count"]) == (2, 1, 0)
+
+    # Without times the app's total_session_time is kept; a zero-length session has no rates.
+    record = derive_metrics({"total_session_time": 0, "revert_button_clicked_count": 1})
+    assert (record["total_session_time"], record["total_clicked_rate"]) == (0, None)
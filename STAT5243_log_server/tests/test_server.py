@@ -0,0 +1,114 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def client(ingest, monkeypatch):
+    import server
+
+    # Nothing is flushed in the background while a test runs.
+    monkeypatch.setattr(ingest, "FLUSH_INTERVAL", 3600)
+    return server.app.test_client()
+
+
+def session(user_id):
+    return {"user_id": user_id, "group": "A", "session_start_time": "2025-04-18T10:00:00"}
+
+
+def test_full_queue_answers_429_until_it_drains(client, ingest, monkeypatch):
+    monkeypatch.setattr(ingest, "QUEUE_DEPTH", 2)
+    experiment, _ = ingest.get_experiment()
+    # A slow disk: the writer, woken by the first 429, cannot drain the queue until released.
+    disk = threading.Event()
+    write = experiment.store.write
+    monkeypatch.setattr(experiment.store, "write", lambda key, records: disk.wait() and write(key, records))
+    assert [client.post("/log", json=session(f"u{i}")).status_code for i in range(2)] == [200, 200]
+
+    response = client.post("/log", json=session("u2"))
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == str(ingest.RETRY_AFTER)
+    assert client.post("/log/batch", json=[session("u3")]).status_code == 429
+    assert client.get("/queue").get_json() == {"depth": 2, "capacity": 2, "rejected": 2}
+    # A batch that can never fit is refused outright.
+    assert client.post("/log/batch", json=[session(f"v{i}") for i in range(3)]).status_code == 413
+
+    disk.set()
+    experiment.writer.flush()
+    # The rejected record was not claimed by the dedup index, so its retry is stored.
+    response = client.post("/log", json=session("u2"))
+    assert response.status_code == 200 and "duplicate" not in response.get_json()
+
+
+def sample(client, series):
+    """Value of one series in /metrics, 0 if it has no samples yet."""
+    for line in client.get("/metrics").get_data(as_text=True).splitlines():
+        if line.startswith(series + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0
+
+
+def test_metrics_count_requests_records_and_writes(client, ingest):
+    series = ['log_records_received_total{experiment="default",outcome="accepted"}',
+              'log_records_received_total{experiment="default",outcome="duplicate"}',
+              'log_records_written_total{experiment="default",partition="20250418"}',
+              'log_parse_failures_total{endpoint="/log",reason="body"}',
+              'log_request_duration_seconds_count{route="/log",method="POST",status="200"}']
+    before = [sample(client, s) for s in series]
+    client.post("/log", json=session("u0"))
+    client.post("/log", json=session("u0"))
+    client.post("/log", data="{", content_type="application/json")
+    ingest.get_experiment()[0].writer.flush()
+
+    response = client.get("/metrics")
+    assert response.content_type.startswith("text/plain; version=0.0.4")
+    assert "# TYPE log_flush_duration_seconds histogram" in response.get_data(as_text=True)
+    assert [sample(client, s) - b for s, b in zip(series, before)] == [1, 1, 1, 1, 2]
+    assert sample(client, "log_ingest_queue_depth") == 0
+
+
+
+def test_experiments_are_isolated(client, ingest):
+    # The same user_id is not a duplicate across experiments.
+    assert client.post("/log", json=session("u0")).get_json() == {"status": " Log saved"}
+    assert client.post("/experiments/color/log", json=session("u0")).get_json() == {"status": " Log saved"}
+    assert client.post("/log", json=dict(session("u1"), experiment="color")).status_code == 200
+    assert client.post("/experiments/color/log", json=dict(session("u2"), experiment="size")).status_code == 400
+    assert client.post("/experiments/no.dots/log", json=session("u3")).status_code == 400
+    assert client.get("/experiments/size/status").status_code == 404
+
+    for experiment in ingest.experiments.values():
+        experiment.writer.flush()
+    default, _ = ingest.get_experiment()
+    color, _ = ingest.get_experiment("color")
+    assert color.log_dir == os.path.join("logs", "experiments", "color")
+    assert list(default.store.read(default.store.partition_path("20250418"))["user_id"]) == ["u0"]
+    assert sorted(color.store.read(color.store.partition_path("20250418"))["user_id"]) == ["u0", "u1"]
+    assert client.get("/experiments").get_json() == {"color": {"partitions": 1, "rows": 2},
+                                                    "default": {"partitions": 1, "rows": 1}}
+    assert client.get("/experiments/color/status").get_json()["total_logs"] == 2
+
+
+COLD_START = """
+import json, sys
+import server
+client = server.app.test_client()
+response = client.post("/log", json={"user_id": sys.argv[1], "group": "A", "session_start_time": "2025-04-18T10:00:00"})
+status = client.get("/status").get_json()
+print(json.dumps([response.status_code, status["total_logs"], len(status["columns"]), "pandas" in sys.modules]))
+"""
+
+
+def test_light_start_serves_ingest_and_status_without_pandas(tmp_path):
+    env = dict(os.environ, LOG_LIGHT="1", PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    # Fresh interpreters: an empty log, then restarts on the existing one.
+    for i in range(3):
+        result = subprocess.run([sys.executable, "-c", COLD_START, f"u{i}"], cwd=tmp_path, env=env,
+                                capture_output=True, text=True, check=True)
+        code, total, columns, pandas = json.loads(result.stdout.splitlines()[-1])
+        assert (code, total, pandas) == (200, i + 1, False)
+        assert columns > 0
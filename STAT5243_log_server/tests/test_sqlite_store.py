@@ -0,0 +1,71 @@
+import csv
+from datetime import datetime
+
+from query import iter_range
+from sqlite_store import SqliteStore
+
+
+def test_group_counts_use_the_start_time_index(tmp_path):
+    store = SqliteStore(str(tmp_path))
+    store.write("20250418", [{"user_id": "a", "group": "A", "session_start_time": "2025-04-18T10:00:00"},
+                             {"user_id": "b", "group": "B", "session_start_time": "2025-04-19T10:00:00"}])
+    conn = store._conn()
+    with conn:
+        # A row written before schema v2, with its start time as an ISO string.
+        conn.execute('INSERT INTO sessions (partition_key, user_id, "group", session_start_time) '
+                     "VALUES ('20250418', 'c', 'A', '2025-04-18T11:00:00')")
+
+    statements = []
+    conn.set_trace_callback(statements.append)
+    assert store.group_counts(datetime(2025, 4, 18), datetime(2025, 4, 19)) == {"A": 2}
+    assert store.group_counts(start=datetime(2025, 4, 19)) == {"B": 1}
+    assert store.group_counts(end=datetime(2025, 4, 19)) == {"A": 2}
+    conn.set_trace_callback(None)
+
+    for sql in statements:
+        plan = " ".join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql))
+        assert "USING INDEX sessions_start_time" in plan and "SCAN" not in plan, plan
+
+
+def test_logs_range_uses_the_start_time_index(tmp_path):
+    store = SqliteStore(str(tmp_path))
+    store.write("20250418", [{"user_id": "a", "group": "A", "session_start_time": "2025-04-18T10:00:00"}])
+    store.write("20250419", [{"user_id": "b", "group": "B", "session_start_time": "2025-04-19T10:00:00"}])
+
+    conn = store._conn()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    chunks = list(iter_range(store, datetime(2025, 4, 19), datetime(2025, 4, 20), columns=["user_id"]))
+    conn.set_trace_callback(None)
+
+    assert [list(chunk["user_id"]) for chunk in chunks] == [["b"]]
+    (sql,) = [s for s in statements if s.startswith("SELECT")]
+    plan = " ".join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql))
+    assert "USING INDEX sessions_start_time" in plan and "SCAN" not in plan, plan
+
+
+def test_write_reports_the_bytes_of_the_rows(tmp_path):
+    store = SqliteStore(str(tmp_path))
+    records = [{"user_id": "abc", "group": "A", "session_start_time": "2025-04-18T10:00:00"}]
+    # Not the growth of the database, which is 0 or a whole page.
+    sizes = [store.write("20250418", records) for _ in range(3)]
+    assert sizes[0] >= len("20250418") + len("abc") + len("A") + 8
+    assert sizes == [sizes[0]] * 3
+
+
+def test_partition_is_exported_in_the_wide_csv_layout(tmp_path):
+    store = SqliteStore(str(tmp_path))
+    store.write("20250418", [
+        {"user_id": "u0", "group": "A", "session_start_time": "2025-04-18T10:00:00",
+         "operation_names": ["log", "sqrt"], "operation_errors": [None, "negative"]},
+        {"user_id": "u1", "group": "B", "session_start_time": "2025-04-18T11:00:00",
+         "operation_name1": "square", "operation_is_error1": ""},
+    ])
+    assert list(store.read("20250418")["user_id"]) == ["u0", "u1"]
+
+    with open(store.export_csv("20250418"), newline="") as f:
+        rows = {row["user_id"]: row for row in csv.DictReader(f)}
+    assert rows["u0"]["session_start_time"] == "2025-04-18T10:00:00"
+    assert [rows["u0"][c] for c in ("operation_name1", "operation_is_error1", "operation_name2",
+                                    "operation_is_error2")] == ["log", "", "sqrt", "negative"]
+    assert (rows["u1"]["operation_name1"], rows["u1"]["operation_name2"]) == ("square", "")
@@ -0,0 +1,130 @@
+import os
+import threading
+from datetime import datetime
+
+import pytest
+
+from manifest import Manifest, stats_of
+from schema import OPERATION_COLUMNS, SESSION_COLUMNS
+from storage import ColumnarStore, CsvStore, Retention, make_store
+
+
+def records(start, n, **extra):
+    return [dict({"user_id": f"u{i}", "group": "AB"[i % 2]}, **extra) for i in range(start, start + n)]
+
+
+def test_late_file_is_archived_next_to_the_day(tmp_path):
+    store = CsvStore(str(tmp_path))
+    path = store.partition_path("20250418")
+    store.write("20250418", records(0, 3))
+    assert store.archive(path, min_idle=0)
+
+    # Late rows with another column order and a column the archived header lacks.
+    late = [{"browser": "firefox", "group": "B", "user_id": "late0"}]
+    store.write("20250418", late)
+    assert store.archive(path, min_idle=0)
+
+    assert sorted(os.listdir(tmp_path)) == ["session_log_20250418.csv.gz", "session_log_20250418.late1.csv.gz"]
+    df = store.read(path).set_index("user_id")
+    assert list(df.index) == ["u0", "u1", "u2", "late0"]
+    assert df.loc["late0", "group"] == "B" and df.loc["late0", "browser"] == "firefox"
+    assert df.loc["u1", "group"] == "B"
+    assert store.count(path) == 4
+
+
+def test_archive_does_not_lose_concurrent_appends(tmp_path):
+    store = CsvStore(str(tmp_path))
+    path = store.partition_path("20250418")
+    done = threading.Event()
+
+    def write():
+        for i in range(200):
+            store.write("20250418", records(5 * i, 5))
+        done.set()
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    while not done.is_set():
+        store.archive(path, min_idle=0)
+    writer.join()
+    store.archive(path, min_idle=0)
+
+    assert all(f.endswith(".csv.gz") for f in store.files(path))
+    df = store.read(path)
+    assert len(df) == 1000 and df["user_id"].nunique() == 1000
+    assert store.count(path) == 1000
+
+
+def test_new_columns_start_a_wider_file(tmp_path):
+    store = CsvStore(str(tmp_path))
+    path = store.partition_path("20250418")
+    store.write("20250418", records(0, 2))
+    store.write("20250418", records(2, 2, operation_name3="normalize"))
+    store.write("20250418", records(4, 1))
+
+    assert store.files(path) == [path, path[:-len(".csv")] + ".w1.csv"]
+    df = store.read(path).set_index("user_id")
+    assert len(df) == 5
+    assert list(df["operation_name3"].fillna("")) == ["", "", "normalize", "normalize", ""]
+
+    # A new writer (e.g. after a restart) finds the wider file again instead of starting another.
+    store = CsvStore(str(tmp_path))
+    store.write("20250418", records(5, 1, operation_name3="one_hot"))
+    assert len(store.files(path)) == 2
+    assert store.count(path) == 6
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_columnar_parts_are_compacted_into_one_file(tmp_path, fmt):
+    store = ColumnarStore(str(tmp_path), fmt=fmt)
+    for i in range(3):
+        store.write("20250418", [dict(r, total_clicked_count=i) for r in records(i, 1)])
+    path = store.partition_path("20250418")
+    assert len(store.parts(path)) == 3
+
+    assert store.compact(path)
+    assert len(store.parts(path)) == 1
+    df = store.read(path, columns=["user_id", "total_clicked_count"])
+    assert list(df.columns) == ["user_id", "total_clicked_count"]
+    assert sorted(zip(df["user_id"], df["total_clicked_count"])) == [("u0", 0), ("u1", 1), ("u2", 2)]
+    assert store.count(path) == 3
+
+
+def test_normalized_layout_splits_sessions_and_operations(tmp_path):
+    store = make_store(str(tmp_path), layout="normalized")
+    store.write("20250418", [
+        {"user_id": "u0", "group": "A", "operation_name1": "normalization", "operation_is_error1": None,
+         "operation_name2": "log_transformation", "operation_is_error2": "ValueError"},
+        {"user_id": "u1", "group": "B", "operation_names": ["drop_missing"], "operation_errors": [None]},
+    ])
+    path = store.partition_path("20250418")
+
+    sessions = store.read(path)
+    assert list(sessions.columns) == SESSION_COLUMNS
+    assert list(sessions["user_id"]) == ["u0", "u1"]
+    operations = store.read_operations(path)
+    assert list(operations.columns) == OPERATION_COLUMNS
+    assert [tuple(row) for row in operations[["session_id", "seq", "op_name"]].itertuples(index=False)] == [
+        ("u0", 1, "normalization"), ("u0", 2, "log_transformation"), ("u1", 1, "drop_missing")]
+    assert list(operations["error"].fillna("")) == ["", "ValueError", ""]
+
+
+def test_retention_archives_old_days_and_drops_expired_ones(tmp_path):
+    store, manifest = CsvStore(str(tmp_path)), Manifest(str(tmp_path))
+    for day in ("20250401", "20250410", "20250415", "20250416"):
+        store.write(day, records(0, 3))
+        manifest.add(day, stats_of(records(0, 3)))
+        for f in store.files(store.partition_path(day)):
+            os.utime(f, (0, 0))  # idle long enough to be archived
+
+    retention = Retention(store, compress_after_days=2, keep_days=10, manifest=manifest)
+    assert retention.run_once(now=datetime(2025, 4, 16, 12)) == (1, 1)
+
+    assert [store.key_of(p) for p in store.partitions()] == ["20250410", "20250415", "20250416"]
+    assert sorted(manifest.entries()) == ["20250410", "20250415", "20250416"]
+    archived = store.partition_path("20250410")
+    assert [f.endswith(".gz") for f in store.files(archived)] == [True]
+    assert manifest.get("20250410")["bytes"] == os.path.getsize(store.files(archived)[0])
+    # Archived partitions read like the others.
+    assert list(store.read(archived)["user_id"]) == ["u0", "u1", "u2"]
+    assert not any(f.endswith(".gz") for f in store.files(store.partition_path("20250415")))
@@ -0,0 +1,164 @@
+import glob
+import multiprocessing
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from rollups import Rollups
+import writer as writer_module
+from metrics import LATE_RECORDS
+from storage import CsvStore
+from writer import LogWriter
+
+
+def session(user_id, start, **extra):
+    return dict({"user_id": user_id, "group": "A", "session_start_time": start}, **extra)
+
+
+def test_late_records_for_an_archived_day(tmp_path):
+    store = CsvStore(str(tmp_path))
+    writer = LogWriter(str(tmp_path), store, flush_interval=3600)
+    path = store.partition_path("20250418")
+    writer.append_many([session("u0", "2025-04-18T10:00:00"), session("u1", "2025-04-18T23:59:00")])
+    writer.flush()
+    assert store.archive(path, min_idle=0)
+
+    # A retry a day late, with its fields in another order and one the archived header lacks.
+    writer.append({"browser": "firefox", "session_start_time": "2025-04-18T12:00:00", "user_id": "late0"})
+    writer.flush()
+    writer.close()
+    # Read back before and after the late file is archived.
+    for _ in range(2):
+        df = store.read(path).set_index("user_id")
+        assert sorted(df.index) == ["late0", "u0", "u1"]
+        assert df.loc["late0", "browser"] == "firefox" and df.loc["u0", "group"] == "A"
+        store.archive(path, min_idle=0)
+    assert all(f.endswith(".gz") for f in store.files(path))
+
+
+def test_records_are_partitioned_by_session_start_in_utc(tmp_path):
+    store = CsvStore(str(tmp_path))
+    writer = LogWriter(str(tmp_path), store, flush_interval=3600)
+    now = datetime(2025, 4, 19, 12, 0)
+    assert writer.partition_of(session("u0", "2025-04-18T23:30:00"), now) == "20250418"
+    assert writer.partition_of(session("u1", "2025-04-18T23:30:00-02:00"), now) == "20250419"
+    # No usable start time, or one too far ahead of the clock: filed by arrival.
+    assert writer.partition_of(session("u2", "not a time"), now) == "20250419"
+    assert writer.partition_of(session("u3", "2025-04-21T00:00:00"), now) == "20250419"
+    writer.close()
+
+
+def test_records_for_past_partitions_are_counted_late(tmp_path):
+    writer = LogWriter(str(tmp_path), CsvStore(str(tmp_path)), flush_interval=3600, experiment="late")
+    today = datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+    writer.append_many([session("u0", "2025-04-18T10:00:00"), session("u1", "2025-04-17T10:00:00"),
+                        session("u2", today)])
+    writer.close()
+    assert 'log_late_records_total{experiment="late"} 2' in LATE_RECORDS.collect()
+
+
+def crash_after_journaling(log_dir, records):
+    writer = LogWriter(log_dir, CsvStore(log_dir), flush_interval=3600)
+    writer.append_many(records)
+    os._exit(0)  # killed before the background writer flushed
+
+
+def test_journal_is_replayed_after_a_crash(tmp_path):
+    log_dir = str(tmp_path)
+    records = [session(f"u{i}", "2025-04-18T10:00:00") for i in range(3)]
+    process = multiprocessing.get_context("fork").Process(target=crash_after_journaling, args=(log_dir, records))
+    process.start()
+    process.join()
+    (journal,) = glob.glob(os.path.join(log_dir, "journal_*.wal"))
+    with open(journal, "a") as f:
+        f.write('["20250418", {"user_id": "torn')  # a write cut off by the crash
+
+    store = CsvStore(log_dir)
+    writer = LogWriter(log_dir, store, flush_interval=3600)
+    writer.close()
+    assert not glob.glob(os.path.join(log_dir, "journal_*"))
+    df = store.read(store.partition_path("20250418"))
+    assert sorted(df["user_id"]) == ["u0", "u1", "u2"]
+
+
+class FlakyStore(CsvStore):
+    """Fails the first write to one partition."""
+
+    def __init__(self, log_dir, failing_key):
+        super().__init__(log_dir)
+        self.failing_key = failing_key
+
+    def write(self, key, records):
+        if key == self.failing_key:
+            self.failing_key = None
+            raise OSError("disk full")
+        return super().write(key, records)
+
+
+class BrokenIndex:
+    def add(self, key, records, segment):
+        raise RuntimeError("database is locked")
+
+
+def test_failed_partition_is_retried_without_rewriting_the_others(tmp_path):
+    log_dir = str(tmp_path)
+    store = FlakyStore(log_dir, "20250419")
+    writer = LogWriter(log_dir, store, flush_interval=3600, indexes=[BrokenIndex()])
+    writer.append_many([session("u0", "2025-04-18T10:00:00"), session("u1", "2025-04-19T10:00:00")])
+
+    assert writer.flush() == 1
+    assert writer.depth() == 1
+    assert writer.flush() == 1
+    writer.close()
+    for key, user_id in (("20250418", "u0"), ("20250419", "u1")):
+        assert list(store.read(store.partition_path(key))["user_id"]) == [user_id]
+    assert not glob.glob(os.path.join(log_dir, "journal_*"))
+
+
+def crash_before_removing_the_segment(log_dir, records):
+    writer = LogWriter(log_dir, CsvStore(log_dir), flush_interval=3600, indexes=[Rollups(log_dir)])
+    writer.append_many(records)
+    os.remove = lambda path: os._exit(0)  # killed after the write, with the segment still on disk
+    writer.flush()
+
+
+def test_replayed_segment_is_not_counted_twice_in_the_rollups(tmp_path):
+    log_dir = str(tmp_path)
+    records = [session(f"u{i}", "2025-04-18T10:00:00") for i in range(3)]
+    process = multiprocessing.get_context("fork").Process(target=crash_before_removing_the_segment,
+                                                          args=(log_dir, records))
+    process.start()
+    process.join()
+    store = CsvStore(log_dir)
+    assert len(store.read(store.partition_path("20250418"))) == 3
+
+    rollups = Rollups(log_dir)
+    LogWriter(log_dir, store, flush_interval=3600, indexes=[rollups]).close()
+    # The raw rows are written again; the counters are not.
+    assert len(store.read(store.partition_path("20250418"))) == 6
+    assert [r["sessions"] for r in rollups.query("hour")] == [3]
+
+
+def test_appends_wait_for_one_shared_journal_sync(tmp_path, monkeypatch):
+    synced = []
+
+    def slow_fdatasync(fd):
+        time.sleep(0.05)
+        synced.append(fd)
+
+    monkeypatch.setattr(writer_module, "_fdatasync", slow_fdatasync)
+    writer = LogWriter(str(tmp_path), CsvStore(str(tmp_path)), flush_interval=3600)
+    writer.append(session("u0", "2025-04-18T10:00:00"))
+    assert len(synced) == 1
+
+    threads = [threading.Thread(target=writer.append, args=(session(f"u{i}", "2025-04-18T10:00:00"),))
+               for i in range(1, 9)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # The appends that queued up behind the first sync are covered by one more.
+    assert 2 <= len(synced) <= 3
+    assert writer._synced == writer._appended == 9
+    writer.close()
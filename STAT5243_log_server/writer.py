@@ -0,0 +1,323 @@
+"""Group-commit writer for the log server.
+
+Every POST used to build a one-row DataFrame and append it to the daily CSV.
+Here a request only appends one line to a write-ahead journal and queues the
+record in memory; a background thread drains the queue in batches, writes
+each batch to its log partition and fsyncs once per batch. Journal segments left
+behind by a crash are replayed into the log files on startup.
+
+The journal is fdatasynced before append returns, so an acknowledged record
+survives a power loss as well as a process crash. Requests that append at the
+same time share one sync (group commit). With ``sync_journal=False`` the
+journal only lives in the page cache until its batch is committed, which
+covers process crashes only.
+
+Records are partitioned by event time: each goes to the partition of its
+``session_start_time`` (in UTC), so a session that ends after midnight or a
+retry that arrives a day late still lands next to its peers. Only records
+without a usable start time are filed by arrival time. Where a partition
+lives on disk is decided by the store (see storage.py).
+"""
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from manifest import stats_of
+from metrics import BYTES_WRITTEN, FLUSH_DURATION, LATE_RECORDS, RECORDS_WRITTEN
+from schema import parse_time
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; recovery then skips the lock check
+    fcntl = None
+
+_fdatasync = getattr(os, "fdatasync", os.fsync)  # not on macOS
+
+logger = logging.getLogger(__name__)
+
+# Start times further ahead of the server clock come from a skewed client clock;
+# such records are filed by arrival time rather than opening a future partition.
+MAX_CLOCK_SKEW = timedelta(hours=1)
+
+
+class QueueFull(Exception):
+    """Raised by append when the records would exceed the queue capacity."""
+
+
+class LogWriter:
+    def __init__(self, log_dir, store, batch_size=500, flush_interval=1.0, max_pending=None, manifest=None,
+                 experiment="default", indexes=(), sync_journal=True):
+        self.log_dir = log_dir
+        self.store = store
+        # Aggregates kept next to the partitions (sketches.py, rollups.py): each
+        # one's add(key, records, segment) is called after every write, with the
+        # name of the journal segment the records came from, so that one that is
+        # not idempotent can recognize a segment replayed after a crash.
+        self.indexes = list(indexes)
+        # Label of this writer's series in /metrics.
+        self.experiment = experiment
+        # Partition manifest (see manifest.py) updated after every write, if given.
+        self.manifest = manifest
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # Bound on queued, not yet committed records; None means unbounded.
+        self.max_pending = max_pending
+        self.sync_journal = sync_journal
+        self.rejected = 0
+
+        self._lock = threading.Lock()        # guards the journal and the pending list
+        self._flush_lock = threading.Lock()  # one flush at a time
+        self._sync_lock = threading.Lock()   # one journal sync at a time; taken before _lock
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._pending = []
+        self._in_flight = 0  # records of the batch being written by flush
+        self._listeners = []
+        self._appended = 0  # journal appends so far ...
+        self._synced = 0    # ... and how many of them are known to be on disk
+        self._segment = 0
+        # Segment names must not repeat when a later process gets the same pid.
+        self._token = f"{time.time_ns():x}"
+        self._journal_fd = None
+        self._journal_path = None
+
+        os.makedirs(log_dir, exist_ok=True)
+        # Our own segment first: recover() requeues what it cannot write into it.
+        self._open_journal()
+        self.recover()
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def subscribe(self, listener):
+        """Call ``listener(key, records)`` for every accepted batch, at ingest time."""
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def append(self, record):
+        """Journal and queue one record; the write to storage happens later."""
+        self.append_many([record])
+
+    def append_many(self, records):
+        """Journal and queue several records with a single journal write.
+
+        Raises QueueFull, without queuing anything, when the queue has no room.
+        """
+        if not records:
+            return
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        arrival_key = self.store.partition_key(now)
+        entries = [(self.partition_of(record, now), record) for record in records]
+        data = "".join(json.dumps(entry, default=str) + "\n" for entry in entries).encode("utf-8")
+        with self._lock:
+            queued = len(self._pending) + self._in_flight
+            if self.max_pending is not None and queued + len(entries) > self.max_pending:
+                self.rejected += len(entries)
+                self._wake.set()
+                raise QueueFull(f"{queued} records already queued")
+            _write_all(self._journal_fd, data)
+            self._appended += 1
+            appended = self._appended
+            self._pending.extend(entries)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wake.set()
+        if self.sync_journal:
+            self._sync(appended)
+
+        by_key = {}
+        for key, record in entries:
+            by_key.setdefault(key, []).append(record)
+        late = sum(len(group) for key, group in by_key.items() if key < arrival_key)
+        if late:
+            LATE_RECORDS.inc(late, experiment=self.experiment)
+        for listener in self._listeners:
+            for key, group in by_key.items():
+                try:
+                    listener(key, group)
+                except Exception as e:
+                    # The records are already journaled; a failing listener must not fail the request.
+                    logger.exception(" Log listener failed: %s", e)
+
+    def partition_of(self, record, now):
+        """Partition key of a record: the day (or hour) its session started, in UTC."""
+        started = parse_time(record.get("session_start_time")) if isinstance(record, dict) else None
+        if started is None or started > now + MAX_CLOCK_SKEW:
+            started = now
+        return self.store.partition_key(started)
+
+    def depth(self):
+        """Number of queued records not yet committed to storage."""
+        with self._lock:
+            return len(self._pending) + self._in_flight
+
+    def flush(self):
+        """Commit everything queued so far. Returns the number of records written."""
+        with self._flush_lock:
+            with self._sync_lock:
+                with self._lock:
+                    if not self._pending:
+                        return 0
+                    batch, self._pending = self._pending, []
+                    self._in_flight = len(batch)
+                    old_fd, old_path = self._journal_fd, self._journal_path
+                    self._open_journal()
+                    appended = self._appended
+                # Appends still waiting for a sync of the old segment would otherwise sync the new one.
+                if self.sync_journal and self._synced < appended:
+                    _fdatasync(old_fd)
+                    self._synced = appended
+
+            started = time.perf_counter()
+            try:
+                failed = self._write_batch(batch, os.path.basename(old_path))
+                FLUSH_DURATION.observe(time.perf_counter() - started)
+                # Partitions that could not be written are retried by the next flush.
+                self._requeue(failed)
+            except Exception:
+                # Keep the segment on disk; the next startup replays it.
+                os.close(old_fd)
+                raise
+            finally:
+                with self._lock:
+                    self._in_flight = 0
+            # The batch is durable in the partitions or journaled again, so its segment can go.
+            os.close(old_fd)
+            os.remove(old_path)
+            return len(batch) - len(failed)
+
+    def _sync(self, appended):
+        """Wait until journal append number ``appended`` is on disk.
+
+        Appends that arrive while a sync runs are all covered by the next one.
+        """
+        with self._sync_lock:
+            if self._synced >= appended:
+                return
+            with self._lock:
+                if self._journal_fd is None:
+                    return
+                fd, upto = os.dup(self._journal_fd), self._appended
+            try:
+                _fdatasync(fd)
+            finally:
+                os.close(fd)
+            self._synced = upto
+
+    def close(self):
+        if self._journal_fd is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        self.flush()
+        with self._lock:
+            os.close(self._journal_fd)
+            os.remove(self._journal_path)
+            self._journal_fd = None
+
+    def recover(self):
+        """Replay journal segments that no live writer holds."""
+        recovered = 0
+        for path in sorted(glob.glob(os.path.join(self.log_dir, "journal_*.wal"))):
+            fd = os.open(path, os.O_RDWR)
+            try:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        continue  # still owned by a running writer
+                batch = []
+                with os.fdopen(os.dup(fd), "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            key, record = json.loads(line)
+                        except ValueError:
+                            break  # torn write at the end of the segment
+                        batch.append((key, record))
+                if batch:
+                    failed = self._write_batch(batch, os.path.basename(path))
+                    self._requeue(failed)
+                    recovered += len(batch) - len(failed)
+                os.remove(path)
+            finally:
+                os.close(fd)
+        if recovered:
+            logger.info(" Recovered %d log records from journal", recovered)
+        return recovered
+
+    def _open_journal(self):
+        self._segment += 1
+        path = os.path.join(self.log_dir, f"journal_{os.getpid()}_{self._token}_{self._segment:06d}.wal")
+        # Created under another name and locked before recover() in another worker can see it;
+        # otherwise that worker could take the lock first and remove the segment.
+        fd = os.open(path + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        os.rename(path + ".tmp", path)
+        self._journal_fd, self._journal_path = fd, path
+
+    def _requeue(self, entries):
+        """Put entries back at the head of the queue, journaled in the current segment."""
+        if not entries:
+            return
+        data = "".join(json.dumps(entry, default=str) + "\n" for entry in entries).encode("utf-8")
+        with self._lock:
+            _write_all(self._journal_fd, data)
+            self._pending[:0] = entries
+
+    def _write_batch(self, batch, segment):
+        """Write a batch to its partitions. Returns the entries of the partitions that failed.
+
+        The manifest and the indexes are only updated once every partition
+        has been written, and a failure there is logged, not raised: the
+        records are stored, and replaying the batch would duplicate them.
+        """
+        by_key = {}
+        for key, record in batch:
+            by_key.setdefault(key, []).append(record)
+
+        written, failed = {}, []
+        for key, records in by_key.items():
+            try:
+                written[key] = self.store.write(key, records)
+            except Exception as e:
+                logger.exception(" Writing %d records to partition %s failed: %s", len(records), key, e)
+                failed.extend((key, record) for record in records)
+
+        for key, size in written.items():
+            records = by_key[key]
+            RECORDS_WRITTEN.inc(len(records), experiment=self.experiment, partition=key)
+            if size:
+                BYTES_WRITTEN.inc(size, experiment=self.experiment, partition=key)
+            updates = [(index.add, (key, records, segment)) for index in self.indexes]
+            if self.manifest is not None:
+                updates.insert(0, (self.manifest.add, (key, stats_of(records, size))))
+            for update, args in updates:
+                try:
+                    update(*args)
+                except Exception as e:
+                    logger.exception(" Updating %s for partition %s failed: %s",
+                                     type(update.__self__).__name__, key, e)
+        return failed
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception(" Log flush failed: %s", e)
+
+
+def _write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
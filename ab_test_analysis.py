@@ -3,6 +3,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 from scipy import stats
+import glob
 import os
 import warnings
 warnings.filterwarnings('ignore')
@@ -18,6 +19,35 @@ results_dir = 'AB_Test_Results/'
 if not os.path.exists(results_dir):
     os.makedirs(results_dir)
 
+# Function to load only the needed columns from a CSV, Parquet or Arrow file, a log
+# partition folder of Parquet/Arrow parts (logs/session_log_20250418/) or a glob of files
+def load_data(path, columns=None):
+    if os.path.isdir(path):
+        files = sorted(glob.glob(os.path.join(path, '*.parquet')) + glob.glob(os.path.join(path, '*.arrow')))
+    else:
+        files = sorted(glob.glob(path))
+    if not files:
+        raise FileNotFoundError(f"No data files found at {path}")
+    frames = [load_file(f, columns) for f in files]
+    return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+def load_file(file_path, columns=None):
+    if file_path.endswith(('.parquet', '.arrow', '.feather')):
+        import pyarrow as pa
+        import pyarrow.feather as feather
+        import pyarrow.parquet as pq
+
+        parquet = file_path.endswith('.parquet')
+        if columns is not None:
+            # Parts written at different times may not all have every column
+            names = pq.read_schema(file_path).names if parquet else pa.ipc.open_file(file_path).schema.names
+            columns = [c for c in columns if c in names]
+        table = pq.read_table(file_path, columns=columns) if parquet else feather.read_table(file_path, columns=columns)
+        return table.to_pandas()
+    if columns is None:
+        return pd.read_csv(file_path)
+    return pd.read_csv(file_path, usecols=lambda c: c in set(columns))
+
 # Function to check normality
 def check_normality(data, group_col, metric_col):
     group1 = data[data[group_col] == data[group_col].unique()[0]][metric_col]
@@ -278,23 +308,11 @@ def create_aggregated_comparison_plot(data, metrics):
     plt.close(fig)
 
 # Main analysis function
-def analyze_ab_test():
+def analyze_ab_test(data_path='ab_test_log_step3_cleaned.csv'):
     print("Starting AB Test Analysis...")
     print("===========================\n")
     
     try:
-        # Load the dataset - Updated file path
-        print("Loading data from: ab_test_log_step3_cleaned.csv")
-        data = pd.read_csv('ab_test_log_step3_cleaned.csv')
-        
-        print("\nData loaded successfully!")
-        print(f"Dataset shape: {data.shape}")
-        print("\nFirst few rows:")
-        print(data.head())
-        
-        print("\nData columns:")
-        print(data.columns.tolist())
-        
         # Check if the required columns exist
         required_metrics = [
             'group', 
@@ -305,6 +323,18 @@ def analyze_ab_test():
             'total_error_rate'
         ]
         
+        # Load the dataset - only the columns used by the analysis are read
+        print(f"Loading data from: {data_path}")
+        data = load_data(data_path, columns=required_metrics)
+        
+        print("\nData loaded successfully!")
+        print(f"Dataset shape: {data.shape}")
+        print("\nFirst few rows:")
+        print(data.head())
+        
+        print("\nData columns:")
+        print(data.columns.tolist())
+        
         missing_cols = [col for col in required_metrics if col not in data.columns]
         
         if missing_cols:
@@ -404,4 +434,5 @@ def analyze_ab_test():
         print(f"Error in analysis: {str(e)}")
 
 if __name__ == "__main__":
-    analyze_ab_test() 
\ No newline at end of file
+    import sys
+    analyze_ab_test(*sys.argv[1:2]) 
\ No newline at end of file